@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+bench_backend.py
+
+Compare the parse and serialize latency of the stdlib and lxml xml backends
+for schema 1 and schema 2 swinstall_stacks, reporting the speedup of lxml.
+"""
+import argparse
+import xml.etree.ElementTree as ET
+
+import common
+from swinstall_stack import backend
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if lxml_etree is None:
+        print "lxml is not installed. reporting the stdlib backend only"
+    for schema in ("1", "2"):
+        for entries in args.entries:
+            print "schema {} {} entries".format(schema, entries)
+            data = common.stack_xml("/tmp/bak/stack/stack_swinstall_stack", entries, schema)
+            stdlib_root = ET.fromstring(data)
+            results = {}
+            results["parse"] = [common.timed(lambda: ET.fromstring(data), args.repeat)]
+            results["serialize"] = [common.timed(
+                lambda: backend._serialize_minidom(stdlib_root), args.repeat)]
+            if lxml_etree is not None:
+                lxml_root = lxml_etree.fromstring(data, backend._PARSER)
+                results["parse"].append(common.timed(
+                    lambda: lxml_etree.fromstring(data, backend._PARSER), args.repeat))
+                results["serialize"].append(common.timed(
+                    lambda: backend._serialize_lxml(lxml_root), args.repeat))
+            for operation in ("parse", "serialize"):
+                timings = results[operation]
+                common.report("  {} stdlib".format(operation), *timings[0])
+                if len(timings) > 1:
+                    common.report("  {} lxml".format(operation), *timings[1],
+                                  extra="{:.1f}x".format(timings[0][0] / timings[1][0]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+bench_cache.py
+
+Compare SwinstallStackMgr.parse reading swinstall_stacks from disk against
+parsing them through a warm local disk cache.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+import common
+from swinstall_stack.cache import StackCache
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    import_schemas()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = StackCache(os.path.join(tmpdir, "cache"))
+        for schema in ("1", "2"):
+            for entries in args.entries:
+                print "schema {} {} entries".format(schema, entries)
+                versionless = common.make_stack(tmpdir, "stack_{}_{}".format(schema, entries),
+                                                entries, schema)
+                uncached = SwinstallStackMgr()
+                uncached.cache = None
+                cached = SwinstallStackMgr(cache)
+                cached.parse(versionless)
+                baseline, mean = common.timed(lambda: uncached.parse(versionless), args.repeat)
+                common.report("  parse", baseline, mean)
+                best, mean = common.timed(lambda: cached.parse(versionless), args.repeat)
+                common.report("  parse cached", best, mean,
+                              "{:>5.1f}x".format(baseline / best))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+bench_columnar.py
+
+Compare the parse throughput and memory per entry of the ElementTree and
+columnar representations of swinstall_stacks, along with the latency of
+common queries against each.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+
+import common
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+import_schemas()
+
+def deep_size(obj, seen=None):
+    """Approximate the number of bytes held by obj and everything it references,
+    counting shared objects (such as interned strings) once."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen)
+                    for key, value in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif ET.iselement(obj):
+        size += deep_size(obj.tag, seen) + deep_size(obj.attrib, seen)
+        size += sum(deep_size(child, seen) for child in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mgr = SwinstallStackMgr()
+        for schema in ("1", "2"):
+            for entries in args.entries:
+                print "schema {} {} entries".format(schema, entries)
+                versionless = common.make_stack(tmpdir, "stack_{}_{}".format(schema, entries),
+                                                entries, schema)
+                tree = mgr.parse(versionless)
+                columns = mgr.parse_columns(versionless)
+                for label, parse, result in (("elementtree", mgr.parse, tree.root),
+                                             ("columnar", mgr.parse_columns, columns.columns)):
+                    best, mean = common.timed(lambda: parse(versionless), args.repeat)
+                    common.report("  parse {}".format(label), best, mean,
+                                  "{:>8.0f} entries/s {:>6.0f} bytes/entry"\
+                                  .format(entries / best, float(deep_size(result)) / entries))
+                target = "20100101-120000"
+                for label, instance in (("elementtree", tree), ("columnar", columns)):
+                    best, mean = common.timed(lambda: instance.file_on(target), args.repeat)
+                    common.report("  file_on {}".format(label), best, mean)
+                    best, mean = common.timed(lambda: list(instance.history()), args.repeat)
+                    common.report("  history {}".format(label), best, mean)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+bench_compression.py
+
+Compare the read latency of plain and compressed swinstall_stack files, and
+the on disk size of each format.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+import common
+from swinstall_stack.compression import CODECS, read_stack
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+import_schemas()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mgr = SwinstallStackMgr()
+        for entries in args.entries:
+            print "{} entries".format(entries)
+            for codec in (None,) + CODECS:
+                name = "stack_{}_{}".format(entries, codec or "plain")
+                versionless = common.make_stack(tmpdir, name, entries, codec=codec)
+                swinstall_stack = mgr._swinstall_stack_from_file(versionless)
+                size = os.path.getsize(swinstall_stack)
+                best, mean = common.timed(lambda: read_stack(swinstall_stack), args.repeat)
+                common.report("  read {}".format(codec or "plain"), best, mean,
+                              "{:>10} bytes".format(size))
+                best, mean = common.timed(lambda: mgr.parse(versionless), args.repeat)
+                common.report("  parse {}".format(codec or "plain"), best, mean)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+common.py
+
+Helpers shared by the benchmark scripts.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+def add_src_to_syspath():
+    """helper function to update syspath"""
+    from os.path import realpath as real
+    from os.path import dirname as cdu
+    api_dir = cdu(cdu(real(__file__)))
+    if api_dir not in sys.path:
+        sys.path.append(api_dir)
+
+add_src_to_syspath()
+
+from swinstall_stack.compression import compress
+from swinstall_stack.constants import DATETIME_FORMAT
+
+STACK_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+def stack_xml(swinstall_stack, entries, schema="2"):
+    """Generate the xml for a swinstall_stack with the supplied number of entries.
+
+    :param swinstall_stack: full path recorded in the root element
+    :type swinstall_stack: str
+    :param entries: number of entries in the stack
+    :type entries: int
+    :param schema: schema version of the stack ("1" or "2")
+    :type schema: str
+
+    :returns: xml document
+    :rtype: str
+    """
+    start = datetime(2010, 1, 1)
+    lines = [STACK_HEADER]
+    if schema == "1":
+        lines.append('<stack_history path="{}">'.format(swinstall_stack))
+        for index in range(entries):
+            version = (start + timedelta(minutes=index)).strftime(DATETIME_FORMAT)
+            lines.append('   <elt is_current="{}" version="{}"/>'\
+                         .format(index == entries - 1, version))
+    else:
+        lines.append('<stack_history path="{}" schema="2">'.format(swinstall_stack))
+        for index in range(entries, 0, -1):
+            date_time = (start + timedelta(minutes=index)).strftime(DATETIME_FORMAT)
+            lines.append('   <elt action="install" datetime="{}" hash="{:032x}" version="{}"/>'\
+                         .format(date_time, index * 2654435761, index))
+    lines.append("</stack_history>")
+    return os.linesep.join(lines)
+
+def make_stack(directory, name, entries, schema="2", codec=None):
+    """Create a swinstall_stack for the versionless file directory/name.
+
+    :returns: full path to the versionless file
+    :rtype: str
+    """
+    bak = os.path.join(directory, "bak", name)
+    if not os.path.isdir(bak):
+        os.makedirs(bak)
+    swinstall_stack = os.path.join(bak, "{}_swinstall_stack".format(name))
+    with open(swinstall_stack, "wb") as filehandle:
+        filehandle.write(compress(stack_xml(swinstall_stack, entries, schema), codec))
+    return os.path.join(directory, name)
+
+def timed(func, repeat=5):
+    """Call func repeat times, returning the best and mean wall clock time in seconds.
+
+    :rtype: tuple(float, float)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return (min(times), sum(times) / len(times))
+
+def report(label, best, mean, extra=""):
+    """Print a row of benchmark output"""
+    print "{:<36} best {:>9.3f} ms  mean {:>9.3f} ms  {}"\
+          .format(label, best * 1000, mean * 1000, extra)
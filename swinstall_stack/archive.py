@@ -0,0 +1,72 @@
+"""
+archive.py
+
+Reading and writing of compressed archive segments, which hold the older
+history of a swinstall_stack once it has been compacted.
+"""
+
+import logging
+import os
+import tempfile
+from .backend import fromstring, tostring
+from .compression import GZIP, compress, read_stack
+
+__all__ = ("segment_path", "read_segment", "write_segment")
+
+LOG = logging.getLogger(__name__)
+
+def segment_path(swinstall_stack, index):
+    """Given the full path to a swinstall_stack and a segment index, return
+    the full path to the archive segment.
+
+    :param swinstall_stack: full path to the swinstall_stack file
+    :type swinstall_stack: str
+    :param index: index of the segment. Segment 1 holds the oldest entries.
+    :type index: int
+
+    :returns: full path to the archive segment
+    :rtype: str
+    """
+    return "{}.{}.gz".format(swinstall_stack, index)
+
+def read_segment(path):
+    """Read and parse an archive segment.
+
+    :param path: full path to the archive segment
+    :type path: str
+
+    :returns: root element of the segment
+    :rtype: ElementTree.Element
+
+    :raises: IOError if the segment does not exist
+    """
+    LOG.debug("paging in archive segment %s", path)
+    return fromstring(read_stack(path)[0])
+
+def write_segment(path, root, replace=False):
+    """Write an archive segment. The segment is written to a temporary file
+    in the same directory and renamed into place, so a segment is either
+    complete or absent.
+
+    :param path: full path to the archive segment
+    :type path: str
+    :param root: root element of the segment
+    :type root: ElementTree.Element
+    :param replace: whether to replace an existing segment, whose history
+                    has been edited
+    :type replace: bool
+
+    :raises: IOError if the segment already exists and replace is False
+    """
+    if not replace and os.path.exists(path):
+        raise IOError("archive segment {} already exists".format(path))
+    dirname = os.path.dirname(path)
+    handle, tmp_path = tempfile.mkstemp(prefix=".segment", dir=dirname)
+    try:
+        with os.fdopen(handle, "wb") as filehandle:
+            filehandle.write(compress(tostring(root, encoding="UTF-8"), GZIP))
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,125 @@
+"""
+backend.py
+
+Selection of the xml library used to parse and serialize swinstall_stacks.
+lxml is used when it is installed, as its parser and serializer are
+implemented in C. Otherwise the stdlib ElementTree is used. Both backends
+serialize stacks identically.
+"""
+
+import logging
+import os
+import xml.etree.ElementTree as _stdlib
+from xml.dom import minidom
+
+__all__ = ("BACKEND", "Element", "SubElement", "attrib_iterparse", "fromstring", "iselement",
+           "iterparse", "serialize", "tostring")
+
+LOG = logging.getLogger(__name__)
+
+LXML = "lxml"
+STDLIB = "stdlib"
+
+# environment variable used to force the stdlib backend
+BACKEND_ENV = "SWINSTALL_STACK_XML_BACKEND"
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+try:
+    if os.environ.get(BACKEND_ENV, LXML) != LXML:
+        raise ImportError("{} backend requested".format(os.environ[BACKEND_ENV]))
+    from lxml import etree as _lxml
+except ImportError:
+    _lxml = None
+
+BACKEND = LXML if _lxml is not None else STDLIB
+
+if _lxml is not None:
+    # stdlib ElementTree drops comments and processing instructions when parsing
+    _PARSER = _lxml.XMLParser(remove_comments=True, remove_pis=True)
+
+    Element = _lxml.Element
+    SubElement = _lxml.SubElement
+    iselement = _lxml.iselement
+    iterparse = _lxml.iterparse
+
+    def fromstring(data):
+        """Parse an xml document, returning its root element."""
+        return _lxml.fromstring(data, _PARSER)
+
+    def tostring(root, encoding="UTF-8"):
+        """Serialize an element, without pretty printing."""
+        return _lxml.tostring(root, encoding=encoding)
+else:
+    Element = _stdlib.Element
+    SubElement = _stdlib.SubElement
+    iselement = _stdlib.iselement
+    iterparse = _stdlib.iterparse
+    fromstring = _stdlib.fromstring
+    tostring = _stdlib.tostring
+
+if _lxml is not None:
+    attrib_iterparse = iterparse
+else:
+    # readers which only take attributes from the elements may use the faster
+    # C ElementTree, even though its elements cannot be mixed with those of
+    # the backend
+    try:
+        from xml.etree.cElementTree import iterparse as attrib_iterparse
+    except ImportError:
+        attrib_iterparse = iterparse
+
+def _serialize_minidom(root):
+    """Pretty print root through minidom. This defines the format of stacks on disk."""
+    xmlstr = minidom.parseString(_stdlib.tostring(root))\
+        .toprettyxml(indent="   ", encoding='UTF-8')
+    return os.linesep.join([s for s in xmlstr.splitlines() if s.strip()])
+
+def _serialize_lxml(root):
+    """Pretty print an lxml root in the format written by _serialize_minidom.
+
+    :returns: xml document, or None if the tree holds text or attribute values
+              which lxml escapes differently from minidom
+    :rtype: str | None
+    """
+    for elt in root.iter():
+        if (elt.text and elt.text.strip()) or (elt.tail and elt.tail.strip()):
+            return None
+        # lxml only pretty prints elements which are not separated by whitespace
+        elt.text = None
+        if elt is not root:
+            elt.tail = None
+        # minidom writes attributes sorted by name, lxml in insertion order
+        items = elt.items()
+        ordered = sorted(items)
+        if items != ordered:
+            elt.attrib.clear()
+            for name, value in ordered:
+                elt.set(name, value)
+        for _, value in ordered:
+            if "\n" in value or "\r" in value or "\t" in value:
+                return None
+    lines = [_XML_DECLARATION]
+    for line in _lxml.tostring(root, pretty_print=True, encoding="UTF-8").splitlines():
+        # lxml indents by two spaces per level, minidom by three
+        stripped = line.lstrip(" ")
+        lines.append(" " * ((len(line) - len(stripped)) // 2 * 3) + stripped)
+    return os.linesep.join(lines)
+
+def serialize(root):
+    """Serialize the root element of a swinstall_stack to the pretty printed
+    xml which is written to disk.
+
+    :param root: root element of the stack
+    :type root: Element
+
+    :returns: xml document
+    :rtype: str
+    """
+    if _lxml is not None and isinstance(root, _lxml._Element):
+        xmlstr = _serialize_lxml(root)
+        if xmlstr is not None:
+            return xmlstr
+        LOG.debug("serializing %s through minidom", root.attrib.get("path"))
+        root = _stdlib.fromstring(_lxml.tostring(root))
+    return _serialize_minidom(root)
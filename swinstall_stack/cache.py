@@ -0,0 +1,308 @@
+"""
+cache.py
+
+Persistent cache of parsed swinstall_stacks on local disk. With the stdlib
+xml backend, each entry holds the attributes of a stack's root element and
+of each of its elements, serialized with marshal, which rebuild the tree
+faster than the stdlib parser. lxml parses faster than the tree can be
+rebuilt from python, so with lxml entries hold the uncompressed xml
+instead. Entries are keyed by the path of the stack together with the token
+of the file it was read from. A saved stack is renamed into place, so its
+token changes and stale entries are never returned.
+"""
+
+import errno
+import hashlib
+import logging
+import marshal
+import os
+import tempfile
+import time
+from .backend import BACKEND, LXML, Element, SubElement, fromstring, tostring
+from .constants import ELEM
+
+__all__ = ("NegativeCache", "StackCache", "default_cache_dir")
+
+LOG = logging.getLogger(__name__)
+
+# environment variables used to configure the site cache
+CACHE_ENV = "SWINSTALL_STACK_CACHE"
+CACHE_SIZE_ENV = "SWINSTALL_STACK_CACHE_SIZE"
+MISSING_TTL_ENV = "SWINSTALL_STACK_MISSING_TTL"
+
+_FORMAT = 1
+_SUFFIX = ".stack"
+_TMP_SUFFIX = ".tmp"
+# temporary files older than this are left over from crashed writers
+_TMP_MAX_AGE = 3600
+
+def default_cache_dir():
+    """Return the default cache directory, under $XDG_CACHE_HOME.
+
+    :rtype: str
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "swinstall_stack")
+
+
+class StackCache(object):
+    """Cache of parsed swinstall_stacks on local disk, bounded in size by
+    evicting the least recently used entries. Entries are written to a
+    temporary file and renamed into place, so any number of processes may
+    share the cache. An entry which cannot be read is treated as a miss.
+    """
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        """Initialize the cache.
+
+        :param directory: cache directory. Defaults to default_cache_dir()
+        :type directory: str | None
+        :param max_size: size in bytes above which entries are evicted
+        :type max_size: int
+        """
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+        # estimate of the size of the cache, refreshed whenever it is evicted
+        self._size = None
+
+    def __repr__(self):
+        return "StackCache <directory:{} max_size:{}>".format(self.directory, self.max_size)
+
+    @classmethod
+    def from_environment(cls, environ=None):
+        """Construct the cache configured by SWINSTALL_STACK_CACHE, which names the
+        cache directory, or is "1" for the default directory, and
+        SWINSTALL_STACK_CACHE_SIZE, in bytes.
+
+        :param environ: mapping to read the configuration from. Defaults to os.environ
+        :type environ: dict
+
+        :returns: the configured cache, or None if caching is not enabled
+        :rtype: StackCache | None
+        """
+        environ = os.environ if environ is None else environ
+        directory = environ.get(CACHE_ENV)
+        if not directory or directory == "0":
+            return None
+        return cls(None if directory == "1" else directory,
+                   int(environ.get(CACHE_SIZE_ENV, cls.DEFAULT_MAX_SIZE)))
+
+    def _entry_path(self, swinstall_stack):
+        return os.path.join(self.directory,
+                            hashlib.sha1(swinstall_stack).hexdigest() + _SUFFIX)
+
+    def get(self, swinstall_stack, token):
+        """Return the parsed stack cached for the file identified by token.
+
+        :param swinstall_stack: full path to the swinstall_stack file
+        :type swinstall_stack: str
+        :param token: token of the swinstall_stack file
+        :type token: concurrency.StackToken
+
+        :returns: root element and compression codec of the stack, or None
+                  on a miss
+        :rtype: tuple(Element, str | None) | None
+        """
+        path = self._entry_path(swinstall_stack)
+        try:
+            with open(path, "rb") as filehandle:
+                entry = marshal.loads(filehandle.read())
+            version, backend, stack, entry_token, codec, payload = entry
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                LOG.debug("unable to read cache entry %s: %s", path, err)
+            return None
+        except (EOFError, ValueError, TypeError) as err:
+            LOG.debug("discarding corrupt cache entry %s: %s", path, err)
+            return None
+        if version != _FORMAT or backend != BACKEND or stack != swinstall_stack or \
+           entry_token != tuple(token):
+            return None
+        try:
+            # the modification time of an entry records when it was last used
+            os.utime(path, None)
+        except OSError:
+            pass
+        if BACKEND == LXML:
+            return (fromstring(payload), codec)
+        tag, attrib, entries = payload
+        root = Element(tag, attrib)
+        for attrib in entries:
+            SubElement(root, ELEM, attrib)
+        return (root, codec)
+
+    def put(self, swinstall_stack, token, codec, root):
+        """Cache a parsed stack. Stacks holding anything other than a flat list of
+        elt elements are not cached.
+
+        :param swinstall_stack: full path to the swinstall_stack file
+        :type swinstall_stack: str
+        :param token: token of the file the stack was parsed from
+        :type token: concurrency.StackToken
+        :param codec: compression codec of the file
+        :type codec: str | None
+        :param root: root element of the stack
+        :type root: Element
+
+        :returns: whether the stack was cached
+        :rtype: bool
+        """
+        for elt in root:
+            if elt.tag != ELEM or len(elt) or (elt.text and elt.text.strip()):
+                return False
+        if BACKEND == LXML:
+            payload = tostring(root)
+        else:
+            payload = (root.tag, dict(root.attrib), [dict(elt.attrib) for elt in root])
+        data = marshal.dumps((_FORMAT, BACKEND, swinstall_stack, tuple(token), codec, payload), 2)
+        try:
+            if not os.path.isdir(self.directory):
+                try:
+                    os.makedirs(self.directory)
+                except OSError as err:
+                    if err.errno != errno.EEXIST:
+                        raise
+            handle, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=_TMP_SUFFIX)
+            try:
+                # not synced: an entry torn by a crash fails to load and is a miss
+                with os.fdopen(handle, "wb") as filehandle:
+                    filehandle.write(data)
+                os.rename(tmp_path, self._entry_path(swinstall_stack))
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except (IOError, OSError) as err:
+            LOG.debug("unable to cache %s: %s", swinstall_stack, err)
+            return False
+        if self._size is not None:
+            self._size += len(data)
+        if self._size is None or self._size > self.max_size:
+            self.evict()
+        return True
+
+    def _entries(self):
+        """Return the modification time, size and path of each entry."""
+        entries = []
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if name.endswith(_TMP_SUFFIX):
+                    if now - stat.st_mtime > _TMP_MAX_AGE:
+                        os.remove(path)
+                elif name.endswith(_SUFFIX):
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                # removed by another process
+                pass
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the cache holds no more
+        than max_size bytes.
+
+        :returns: number of entries removed
+        :rtype: int
+        """
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            size -= entry_size
+        self._size = size
+        if removed:
+            LOG.debug("evicted %s entries from %s", removed, self.directory)
+        return removed
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0
+
+
+class NegativeCache(object):
+    """In memory cache of swinstall_stacks found not to exist, so that repeated
+    probes for files which have not been swinstalled do not each cost a round
+    trip to the file server. Paths are forgotten after ttl seconds.
+    """
+    DEFAULT_TTL = 5.0
+    MAX_ENTRIES = 65536
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+        """Initialize the cache.
+
+        :param ttl: seconds for which a missing path is remembered. A ttl of 0
+                    disables the cache
+        :type ttl: float
+        :param max_entries: number of paths above which expired paths are pruned
+        :type max_entries: int
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._expiry = {}
+
+    def __repr__(self):
+        return "NegativeCache <ttl:{} entries:{}>".format(self.ttl, len(self._expiry))
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def __contains__(self, path):
+        expiry = self._expiry.get(path)
+        if expiry is None:
+            return False
+        if expiry < time.time():
+            self._expiry.pop(path, None)
+            return False
+        return True
+
+    @classmethod
+    def from_environment(cls, environ=None):
+        """Construct the cache with the ttl in SWINSTALL_STACK_MISSING_TTL, in seconds.
+
+        :param environ: mapping to read the configuration from. Defaults to os.environ
+        :type environ: dict
+
+        :rtype: NegativeCache
+        """
+        environ = os.environ if environ is None else environ
+        return cls(float(environ.get(MISSING_TTL_ENV, cls.DEFAULT_TTL)))
+
+    def add(self, path):
+        """Remember that path does not exist."""
+        if self.ttl <= 0:
+            return
+        if len(self._expiry) >= self.max_entries:
+            self.prune()
+        self._expiry[path] = time.time() + self.ttl
+
+    def discard(self, path):
+        """Forget path, as it may now exist."""
+        self._expiry.pop(path, None)
+
+    def prune(self):
+        """Forget expired paths, or every path if none have expired."""
+        now = time.time()
+        expiry = dict((path, when) for path, when in self._expiry.items() if when >= now)
+        self._expiry = expiry if len(expiry) < self.max_entries else {}
+
+    def clear(self):
+        """Forget every path."""
+        self._expiry = {}
@@ -0,0 +1,410 @@
+"""
+columnar.py
+
+Columnar, read only representation of swinstall_stacks. Rather than a tree
+of ElementTree nodes, each holding its own attribute dictionary, the entries
+of a stack are held in parallel arrays populated by a single iterparse pass.
+"""
+
+from array import array
+from cStringIO import StringIO
+from datetime import datetime
+import logging
+import os
+from . import backend
+from .archive import segment_path
+from .compression import read_stack
+from .constants import ACTIONS, DEFAULT_SCHEMA, ELEM
+from .metrics import LOOKUPS, counted
+from .schemas.base.schema import SchemaBase, SchemaCommon
+from .schemas.schema1.file_metadata import FileMetadata as FileMetadata1
+from .schemas.schema2.file_metadata import FileMetadata as FileMetadata2
+from .utils import (bisect_descending, datetime_from_str, datetime_revision_from_str,
+                    epoch_from_datetime, epoch_from_str, epoch_to_str)
+
+__all__ = ("ColumnarSchema1", "ColumnarSchema2", "StackColumns", "parse_columns")
+
+LOG = logging.getLogger(__name__)
+
+class StackColumns(object):
+    """The entries of a swinstall_stack, in document order, as parallel columns.
+    Epochs, versions and action codes are held in arrays, while hashes and
+    revisions are interned so that repeated values share a single string.
+    """
+    def __init__(self):
+        self.attrib = {}
+        self.epochs = array("l")
+        self.versions = array("l")
+        self.actions = array("b")
+        self.hashes = []
+        self.revisions = []
+        # index of the entry flagged is_current, for schema 1 stacks
+        self.current_index = None
+        self.action_names = list(ACTIONS)
+        self._action_codes = dict((action, code) for code, action in enumerate(ACTIONS))
+
+    def __len__(self):
+        return len(self.epochs)
+
+    @classmethod
+    def from_xml(cls, data):
+        """Populate the columns from the xml contents of a stack, in a single
+        iterparse pass, using a C accelerated parser where available.
+        Each element is discarded once it has been read.
+
+        :param data: xml contents of the stack
+        :type data: str
+
+        :returns: columns of the stack
+        :rtype: StackColumns
+        """
+        columns = cls()
+        root = None
+        for event, elt in backend.attrib_iterparse(StringIO(data), events=("start", "end")):
+            if root is None:
+                root = elt
+                columns.attrib = dict(elt.attrib)
+            elif event == "end" and elt.tag == ELEM:
+                columns.append(elt.attrib)
+                root.clear()
+        return columns
+
+    @classmethod
+    def load(cls, path):
+        """Read the columns of the stack file at path, transparently decompressing it.
+
+        :param path: full path to the swinstall_stack or archive segment
+        :type path: str
+
+        :returns: columns of the stack
+        :rtype: StackColumns
+        """
+        return cls.from_xml(read_stack(path)[0])
+
+    def _action_code(self, action):
+        """Return the code of an action, allocating one for unknown actions."""
+        code = self._action_codes.get(action)
+        if code is None:
+            code = self._action_codes[action] = len(self.action_names)
+            self.action_names.append(action)
+        return code
+
+    def append(self, attrib):
+        """Append an entry to the columns.
+
+        :param attrib: attributes of the entry's element
+        :type attrib: dict
+        """
+        revision = attrib.get("revision")
+        if "datetime" in attrib:
+            self.epochs.append(epoch_from_str(attrib["datetime"]))
+            self.versions.append(int(attrib["version"]))
+        else:
+            # schema 1 entries are versioned by datetime and revision
+            datetime_str, _, revision = attrib["version"].partition("_")
+            revision = revision or None
+            self.epochs.append(epoch_from_str(datetime_str))
+            self.versions.append(0)
+            if attrib.get("is_current") == "True":
+                self.current_index = len(self.epochs) - 1
+        self.actions.append(self._action_code(attrib.get("action", ACTIONS[0])))
+        self.hashes.append(intern(attrib["hash"]) if "hash" in attrib else None)
+        self.revisions.append(intern(revision) if revision is not None else None)
+
+    def action(self, index):
+        """Return the name of the action of the entry at index."""
+        return self.action_names[self.actions[index]]
+
+    def datetime(self, index):
+        """Return the datetime of the entry at index."""
+        return datetime.utcfromtimestamp(self.epochs[index])
+
+
+class _ColumnarSchema(SchemaBase):
+    """Read only schema answering queries from StackColumns. Methods which
+    modify the stack are not implemented; use SwinstallStackMgr.parse for those.
+    """
+    schema_version = None
+
+    def __init__(self, columns, codec=None):
+        """
+        :param columns: columns of the live stack
+        :type columns: StackColumns
+        :param codec: compression codec the stack was read with, if any
+        :type codec: str | None
+        """
+        schema_version = columns.attrib.get("schema", DEFAULT_SCHEMA)
+        if schema_version != self.schema_version:
+            raise ValueError("wrong schema version {} for class: {} schema:{}"\
+            .format(schema_version, self.__class__.__name__, self.schema_version))
+        self.columns = columns
+        self._codec = codec
+        self._swinstall_stack = columns.attrib.get("path")
+
+    @property
+    def swinstall_stack(self):
+        """The full path to the swinstall_stack file."""
+        return self._swinstall_stack
+
+    @property
+    def codec(self):
+        """The compression codec the stack is stored with."""
+        return self._codec
+
+    def root_dirname(self):
+        """Return the directory name of the root path."""
+        return os.path.dirname(self._swinstall_stack)
+
+    def versionless_filename(self):
+        """Return the versionless name of the swinstalled file"""
+        return os.path.basename(self.root_dirname())
+
+    _history_bounds = staticmethod(SchemaCommon._history_bounds)
+
+
+class ColumnarSchema1(_ColumnarSchema):
+    """Read only Schema1 backed by columns. Entries are held oldest first."""
+    schema_version = "1"
+
+    def _versioned_file(self, index):
+        revision = self.columns.revisions[index]
+        return os.path.join(self.root_dirname(), "{}_{}{}".format(
+            self.versionless_filename(), epoch_to_str(self.columns.epochs[index]),
+            "" if revision is None else "_{}".format(revision)))
+
+    def _metadata(self, index, is_current):
+        return FileMetadata1(self._versioned_file(index), is_current,
+                             self.columns.datetime(index), self.columns.revisions[index])
+
+    def _current_index(self):
+        current = self.columns.attrib.get("current")
+        if current is not None:
+            date_time, revision = datetime_revision_from_str(current)
+            epoch = epoch_from_datetime(date_time)
+            for index in xrange(len(self.columns) - 1, -1, -1):
+                if self.columns.epochs[index] == epoch and \
+                   self.columns.revisions[index] == revision:
+                    return index
+        if self.columns.current_index is None:
+            raise ValueError("Unable to find current")
+        return self.columns.current_index
+
+    @counted(LOOKUPS, method="current")
+    def current(self):
+        """Return metadata corresponding with the current file in the swinstall stack."""
+        return self._metadata(self._current_index(), "True")
+
+    def current_version(self):
+        """Return the current version number.
+
+        :rtype: datetime
+        """
+        try:
+            return self.columns.datetime(self._current_index())
+        except ValueError:
+            raise ValueError("No current version")
+
+    @counted(LOOKUPS, method="version")
+    def version(self, version):
+        """retrieve metadata for the swinstalled file entry with the supplied version.
+
+        :param version: version of interest
+        :type version: datetime or str
+
+        :raises: KeyError if version does not match any versions
+        """
+        version = datetime_from_str(version) if isinstance(version, basestring) else version
+        try:
+            index = self.columns.epochs.index(epoch_from_datetime(version))
+        except ValueError:
+            raise KeyError("no version: {} has been published".format(version))
+        return self._metadata(index, "True" if index == self.columns.current_index else "False")
+
+    @counted(LOOKUPS, method="file_on")
+    def file_on(self, date_time):
+        """Retrieve the versioned file corresponding to the specified date. See
+        Schema1.file_on
+
+        :raises: LookupError - If date_time is invalid
+        """
+        date_time = datetime_from_str(date_time) if isinstance(date_time, basestring) else date_time
+        target = epoch_from_datetime(date_time)
+        epochs = self.columns.epochs
+        current = self.columns.current_index
+        latest = None
+        for index in xrange(len(epochs)):
+            if epochs[index] > target:
+                if latest is None:
+                    raise LookupError("no version less than or equal to {}"\
+                                      .format(epoch_to_str(target)))
+                return self._metadata(latest, "False")
+            latest = index
+            if index == current:
+                return self._metadata(latest, "True")
+        raise LookupError("no version less than or equal to {}".format(epoch_to_str(target)))
+
+    def history(self, start=None, end=None, actions=None):
+        """Generate metadata for the entries in the stack, newest first. See
+        Schema1.history
+        """
+        if actions is not None and ACTIONS[0] not in actions:
+            return
+        start, end = self._history_bounds(start, end)
+        epochs = self.columns.epochs
+        last = len(epochs) - 1
+        current = self.columns.current_index
+        for index in xrange(bisect_descending(last + 1, lambda i: epochs[last - i], end),
+                            last + 1):
+            if epochs[last - index] < start:
+                return
+            yield self._metadata(last - index, "True" if last - index == current else "False")
+
+
+class ColumnarSchema2(_ColumnarSchema):
+    """Read only Schema2 backed by columns. Entries are held newest first, and
+    archive segments are read into columns of their own when a query reaches
+    them.
+    """
+    schema_version = "2"
+
+    def __init__(self, columns, codec=None):
+        super(ColumnarSchema2, self).__init__(columns, codec)
+        self._segment_columns = {}
+
+    def segment_count(self):
+        """Return the number of archive segments holding compacted history."""
+        return int(self.columns.attrib.get("segments", 0))
+
+    def _segment(self, index):
+        if index not in self._segment_columns:
+            self._segment_columns[index] = StackColumns.load(
+                segment_path(self._swinstall_stack, index))
+        return self._segment_columns[index]
+
+    def _column_sequences(self, since=None):
+        """Iterate over the live columns followed by those of each archive
+        segment, newest first. See Schema2._element_sequences
+        """
+        yield self.columns
+        archived_until = self.columns.attrib.get("archived_until")
+        if since is not None and archived_until is not None and \
+           epoch_from_str(archived_until) < since:
+            return
+        for index in range(self.segment_count(), 0, -1):
+            yield self._segment(index)
+
+    def _versioned_file(self, version):
+        return os.path.join(self.root_dirname(),
+                            "{}_{}".format(self.versionless_filename(), version))
+
+    def _metadata(self, columns, index):
+        version = columns.versions[index]
+        return FileMetadata2(self._versioned_file(version), columns.action(index), version,
+                             columns.datetime(index), columns.hashes[index],
+                             columns.revisions[index])
+
+    @counted(LOOKUPS, method="current")
+    def current(self):
+        """Return the current file_metadata metadata.
+
+        :raises: LookupError if nothing has been installed
+        """
+        if not len(self.columns):
+            raise LookupError("{} has no entries".format(self.swinstall_stack))
+        return self._metadata(self.columns, 0)
+
+    def current_version(self):
+        """Returns the current version number.
+
+        :rtype: int
+        """
+        current = self.columns.attrib.get("current")
+        if current is not None:
+            return int(current)
+        return self.columns.versions[0]
+
+    def next_version(self):
+        """Returns the next version number after the highest installed one.
+
+        :rtype: int
+        """
+        if not len(self.columns):
+            return 1
+        max_version = self.columns.attrib.get("max_version")
+        if max_version is not None:
+            return int(max_version) + 1
+        for columns in self._column_sequences():
+            for index in xrange(len(columns)):
+                if columns.actions[index] == 0:
+                    return columns.versions[index] + 1
+        raise RuntimeError("unable to find next version")
+
+    @counted(LOOKUPS, method="version")
+    def version(self, version):
+        """retrieve the metadata of the most recent entry with the version passed in
+
+        :raises KeyError: if the version passed in does not exist
+        """
+        for columns in self._column_sequences():
+            try:
+                return self._metadata(columns, columns.versions.index(int(version)))
+            except ValueError:
+                pass
+        raise KeyError("no version: {} has been published".format(version))
+
+    @counted(LOOKUPS, method="file_on")
+    def file_on(self, date_time):
+        """Given a datetime instance, find the most recent action which is less than or
+        equal to the datetime.
+
+        :raises LookupError: If unable to find an entry which is less than or equal to the
+                             supplied datetime instance"""
+        datetime_val = datetime_from_str(date_time) \
+                        if isinstance(date_time, basestring) else date_time
+        target = epoch_from_datetime(datetime_val)
+        for columns in self._column_sequences():
+            epochs = columns.epochs
+            index = bisect_descending(len(epochs), epochs.__getitem__, target)
+            if index < len(epochs):
+                return self._metadata(columns, index)
+        raise LookupError("unable to find version of {} installed on or before {}"\
+                          .format(self.versionless_filename(), date_time))
+
+    def history(self, start=None, end=None, actions=None):
+        """Generate metadata for the entries in the stack, newest first. See
+        Schema2.history
+        """
+        start, end = self._history_bounds(start, end)
+        for columns in self._column_sequences(start):
+            epochs = columns.epochs
+            for index in xrange(bisect_descending(len(epochs), epochs.__getitem__, end),
+                                len(epochs)):
+                if epochs[index] < start:
+                    return
+                if actions is None or columns.action(index) in actions:
+                    yield self._metadata(columns, index)
+
+
+_COLUMNAR_SCHEMAS = {
+    ColumnarSchema1.schema_version: ColumnarSchema1,
+    ColumnarSchema2.schema_version: ColumnarSchema2
+}
+
+def parse_columns(swinstall_stack):
+    """Read a swinstall_stack into columns, returning the read only schema
+    matching its schema version.
+
+    :param swinstall_stack: full path to the swinstall_stack file
+    :type swinstall_stack: str
+
+    :returns: read only schema
+    :rtype: ColumnarSchema1 | ColumnarSchema2
+
+    :raises: KeyError if the schema version is not supported
+    """
+    data, codec = read_stack(swinstall_stack)
+    columns = StackColumns.from_xml(data)
+    schema_version = columns.attrib.get("schema", DEFAULT_SCHEMA)
+    if schema_version not in _COLUMNAR_SCHEMAS:
+        raise KeyError("no columnar schema for schema version: {}".format(schema_version))
+    return _COLUMNAR_SCHEMAS[schema_version](columns, codec)
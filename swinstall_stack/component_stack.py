@@ -0,0 +1,430 @@
+"""
+component_stack.py
+
+Compact in memory model of a schema 2 swinstall_stack. The history is held
+in parallel arrays rather than as ElementTree nodes, and the current version
+is tracked by an integer cursor into the stack of installed versions. The
+history of a compacted stack is read from its archive segments as well, and
+archived entries are written back to the segment they came from.
+"""
+
+from array import array
+import copy
+from datetime import datetime
+import errno
+import logging
+import os
+from cStringIO import StringIO
+from .archive import read_segment, segment_path, write_segment
+from .backend import Element, SubElement, attrib_iterparse, serialize
+from .compression import compress, site_policy
+from .concurrency import (GENERATION, ConcurrentModificationError, StackToken,
+                          atomic_write, read_stack_token, stack_lock, stat_token)
+from .constants import ELEM
+from .utils import epoch_from_datetime, epoch_from_str, epoch_to_str
+
+__all__ = ("ComponentStack", "StackView")
+
+LOG = logging.getLogger(__name__)
+
+# root attributes describing the stack, rather than the entries written with it
+_CURRENT = "current"
+_MAX_VERSION = "max_version"
+_SEGMENTS = "segments"
+
+INSTALL = "install"
+ROLLBACK = "rollback"
+ROLLFORWARD = "rollforward"
+# action codes stored in the history, indexed by code
+ACTIONS = (INSTALL, ROLLBACK, ROLLFORWARD)
+_ACTION_CODES = dict((action, code) for code, action in enumerate(ACTIONS))
+
+def _parse_attributes(data):
+    """Read the attributes of the root element of a stack and of each of its
+    entries, in document order, in a single iterparse pass. Each element is
+    discarded once its attributes have been copied.
+
+    :param data: xml contents of the stack
+    :type data: str
+
+    :returns: attributes of the root element, and of each entry
+    :rtype: tuple(dict, list(dict))
+    """
+    root = None
+    root_attrib = {}
+    elements = []
+    for event, elt in attrib_iterparse(StringIO(data), events=("start", "end")):
+        if root is None:
+            root = elt
+            # clearing the root below also clears its attributes
+            root_attrib = dict(elt.attrib)
+        elif event == "end" and elt.tag == ELEM:
+            elements.append(dict(elt.attrib))
+            root.clear()
+    return (root_attrib, elements)
+
+class StackView(object):
+    """Read only view over a slice of the versions in a ComponentStack. Creating
+    a view is O(1); versions are only read from the stack when accessed.
+    """
+    def __init__(self, versions, start, stop, step=1):
+        self._versions = versions
+        self._range = xrange(start, stop, step)
+
+    def __len__(self):
+        return len(self._range)
+
+    def __iter__(self):
+        versions = self._versions
+        for index in self._range:
+            yield versions[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        return self._versions[self._range[index]]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "StackView <{}>".format(list(self))
+
+
+class ComponentStack(object):
+    """Stack of the versions installed for a component, with a cursor pointing
+    at the current version. Every cursor move is recorded in the history as a
+    rollback or rollforward entry, so that the stack may be saved back to the
+    schema 2 swinstall_stack it was loaded from.
+    """
+    def __init__(self, path, component_name):
+        """
+        :param path: path to component_swinstall_stack
+        :param component_name: versionless component name
+        """
+        self.file_path = path
+        self.component_name = component_name
+        self.timestamp = None
+        self._codec = None
+        self._generation = None
+        self._clear()
+        self.reloadFile()
+
+    def _clear(self):
+        """reset the stack and its history to empty"""
+        # history, oldest entry first. one entry per element in the swinstall_stack
+        self._log_versions = array("l")
+        self._log_epochs = array("l")
+        self._log_actions = array("b")
+        self._log_hashes = []
+        self._log_revisions = []
+        # archive segment holding each entry, 0 for the live stack, and the
+        # segments which must be rewritten as entries have been removed from them
+        self._log_segments = array("l")
+        self._dirty_segments = set()
+        # root attributes as loaded, and the highest version ever installed
+        # according to the header, which may exceed those left in the stack
+        self._attrib = {}
+        self._max_version = None
+        # stack of installed versions, with the index of the history entry
+        # recording each install
+        self._versions = array("l")
+        self._installs = array("l")
+        self._cursor = -1
+
+    def __copy__(self):
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        for name in ("_log_versions", "_log_epochs", "_log_actions", "_log_hashes",
+                     "_log_revisions", "_log_segments", "_dirty_segments", "_attrib",
+                     "_versions", "_installs"):
+            setattr(new, name, copy.copy(getattr(self, name)))
+        return new
+
+    def __deepcopy__(self, memo):
+        # the instance only holds immutable values in its containers, so a
+        # copy of the containers is as deep as a copy needs to be
+        new = self.__copy__()
+        memo[id(self)] = new
+        return new
+
+    def __len__(self):
+        return len(self._versions)
+
+    def getStack(self):
+        """return current stack"""
+        return StackView(self._versions, 0, len(self._versions))
+
+    def getStackLength(self):
+        """return size of stack"""
+        return len(self._versions)
+
+    def getCurrent(self):
+        """return current version from stack, or None if the stack is empty"""
+        if self._cursor < 0:
+            return None
+        return self._versions[self._cursor]
+
+    def getCurrentIndex(self):
+        """return the index of the current version within the stack"""
+        return self._cursor
+
+    def __getitem__(self, index):
+        """used for getting pars of the stack. either individual elements or ranges"""
+        if isinstance(index, slice):
+            return StackView(self._versions, *index.indices(len(self._versions)))
+        return self._versions[index]
+
+    def _log(self, action, install_index, date_time=None):
+        """Append an entry to the history for the install at install_index"""
+        self._log_versions.append(self._log_versions[install_index])
+        self._log_epochs.append(epoch_from_datetime(date_time or datetime.now()))
+        self._log_actions.append(_ACTION_CODES[action])
+        self._log_hashes.append(self._log_hashes[install_index])
+        self._log_revisions.append(self._log_revisions[install_index])
+        self._log_segments.append(0)
+
+    def setCurrentIndex(self, index, date_time=None):
+        """set the current index of the stack. does not error check"""
+        if index == self._cursor:
+            return
+        action = ROLLBACK if index < self._cursor else ROLLFORWARD
+        self._cursor = index
+        self._log(action, self._installs[index], date_time)
+
+    def pushVersion(self, version, hash_str, date_time=None, revision=None):
+        """put a new version on top of the stack, and make it current
+
+        :param version: the version number
+        :type version: int
+        :param hash_str: hash of the contents of the version
+        :type hash_str: str
+        :param date_time: time of the install. defaults to now
+        :type date_time: datetime
+        :param revision: optional scm revision
+        :type revision: str
+        """
+        self._log_versions.append(version)
+        self._log_epochs.append(epoch_from_datetime(date_time or datetime.now()))
+        self._log_actions.append(_ACTION_CODES[INSTALL])
+        self._log_hashes.append(intern(hash_str))
+        self._log_revisions.append(revision)
+        self._log_segments.append(0)
+        if self._max_version is None or version > self._max_version:
+            self._max_version = version
+        # the stack is in install order, as recorded in the history, so the
+        # new version goes on top whatever the current version was
+        self._versions.append(version)
+        self._installs.append(len(self._log_versions) - 1)
+        self._cursor = len(self._versions) - 1
+
+    def _highest_version(self):
+        """return the highest version ever installed, or 0"""
+        return max([self._max_version or 0] + list(self._versions))
+
+    def nextVersionNumber(self):
+        """return the version number the next pushed version should carry. Versions
+        removed from the stack are not reused"""
+        return self._highest_version() + 1
+
+    def _filter(self, removed):
+        """Drop every version in removed from the stack and the history. Each
+        array is rebuilt exactly once.
+
+        :param removed: versions to remove
+        :type removed: set(int)
+        """
+        keep = [index for index, version in enumerate(self._log_versions)
+                if version not in removed]
+        remap = dict((old, new) for new, old in enumerate(keep))
+        self._dirty_segments.update(segment for version, segment
+                                    in zip(self._log_versions, self._log_segments)
+                                    if segment and version in removed)
+        self._log_versions = array("l", [self._log_versions[i] for i in keep])
+        self._log_epochs = array("l", [self._log_epochs[i] for i in keep])
+        self._log_actions = array("b", [self._log_actions[i] for i in keep])
+        self._log_hashes = [self._log_hashes[i] for i in keep]
+        self._log_revisions = [self._log_revisions[i] for i in keep]
+        self._log_segments = array("l", [self._log_segments[i] for i in keep])
+
+        current = self.getCurrent()
+        stack = [(version, remap[install])
+                 for version, install in zip(self._versions, self._installs)
+                 if version not in removed]
+        self._versions = array("l", [version for version, _ in stack])
+        self._installs = array("l", [install for _, install in stack])
+        self._cursor = self._versions.index(current) if current is not None else -1
+
+    def clearRedo(self):
+        """remove all versions past the current one"""
+        removed = set(self._versions[self._cursor + 1:])
+        if removed:
+            self._filter(removed)
+
+    def filterVersion(self, version):
+        """remove all occuarnces of a version. If athat is the current one,
+        raises a RuntimeError"""
+        if version == self.getCurrent():
+            raise RuntimeError("Cannot filter current version {}".format(version))
+        if version in self._versions:
+            self._filter(set([version]))
+
+    def previousVersion(self, count=1):
+        """return the version count versions before the current one
+
+        :raises: IndexError if that is before the first version
+        """
+        index = self._cursor - count
+        if index < 0:
+            raise IndexError("no version {} before the current version".format(count))
+        return self._versions[index]
+
+    def nextVersion(self, count=1):
+        """get the version count versions past the current index. returns the last version
+        if we encounter an IndexError"""
+        index = min(self._cursor + count, len(self._versions) - 1)
+        return self._versions[index]
+
+    def rollBack(self, count=1, date_time=None):
+        """Roll the current back count elements. If it hits the first element, sets
+        current to first element and raises a RuntimeError."""
+        index = self._cursor - count
+        self.setCurrentIndex(max(index, 0), date_time)
+        if index < 0:
+            raise RuntimeError("Rolled back to the first version of {}"\
+                               .format(self.component_name))
+
+    def rollForward(self, count=1, date_time=None):
+        """roll the current forward count elements. If that is past the last element,
+        sets current to last element and raises a RuntimeError"""
+        index = self._cursor + count
+        last = len(self._versions) - 1
+        self.setCurrentIndex(min(index, last), date_time)
+        if index > last:
+            raise RuntimeError("Rolled forward to the last version of {}"\
+                               .format(self.component_name))
+
+    def _entry(self, index):
+        """Return the attributes of the element of the history entry at index"""
+        attrib = {
+            "action": ACTIONS[self._log_actions[index]],
+            "version": str(self._log_versions[index]),
+            "datetime": epoch_to_str(self._log_epochs[index]),
+            "hash": self._log_hashes[index]
+        }
+        if self._log_revisions[index]:
+            attrib["revision"] = self._log_revisions[index]
+        return attrib
+
+    def _root(self):
+        """Build the root element of the schema 2 swinstall_stack, newest entry
+        first. Archived entries are left to their segments, and the root
+        attributes loaded with the stack are kept"""
+        attrib = dict(self._attrib)
+        attrib.update({"path": self.file_path, "schema": "2",
+                       GENERATION: str((self._generation or 0) + 1)})
+        if self._cursor >= 0:
+            attrib[_CURRENT] = str(self.getCurrent())
+        else:
+            attrib.pop(_CURRENT, None)
+        max_version = self._highest_version()
+        if max_version:
+            attrib[_MAX_VERSION] = str(max_version)
+        root = Element("stack_history", attrib=attrib)
+        for index in xrange(len(self._log_versions) - 1, -1, -1):
+            if not self._log_segments[index]:
+                SubElement(root, ELEM, attrib=self._entry(index))
+        return root
+
+    def _write_segment(self, segment):
+        """Rewrite an archive segment from the entries left in it"""
+        root = Element("stack_history", attrib={"path": self.file_path, "schema": "2",
+                                                "segment": str(segment)})
+        for index in xrange(len(self._log_versions) - 1, -1, -1):
+            if self._log_segments[index] == segment:
+                SubElement(root, ELEM, attrib=self._entry(index))
+        write_segment(segment_path(self.file_path, segment), root, replace=True)
+
+    def saveFile(self):
+        """save the file. Compares the token of the file on disk with the one recorded
+        when it was loaded before saving. If the file on disk has changed, raises a
+        ConcurrentModificationError"""
+        if self.timestamp is None:
+            if stat_token(self.file_path) is not None:
+                raise ConcurrentModificationError("File {} has changed. Cannot save data"\
+                                                  .format(self.file_path))
+            self.timestamp = self._write()
+            return
+        with stack_lock(self.file_path) as filehandle:
+            if StackToken.from_stat(os.fstat(filehandle.fileno())) != self.timestamp:
+                raise ConcurrentModificationError("File {} has changed. Cannot save data"\
+                                                  .format(self.file_path))
+            self.timestamp = self._write()
+
+    def _write(self):
+        """write the stack to disk, returning the token of the new file. Edited
+        archive segments are written first, so that the live stack never
+        refers to entries which are missing from them"""
+        for segment in sorted(self._dirty_segments):
+            self._write_segment(segment)
+        self._dirty_segments = set()
+        xmlstr = serialize(self._root())
+        self._codec = site_policy().codec_for(xmlstr, self._codec)
+        token = atomic_write(self.file_path, compress(xmlstr, self._codec))
+        self._generation = (self._generation or 0) + 1
+        return token
+
+    def reloadFile(self):
+        """Load the file. If the file doesn't exist, set everything to empty and store
+        file's time stamp for later checking"""
+        self._clear()
+        try:
+            data, self._codec, self.timestamp = read_stack_token(self.file_path)
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            LOG.debug("%s does not exist. starting with an empty stack", self.file_path)
+            self.timestamp = None
+            self._generation = None
+            return
+        root_attrib, elements = _parse_attributes(data)
+        self._attrib = root_attrib
+        generation = root_attrib.get(GENERATION)
+        self._generation = int(generation) if generation is not None else None
+        max_version = root_attrib.get(_MAX_VERSION)
+        self._max_version = int(max_version) if max_version is not None else None
+        # the history, newest first: the live entries, followed by those of
+        # each archive segment, newest segment first
+        sources = [(0, elements)]
+        for segment in xrange(int(root_attrib.get(_SEGMENTS, 0)), 0, -1):
+            segment_root = read_segment(segment_path(self.file_path, segment))
+            sources.append((segment, [elt.attrib for elt in segment_root if elt.tag == ELEM]))
+        entries = [(int(attrib["version"]), epoch_from_str(attrib["datetime"]),
+                    _ACTION_CODES[attrib.get("action", INSTALL)],
+                    intern(attrib.get("hash", "")), attrib.get("revision"), segment)
+                   for segment, attribs in sources for attrib in attribs]
+        if not entries:
+            return
+
+        positions = {}
+        for index, (version, epoch, action, hash_str, revision, segment) \
+                in enumerate(reversed(entries)):
+            self._log_versions.append(version)
+            self._log_epochs.append(epoch)
+            self._log_actions.append(action)
+            self._log_hashes.append(hash_str)
+            self._log_revisions.append(revision)
+            self._log_segments.append(segment)
+            if action == _ACTION_CODES[INSTALL]:
+                positions[version] = len(self._versions)
+                self._versions.append(version)
+                self._installs.append(index)
+        current = positions.get(entries[0][0])
+        if current is None:
+            # the install of the newest entry is missing from the archive
+            LOG.warning("no install of current version %s in %s", entries[0][0], self.file_path)
+            current = positions.get(int(root_attrib.get(_CURRENT, 0)), len(self._versions) - 1)
+        self._cursor = current
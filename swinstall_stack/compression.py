@@ -0,0 +1,208 @@
+"""
+compression.py
+
+Transparent compression of swinstall_stack files. Compressed stacks are
+identified by the magic bytes at the start of the file, so a compressed
+stack keeps the same file name as a plain one.
+"""
+
+import bz2
+import gzip
+import logging
+import os
+import zlib
+from cStringIO import StringIO
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+__all__ = ("CODECS", "CompressionPolicy", "compress", "decompress", "detect_codec",
+           "read_stack", "site_policy")
+
+LOG = logging.getLogger(__name__)
+
+GZIP = "gzip"
+ZLIB = "zlib"
+BZ2 = "bz2"
+LZMA = "lzma"
+
+# codecs usable on this host
+CODECS = (GZIP, ZLIB, BZ2) + ((LZMA,) if lzma is not None else ())
+
+# environment variables used to configure the site compression policy
+COMPRESSION_ENV = "SWINSTALL_STACK_COMPRESSION"
+MIN_SIZE_ENV = "SWINSTALL_STACK_COMPRESSION_MIN_SIZE"
+
+_GZIP_MAGIC = "\x1f\x8b"
+_BZ2_MAGIC = "BZh"
+_LZMA_MAGIC = "\xfd7zXZ\x00"
+
+def detect_codec(data):
+    """Identify the codec used to compress data from its magic bytes.
+
+    :param data: contents of a swinstall_stack file
+    :type data: str
+
+    :returns: name of the codec, or None if the data is not compressed
+    :rtype: str | None
+    """
+    if data.startswith(_GZIP_MAGIC):
+        return GZIP
+    if data.startswith(_BZ2_MAGIC):
+        return BZ2
+    if data.startswith(_LZMA_MAGIC):
+        return LZMA
+    # zlib has no magic number proper. A zlib stream starts with a
+    # deflate CMF byte and a FCHECK byte making the pair a multiple of 31,
+    # which plain xml ("<?" or whitespace) never satisfies.
+    if len(data) > 1 and ord(data[0]) == 0x78 and \
+       (ord(data[0]) * 256 + ord(data[1])) % 31 == 0:
+        return ZLIB
+    return None
+
+def compress(data, codec):
+    """Compress data with the named codec.
+
+    :param data: data to compress
+    :type data: str
+    :param codec: name of the codec. None returns data unchanged
+    :type codec: str | None
+
+    :returns: compressed data
+    :rtype: str
+
+    :raises: ValueError if the codec is not available
+    """
+    if codec is None:
+        return data
+    if codec == GZIP:
+        buf = StringIO()
+        # mtime is fixed so that identical stacks compress identically
+        filehandle = gzip.GzipFile(fileobj=buf, mode="wb", mtime=0)
+        try:
+            filehandle.write(data)
+        finally:
+            filehandle.close()
+        return buf.getvalue()
+    if codec == ZLIB:
+        return zlib.compress(data)
+    if codec == BZ2:
+        return bz2.compress(data)
+    if codec == LZMA and lzma is not None:
+        return lzma.compress(data)
+    raise ValueError("unsupported compression codec: {}. Available codecs: {}"\
+                     .format(codec, CODECS))
+
+def decompress(data):
+    """Decompress data, detecting the codec from its magic bytes.
+
+    :param data: possibly compressed data
+    :type data: str
+
+    :returns: the decompressed data and the name of the codec it was
+              compressed with (None for plain data)
+    :rtype: tuple(str, str | None)
+
+    :raises: ValueError if the data uses a codec which is not available
+    """
+    codec = detect_codec(data)
+    if codec is None:
+        return (data, None)
+    if codec == GZIP:
+        filehandle = gzip.GzipFile(fileobj=StringIO(data), mode="rb")
+        try:
+            return (filehandle.read(), codec)
+        finally:
+            filehandle.close()
+    if codec == ZLIB:
+        return (zlib.decompress(data), codec)
+    if codec == BZ2:
+        return (bz2.decompress(data), codec)
+    if lzma is None:
+        raise ValueError("stack is compressed with lzma, which is not available")
+    return (lzma.decompress(data), codec)
+
+def read_stack(path):
+    """Read a swinstall_stack file, transparently decompressing it.
+
+    :param path: full path to the swinstall_stack file
+    :type path: str
+
+    :returns: xml contents of the file and the codec it was compressed with
+    :rtype: tuple(str, str | None)
+    """
+    with open(path, "rb") as filehandle:
+        return decompress(filehandle.read())
+
+
+class CompressionPolicy(object):
+    """Decides whether a swinstall_stack is compressed when it is saved.
+    """
+    PRESERVE = "preserve"
+    NONE = "none"
+
+    def __init__(self, codec=PRESERVE, min_size=0):
+        """Initialize the policy.
+
+        :param codec: name of the codec to compress with. "none" writes plain
+                      stacks, and "preserve" keeps the format the stack was
+                      read in.
+        :type codec: str
+        :param min_size: stacks smaller than min_size bytes are written plain
+        :type min_size: int
+
+        :raises: ValueError if codec is unknown
+        """
+        if codec not in CODECS and codec not in (self.PRESERVE, self.NONE):
+            raise ValueError("unsupported compression codec: {}. Available codecs: {}"\
+                             .format(codec, CODECS))
+        self.codec = codec
+        self.min_size = min_size
+
+    def __repr__(self):
+        return "CompressionPolicy <codec:{} min_size:{}>".format(self.codec, self.min_size)
+
+    @classmethod
+    def from_environment(cls, environ=None):
+        """Construct the policy from SWINSTALL_STACK_COMPRESSION and
+        SWINSTALL_STACK_COMPRESSION_MIN_SIZE.
+
+        :param environ: mapping to read the configuration from. Defaults to os.environ
+        :type environ: dict
+
+        :returns: the configured policy
+        :rtype: CompressionPolicy
+        """
+        environ = os.environ if environ is None else environ
+        return cls(environ.get(COMPRESSION_ENV, cls.PRESERVE),
+                   int(environ.get(MIN_SIZE_ENV, 0)))
+
+    def codec_for(self, data, current_codec=None):
+        """Return the codec a stack should be saved with.
+
+        :param data: uncompressed xml contents of the stack
+        :type data: str
+        :param current_codec: codec the stack was read with
+        :type current_codec: str | None
+
+        :returns: name of the codec, or None to write a plain stack
+        :rtype: str | None
+        """
+        if self.codec == self.PRESERVE:
+            return current_codec
+        if self.codec == self.NONE or len(data) < self.min_size:
+            return None
+        return self.codec
+
+def site_policy():
+    """Return the compression policy configured for this site.
+
+    :returns: site compression policy
+    :rtype: CompressionPolicy
+    """
+    return CompressionPolicy.from_environment()
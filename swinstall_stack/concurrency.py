@@ -0,0 +1,180 @@
+"""
+concurrency.py
+
+Optimistic concurrency control for swinstall_stack files. A stack is read
+along with a token identifying the file it was read from, and is only
+written back if the file on disk still matches that token.
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+import logging
+import os
+import random
+import tempfile
+from .compression import decompress
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ("GENERATION", "ConcurrentModificationError", "StackToken", "atomic_write", "file_mode",
+           "read_stack_token", "retry_delays", "stack_lock", "stat_token")
+
+LOG = logging.getLogger(__name__)
+
+# root attribute counting the number of times a stack has been saved
+GENERATION = "generation"
+
+class ConcurrentModificationError(RuntimeError):
+    """Raised when a swinstall_stack has been modified on disk since it was read.
+    """
+    pass
+
+
+class StackToken(namedtuple("StackToken", "ino size mtime_ns")):
+    """Identifies the state of a swinstall_stack file on disk. Stacks are
+    replaced by rename when saved, so any save changes the inode as well as
+    the modification time.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_stat(cls, stat):
+        """Construct the token from the result of os.stat or os.fstat.
+
+        :param stat: stat result
+        :type stat: os.stat_result
+
+        :returns: token
+        :rtype: StackToken
+        """
+        mtime_ns = getattr(stat, "st_mtime_ns", None)
+        if mtime_ns is None:
+            # float seconds carry microsecond precision
+            mtime_ns = int(round(stat.st_mtime * 1e6)) * 1000
+        return cls(stat.st_ino, stat.st_size, mtime_ns)
+
+def stat_token(path):
+    """Return the token of the file at path, or None if it does not exist.
+
+    :param path: full path to the file
+    :type path: str
+
+    :rtype: StackToken | None
+    """
+    try:
+        return StackToken.from_stat(os.stat(path))
+    except OSError:
+        return None
+
+def read_stack_token(path):
+    """Read a swinstall_stack file, transparently decompressing it, along with
+    the token of the file that was read.
+
+    :param path: full path to the swinstall_stack file
+    :type path: str
+
+    :returns: xml contents of the file, the codec it was compressed with, and
+              the token of the file
+    :rtype: tuple(str, str | None, StackToken)
+    """
+    with open(path, "rb") as filehandle:
+        token = StackToken.from_stat(os.fstat(filehandle.fileno()))
+        data, codec = decompress(filehandle.read())
+    return (data, codec, token)
+
+@contextmanager
+def stack_lock(path):
+    """Hold an exclusive lock on the swinstall_stack at path, yielding a file
+    object open on it. As stacks are replaced by rename, the lock is retaken
+    until the locked file is the one at path. Locking is skipped on
+    platforms without fcntl.
+
+    :param path: full path to the swinstall_stack file
+    :type path: str
+
+    :returns: file object open on the locked stack
+    :rtype: file
+    """
+    while True:
+        filehandle = open(path, "r+b")
+        if fcntl is None:
+            break
+        try:
+            fcntl.lockf(filehandle, fcntl.LOCK_EX)
+            if os.fstat(filehandle.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except Exception:
+            filehandle.close()
+            raise
+        LOG.debug("%s was replaced while waiting for the lock", path)
+        filehandle.close()
+    try:
+        yield filehandle
+    finally:
+        filehandle.close()
+
+def file_mode(path):
+    """Return the permissions a replacement for the file at path should have:
+    those of the existing file, or the default permissions under the current
+    umask for a new file.
+
+    :param path: full path to the file
+    :type path: str
+
+    :rtype: int
+    """
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def atomic_write(path, data):
+    """Replace the file at path with data. The data is written to a temporary
+    file in the same directory, flushed to disk and renamed into place, so
+    readers see either the old or the new contents. The permissions of an
+    existing file are preserved.
+
+    :param path: full path to the file
+    :type path: str
+    :param data: new contents of the file
+    :type data: str
+
+    :returns: token of the new file
+    :rtype: StackToken
+    """
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        prefix=".{}".format(os.path.basename(path)))
+    try:
+        with os.fdopen(handle, "wb") as filehandle:
+            filehandle.write(data)
+            filehandle.flush()
+            os.fsync(filehandle.fileno())
+        os.chmod(tmp_path, file_mode(path))
+        token = stat_token(tmp_path)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return token
+
+def retry_delays(retries, delay, max_delay):
+    """Generate jittered, exponentially increasing delays between retries.
+
+    :param retries: number of delays to generate
+    :type retries: int
+    :param delay: initial delay in seconds
+    :type delay: float
+    :param max_delay: upper bound on any one delay in seconds
+    :type max_delay: float
+
+    :returns: generator of delays in seconds
+    :rtype: generator(float)
+    """
+    for attempt in xrange(retries):
+        yield min(max_delay, delay * 2 ** attempt) * random.uniform(0.5, 1.0)
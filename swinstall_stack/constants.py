@@ -7,3 +7,9 @@ constants used by project
 ELEM = "elt"
 DATETIME_FORMAT = "%Y%m%d-%H%M%S"
 DEFAULT_SCHEMA = "1"
+HASH_ALGORITHM = "md5"
+# actions recorded by schema 2 entries
+ACTIONS = ("install", "rollback", "rollforward")
+# root attribute holding the datetime of the newest entry whose versioned file
+# was collected by retention
+COLLECTED_UNTIL = "collected_until"
@@ -0,0 +1,216 @@
+"""
+dedup.py
+
+Deduplication of identical versioned files. Re-deploying unchanged contents
+creates a new versioned file for each install, so bak directories hold many
+byte-identical copies. The versioned files of each stack are grouped by the
+hash recorded in the stack, or computed for schema 1 stacks, and every
+duplicate is replaced by a hard link to, or a reflink of, a single copy.
+Duplicates are replaced by rename, so the versioned paths of the stack keep
+working throughout.
+"""
+
+from collections import namedtuple
+import errno
+import filecmp
+import logging
+import multiprocessing
+import os
+import tempfile
+from .hashing import hash_file
+from .manager import SwinstallStackMgr
+from .metrics import flushed
+from .schemas import import_schemas
+from .utils import datetime_revision_from_str, find_swinstalled_files, pool_worker
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ("HARDLINK", "REFLINK", "METHODS", "Deduplication", "dedup", "stack_files")
+
+LOG = logging.getLogger(__name__)
+
+HARDLINK = "hardlink"
+REFLINK = "reflink"
+METHODS = (HARDLINK, REFLINK)
+
+# linux ioctl sharing the extents of one file with another, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+class Deduplication(namedtuple("Deduplication", "original duplicates size")):
+    """Duplicates replaced by links to an original versioned file, and the
+    number of bytes reclaimed by doing so.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "{}: {} duplicates {} bytes".format(self.original, len(self.duplicates), self.size)
+
+
+def stack_files(swinstalled_file):
+    """Return the hash and path of each versioned file of a swinstalled file
+    which exists. Schema 2 stacks record the hash of each install; the
+    versioned files of schema 1 stacks are hashed.
+
+    :param swinstalled_file: full path to the versionless swinstalled file
+    :type swinstalled_file: str
+
+    :returns: hash and path pairs
+    :rtype: list(tuple(str, str))
+    """
+    import_schemas()
+    schema = SwinstallStackMgr().parse(swinstalled_file)
+    files = []
+    if schema.schema_version == "1":
+        for elt in schema.root:
+            path = schema._versioned_file(*datetime_revision_from_str(elt.attrib.get("version")))
+            if os.path.isfile(path):
+                files.append((hash_file(path), path))
+        return files
+    seen = set()
+    for elt in schema._elements():
+        version = elt.attrib.get("version")
+        if elt.attrib.get("action") != "install" or version in seen:
+            continue
+        seen.add(version)
+        path = schema._versioned_file(version)
+        if os.path.isfile(path):
+            files.append((elt.attrib.get("hash") or hash_file(path), path))
+    return files
+
+@flushed
+@pool_worker("read", lambda swinstalled_file, err: [])
+def _stack_files_worker(swinstalled_file):
+    """Pool worker gathering the versioned files of a stack."""
+    records = []
+    for hash_str, path in stack_files(swinstalled_file):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        records.append((swinstalled_file, hash_str, path, stat.st_dev, stat.st_ino,
+                        stat.st_nlink, stat.st_size))
+    return records
+
+def _reflink(source, target):
+    """Make target share the extents of source, with the FICLONE ioctl."""
+    if fcntl is None:
+        raise IOError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def _replace(original, duplicate, method):
+    """Replace duplicate with a link to original, under a temporary name renamed
+    into place."""
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(duplicate),
+                                        prefix=".{}".format(os.path.basename(duplicate)))
+    os.close(handle)
+    try:
+        if method == HARDLINK:
+            # mkstemp only reserves a unique name for the link
+            os.remove(tmp_path)
+            os.link(original, tmp_path)
+        else:
+            _reflink(original, tmp_path)
+            stat = os.stat(duplicate)
+            os.chmod(tmp_path, stat.st_mode & 0o7777)
+            os.utime(tmp_path, (stat.st_atime, stat.st_mtime))
+        os.rename(tmp_path, duplicate)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@flushed
+def _dedup_group(args):
+    """Replace the duplicates in a group of files sharing a hash, device and
+    size. Must be module level to be picklable."""
+    group, method, dry_run = args
+    # prefer the copy which is already shared the most
+    group = sorted(group, key=lambda record: (-record[5], record[2]))
+    _, _, original, _, inode, _, size = group[0]
+    duplicates = []
+    replaced = set()
+    for record in group[1:]:
+        path, record_inode = record[2], record[4]
+        if record_inode == inode:
+            # already a link to the original
+            continue
+        try:
+            if not filecmp.cmp(original, path, shallow=False):
+                LOG.warning("%s and %s share a hash but differ", original, path)
+                continue
+            if not dry_run:
+                _replace(original, path, method)
+        except (IOError, OSError) as err:
+            LOG.warning("unable to deduplicate %s: %s", path, err)
+            if err.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                # the filesystem cannot share these files; neither will it the rest
+                break
+            continue
+        replaced.add(record_inode)
+        duplicates.append(path)
+    return Deduplication(original, duplicates, size * len(replaced))
+
+def dedup(root, across_stacks=False, method=HARDLINK, processes=None, dry_run=False):
+    """Replace identical versioned files of the stacks under root with links to
+    a single copy, yielding the duplicates replaced for each original.
+    Stacks are read, and duplicates compared and replaced, in parallel by a
+    pool of worker processes. Files are only linked after their contents
+    have been compared byte for byte, whatever their recorded hash.
+
+    :param root: directory to deduplicate
+    :type root: str
+    :param across_stacks: whether to share contents between the versioned files
+                          of different stacks on the same filesystem, rather than
+                          only between those of the same stack
+    :type across_stacks: bool
+    :param method: "hardlink" to link duplicates to the original, or "reflink"
+                   to give them their own inode sharing the original's extents
+    :type method: str
+    :param processes: number of worker processes. Defaults to the number of cpus.
+                      A value of 1 deduplicates in the calling process.
+    :type processes: int | None
+    :param dry_run: whether to only report the duplicates which would be replaced
+    :type dry_run: bool
+
+    :returns: generator of deduplications
+    :rtype: generator(Deduplication)
+
+    :raises: ValueError if the method is unknown
+    """
+    if method not in METHODS:
+        raise ValueError("unsupported dedup method: {}. Available methods: {}"\
+                         .format(method, METHODS))
+    swinstalled_files = find_swinstalled_files(root)
+    pool = None
+    try:
+        if processes == 1:
+            records = (_stack_files_worker(swinstalled_file)
+                       for swinstalled_file in swinstalled_files)
+        else:
+            pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+            records = pool.imap(_stack_files_worker, swinstalled_files)
+        groups = {}
+        for stack_records in records:
+            for record in stack_records:
+                swinstalled_file, hash_str, _, device, _, _, size = record
+                key = (device, hash_str, size) if across_stacks else \
+                      (swinstalled_file, device, hash_str, size)
+                groups.setdefault(key, []).append(record)
+        work = [(group, method, dry_run) for _, group in sorted(groups.items())
+                if len(group) > 1]
+        LOG.debug("%s groups of identical files under %s", len(work), root)
+        if pool is None:
+            results = (_dedup_group(args) for args in work)
+        else:
+            results = pool.imap_unordered(_dedup_group, work)
+        for result in results:
+            if result.duplicates:
+                yield result
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,111 @@
+"""
+diff.py
+
+Report the swinstalled files under a tree whose resolved version differs
+between two points in time.
+"""
+
+from collections import namedtuple
+import logging
+import multiprocessing
+from .manager import SwinstallStackMgr
+from .metrics import flushed
+from .schemas import import_schemas
+from .utils import find_swinstalled_files, pool_worker
+
+__all__ = ("DiffEntry", "DiffError", "diff_stack", "diff_tree")
+
+LOG = logging.getLogger(__name__)
+
+class DiffEntry(namedtuple("DiffEntry", "swinstalled_file old_path new_path")):
+    """A swinstalled file whose versioned file differs between two times. Either
+    path is None if the file had not been installed at that time.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "{}: {} -> {}".format(self.swinstalled_file, self.old_path, self.new_path)
+
+
+class DiffError(namedtuple("DiffError", "swinstalled_file error")):
+    """A swinstalled file whose stack could not be compared.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "{}: unreadable: {}".format(self.swinstalled_file, self.error)
+
+
+def _resolve(schema, date_time):
+    """Return the path of the versioned file current at date_time, or None"""
+    try:
+        return schema.file_on(date_time).path
+    except LookupError:
+        return None
+
+def diff_stack(swinstalled_file, before, after):
+    """Resolve a swinstalled file at two points in time from a single parse of
+    its swinstall_stack.
+
+    :param swinstalled_file: full path to the versionless swinstalled file
+    :type swinstalled_file: str
+    :param before: the earlier point in time
+    :type before: datetime | str which can be converted to datetime via
+                  utils.datetime_from_str
+    :param after: the later point in time
+    :type after: datetime | str
+
+    :returns: the difference, or None if the file resolves to the same version
+    :rtype: DiffEntry | None
+    """
+    import_schemas()
+    schema = SwinstallStackMgr().parse(swinstalled_file)
+    old_path = _resolve(schema, before)
+    new_path = _resolve(schema, after)
+    if old_path == new_path:
+        return None
+    return DiffEntry(swinstalled_file, old_path, new_path)
+
+@flushed
+@pool_worker("diff", lambda swinstalled_file, err: DiffError(swinstalled_file, str(err)))
+def _diff_stack_worker(args):
+    """Pool worker wrapping diff_stack."""
+    return diff_stack(*args)
+
+def diff_tree(root, before, after, processes=None):
+    """Compare every swinstalled file under root between two points in time,
+    yielding the files whose versioned file differs, and the files whose
+    stack could not be read. Stacks are resolved in parallel by a pool of
+    worker processes, and the results are yielded in sorted order as soon as
+    they are available.
+
+    :param root: directory to compare
+    :type root: str
+    :param before: the earlier point in time
+    :type before: datetime | str which can be converted to datetime via
+                  utils.datetime_from_str
+    :param after: the later point in time
+    :type after: datetime | str
+    :param processes: number of worker processes. Defaults to the number of cpus.
+                      A value of 1 compares stacks in the calling process.
+    :type processes: int | None
+
+    :returns: generator of differences and errors
+    :rtype: generator(DiffEntry | DiffError)
+    """
+    work = ((swinstalled_file, before, after)
+            for swinstalled_file in find_swinstalled_files(root))
+    if processes == 1:
+        results = (_diff_stack_worker(args) for args in work)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_diff_stack_worker, work, 16)
+    try:
+        for entry in results:
+            if entry is not None:
+                yield entry
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,151 @@
+"""
+export.py
+
+Stream the history of every swinstall_stack under a tree as JSON Lines or
+CSV, for consumption by analytics jobs. Stacks are read into columns by
+worker processes and their entries are written out as they arrive, without
+building FileMetadata for each entry.
+"""
+
+from collections import OrderedDict, deque, namedtuple
+import csv
+import json
+import logging
+import multiprocessing
+from .manager import SwinstallStackMgr
+from .metrics import flushed
+from .schemas import import_schemas
+from .utils import epoch_to_str, find_swinstalled_files, pool_worker
+
+__all__ = ("ExportEntry", "FORMATS", "export", "export_entries", "stack_entries")
+
+LOG = logging.getLogger(__name__)
+
+JSONL = "jsonl"
+CSV = "csv"
+FORMATS = (JSONL, CSV)
+
+class ExportEntry(namedtuple("ExportEntry",
+                             "path schema version datetime action hash revision is_current")):
+    """An entry of a swinstall_stack, as exported. path is the versionless
+    swinstalled file, and datetime is formatted as in the stack. Schema 1
+    entries have no hash, and their version is their datetime and revision.
+    """
+    __slots__ = ()
+
+
+def _schema1_entries(swinstalled_file, schema):
+    columns = schema.columns
+    current = schema._current_index()
+    for index in xrange(len(columns) - 1, -1, -1):
+        datetime_str = epoch_to_str(columns.epochs[index])
+        revision = columns.revisions[index]
+        version = datetime_str if revision is None else "{}_{}".format(datetime_str, revision)
+        yield ExportEntry(swinstalled_file, "1", version, datetime_str, columns.action(index),
+                          None, revision, index == current)
+
+def _schema2_entries(swinstalled_file, schema):
+    newest = True
+    for columns in schema._column_sequences():
+        for index in xrange(len(columns)):
+            yield ExportEntry(swinstalled_file, "2", columns.versions[index],
+                              epoch_to_str(columns.epochs[index]), columns.action(index),
+                              columns.hashes[index], columns.revisions[index], newest)
+            newest = False
+
+def stack_entries(swinstalled_file):
+    """Return every entry of a swinstalled file's stack, archived entries
+    included, newest first. The newest entry of a schema 2 stack, and the
+    entry flagged current in a schema 1 stack, are current.
+
+    :param swinstalled_file: full path to the versionless swinstalled file
+    :type swinstalled_file: str
+
+    :returns: entries of the stack
+    :rtype: list(ExportEntry)
+    """
+    import_schemas()
+    schema = SwinstallStackMgr().parse_columns(swinstalled_file)
+    if schema.schema_version == "1":
+        return list(_schema1_entries(swinstalled_file, schema))
+    return list(_schema2_entries(swinstalled_file, schema))
+
+@flushed
+@pool_worker("export", lambda swinstalled_file, err: [])
+def _stack_entries_worker(swinstalled_file):
+    """Pool worker wrapping stack_entries."""
+    return stack_entries(swinstalled_file)
+
+def export_entries(root, processes=None):
+    """Generate every entry of every stack under root. Stacks are read in
+    parallel by a pool of worker processes and yielded in sorted order, each
+    stack's entries newest first. At most a few stacks per worker are held
+    in memory at a time, however slowly the entries are consumed.
+
+    :param root: directory to export
+    :type root: str
+    :param processes: number of worker processes. Defaults to the number of cpus.
+                      A value of 1 reads stacks in the calling process.
+    :type processes: int | None
+
+    :returns: generator of entries
+    :rtype: generator(ExportEntry)
+    """
+    swinstalled_files = find_swinstalled_files(root)
+    if processes == 1:
+        for swinstalled_file in swinstalled_files:
+            for entry in _stack_entries_worker(swinstalled_file):
+                yield entry
+        return
+    processes = processes or multiprocessing.cpu_count()
+    # unlike Pool.imap, a bounded window of outstanding stacks keeps workers
+    # from racing ahead of a slow consumer
+    window = processes * 4
+    pool = multiprocessing.Pool(processes)
+    pending = deque()
+    try:
+        for swinstalled_file in swinstalled_files:
+            pending.append(pool.apply_async(_stack_entries_worker, (swinstalled_file,)))
+            if len(pending) >= window:
+                for entry in pending.popleft().get():
+                    yield entry
+        while pending:
+            for entry in pending.popleft().get():
+                yield entry
+    finally:
+        pool.terminate()
+        pool.join()
+
+def export(root, filehandle, format=JSONL, processes=None):
+    """Write every entry of every stack under root to filehandle. See export_entries
+
+    :param root: directory to export
+    :type root: str
+    :param filehandle: file object to write to
+    :type filehandle: file
+    :param format: "jsonl" for one JSON object per line, or "csv" for CSV with
+                   a header row
+    :type format: str
+    :param processes: number of worker processes
+    :type processes: int | None
+
+    :returns: number of entries written
+    :rtype: int
+
+    :raises: ValueError if the format is unknown
+    """
+    if format not in FORMATS:
+        raise ValueError("unsupported export format: {}. Available formats: {}"\
+                         .format(format, FORMATS))
+    if format == CSV:
+        writer = csv.writer(filehandle)
+        writer.writerow(ExportEntry._fields)
+        write = writer.writerow
+    else:
+        write = lambda entry: filehandle.write(
+            json.dumps(OrderedDict(zip(ExportEntry._fields, entry))) + "\n")
+    count = 0
+    for entry in export_entries(root, processes):
+        write(entry)
+        count += 1
+    return count
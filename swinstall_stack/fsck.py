@@ -0,0 +1,206 @@
+"""
+fsck.py
+
+Integrity verification of swinstall_stacks and the versioned files they track.
+"""
+
+from collections import namedtuple
+import logging
+import os
+from .hashing import hash_file
+from .manager import SwinstallStackMgr
+from .metrics import flushed
+from .retention import COLLECTED_UNTIL
+from .schemas import import_schemas
+from .utils import (datetime_from_str, datetime_revision_from_str, find_swinstalled_files,
+                    init_worker_throttle, rate_limited_pool, worker_throttle)
+
+__all__ = ("FsckIssue", "check_stack", "fsck", "load_checkpoint")
+
+LOG = logging.getLogger(__name__)
+
+UNREADABLE = "unreadable"
+PATH_MISMATCH = "path_mismatch"
+CURRENT_COUNT = "current_count"
+MISSING = "missing"
+HASH_MISMATCH = "hash_mismatch"
+DANGLING_ROLLBACK = "dangling_rollback"
+HEADER_MISMATCH = "header_mismatch"
+
+class FsckIssue(namedtuple("FsckIssue", "swinstalled_file problem detail")):
+    """A problem found in a swinstall_stack or one of its versioned files.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "{}: {}: {}".format(self.swinstalled_file, self.problem, self.detail)
+
+
+def _collected_until(schema):
+    """Return the datetime up to which versioned files may have been removed by
+    retention.gc, or None"""
+    collected_until = schema.root.attrib.get(COLLECTED_UNTIL)
+    return datetime_from_str(collected_until) if collected_until is not None else None
+
+def _check_schema1(schema, swinstalled_file):
+    """Yield the issues found in a Schema1 stack"""
+    current_count = 0
+    current = None
+    collected_until = _collected_until(schema)
+    for elt in schema.root:
+        if elt.attrib.get("is_current") == "True":
+            current_count += 1
+            current = elt.attrib.get("version")
+        date_time, revision = datetime_revision_from_str(elt.attrib.get("version"))
+        path = schema._versioned_file(date_time, revision)
+        if not os.path.isfile(path) and \
+           (collected_until is None or date_time > collected_until):
+            yield FsckIssue(swinstalled_file, MISSING, path)
+    if current_count != 1:
+        yield FsckIssue(swinstalled_file, CURRENT_COUNT,
+                        "expected 1 current entry, found {}".format(current_count))
+    elif schema.root.attrib.get("current", current) != current:
+        yield FsckIssue(swinstalled_file, HEADER_MISMATCH,
+                        "header current {} but entry {} is current"\
+                        .format(schema.root.attrib.get("current"), current))
+
+def _check_schema2(schema, swinstalled_file, verify_hashes, throttle):
+    """Yield the issues found in a Schema2 stack"""
+    installed = set()
+    rolled_back_to = set()
+    max_version = None
+    collected_until = _collected_until(schema)
+    for elt in schema._elements():
+        version = elt.attrib.get("version")
+        if elt.attrib.get("action") != "install":
+            rolled_back_to.add(version)
+            continue
+        installed.add(version)
+        max_version = max(max_version, int(version))
+        path = schema._versioned_file(version)
+        if not os.path.isfile(path):
+            if collected_until is None or \
+               datetime_from_str(elt.attrib.get("datetime")) > collected_until:
+                yield FsckIssue(swinstalled_file, MISSING, path)
+        elif verify_hashes:
+            hash_str = hash_file(path, throttle=throttle)
+            if hash_str != elt.attrib.get("hash"):
+                yield FsckIssue(swinstalled_file, HASH_MISMATCH,
+                                "{} recorded: {} actual: {}"\
+                                .format(path, elt.attrib.get("hash"), hash_str))
+    for version in sorted(rolled_back_to - installed):
+        yield FsckIssue(swinstalled_file, DANGLING_ROLLBACK,
+                        "rollback to version {} which was never installed".format(version))
+    header = schema.root.attrib
+    if len(schema.root) and header.get("current", schema.root[0].attrib.get("version")) \
+       != schema.root[0].attrib.get("version"):
+        yield FsckIssue(swinstalled_file, HEADER_MISMATCH,
+                        "header current {} but newest entry is version {}"\
+                        .format(header.get("current"), schema.root[0].attrib.get("version")))
+    if max_version is not None and int(header.get("max_version", max_version)) != max_version:
+        yield FsckIssue(swinstalled_file, HEADER_MISMATCH,
+                        "header max_version {} but highest install is version {}"\
+                        .format(header.get("max_version"), max_version))
+
+def check_stack(swinstalled_file, verify_hashes=True, throttle=None):
+    """Verify the swinstall_stack of a single swinstalled file.
+
+    :param swinstalled_file: full path to the versionless swinstalled file
+    :type swinstalled_file: str
+    :param verify_hashes: whether to compare the contents of versioned files
+                          against the hashes recorded in schema 2 stacks
+    :type verify_hashes: bool
+    :param throttle: optional callable used to rate limit hashing I/O.
+                     See utils.RateLimiter
+    :type throttle: callable | None
+
+    :returns: the issues found
+    :rtype: list(FsckIssue)
+    """
+    import_schemas()
+    mgr = SwinstallStackMgr()
+    stack = mgr._swinstall_stack_from_file(swinstalled_file)
+    try:
+        schema = mgr.parse(swinstalled_file)
+        issues = []
+        if schema.swinstall_stack != stack:
+            issues.append(FsckIssue(swinstalled_file, PATH_MISMATCH,
+                                    "stack records path {}".format(schema.swinstall_stack)))
+        if schema.schema_version == "2":
+            issues.extend(_check_schema2(schema, swinstalled_file, verify_hashes, throttle))
+        else:
+            issues.extend(_check_schema1(schema, swinstalled_file))
+        return issues
+    except Exception as err:
+        return [FsckIssue(swinstalled_file, UNREADABLE, "{}: {}".format(stack, err))]
+
+@flushed
+def _check_stack_worker(args):
+    """Pool worker wrapping check_stack. Must be module level to be picklable."""
+    swinstalled_file, verify_hashes = args
+    return (swinstalled_file, check_stack(swinstalled_file, verify_hashes, worker_throttle()))
+
+def load_checkpoint(checkpoint):
+    """Read the set of swinstalled files already verified by a previous run.
+
+    :param checkpoint: full path to the checkpoint file
+    :type checkpoint: str
+
+    :returns: versionless paths recorded in the checkpoint
+    :rtype: set(str)
+    """
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint) as filehandle:
+        return set(line.rstrip("\n") for line in filehandle if line.strip())
+
+def fsck(root, processes=None, checkpoint=None, rate_limit=None, verify_hashes=True):
+    """Verify every swinstall_stack under root, yielding issues as they are found.
+    Stacks are verified in parallel by a pool of worker processes.
+
+    :param root: directory to verify
+    :type root: str
+    :param processes: number of worker processes. Defaults to the number of cpus.
+                      A value of 1 verifies stacks in the calling process.
+    :type processes: int | None
+    :param checkpoint: optional path to a checkpoint file. Each verified stack is
+                       appended to the file, and stacks already listed in it are
+                       skipped, so an interrupted run may be resumed.
+    :type checkpoint: str | None
+    :param rate_limit: maximum number of bytes per second read while hashing,
+                       shared between the worker processes
+    :type rate_limit: float | None
+    :param verify_hashes: whether to compare the contents of versioned files
+                          against the hashes recorded in schema 2 stacks
+    :type verify_hashes: bool
+
+    :returns: generator of issues
+    :rtype: generator(FsckIssue)
+    """
+    done = load_checkpoint(checkpoint) if checkpoint else set()
+    work = [(swinstalled_file, verify_hashes)
+            for swinstalled_file in find_swinstalled_files(root)
+            if swinstalled_file not in done]
+    LOG.debug("verifying %s stacks under %s (%s already verified)", len(work), root, len(done))
+
+    checkpoint_handle = open(checkpoint, "a") if checkpoint else None
+    pool = None
+    try:
+        if processes == 1:
+            init_worker_throttle(rate_limit)
+            results = (_check_stack_worker(args) for args in work)
+        else:
+            pool = rate_limited_pool(processes, rate_limit)
+            results = pool.imap_unordered(_check_stack_worker, work)
+        for swinstalled_file, issues in results:
+            for issue in issues:
+                yield issue
+            if checkpoint_handle:
+                checkpoint_handle.write(swinstalled_file + "\n")
+                checkpoint_handle.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if checkpoint_handle:
+            checkpoint_handle.close()
@@ -0,0 +1,87 @@
+"""
+hashing.py
+
+Content hashing of swinstalled files.
+"""
+
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+from .constants import HASH_ALGORITHM
+from .metrics import flushed
+
+__all__ = ("hash_file", "hash_files")
+
+LOG = logging.getLogger(__name__)
+
+# size of the reads used to stream a file through the hash
+CHUNK_SIZE = 1024 * 1024
+# files at least this large are hashed through mmap rather than read()
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+def hash_file(path, algorithm=HASH_ALGORITHM, throttle=None):
+    """Compute the hex digest of the contents of a file. The file is streamed
+    through the hash in chunks, and large files are mapped into memory rather
+    than copied through a read buffer.
+
+    :param path: full path to the file
+    :type path: str
+    :param algorithm: name of the hashlib algorithm to use
+    :type algorithm: str
+    :param throttle: optional callable invoked with the number of bytes
+                     about to be read, used to rate limit I/O. Disables mmap.
+    :type throttle: callable | None
+
+    :returns: hex digest of the file contents
+    :rtype: str
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as filehandle:
+        size = os.fstat(filehandle.fileno()).st_size
+        if throttle is None and size >= MMAP_THRESHOLD:
+            mapped = mmap.mmap(filehandle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                digest.update(mapped)
+            finally:
+                mapped.close()
+            return digest.hexdigest()
+        while True:
+            if throttle is not None:
+                throttle(CHUNK_SIZE)
+            chunk = filehandle.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@flushed
+def _hash_file_worker(args):
+    """Pool worker wrapping hash_file. Must be module level to be picklable."""
+    path, algorithm = args
+    return (path, hash_file(path, algorithm))
+
+def hash_files(paths, processes=None, algorithm=HASH_ALGORITHM):
+    """Compute the hex digest of many files in parallel.
+
+    :param paths: full paths to the files to hash
+    :type paths: list(str)
+    :param processes: number of worker processes. Defaults to the number of cpus.
+                      A value of 1 hashes the files in the calling process.
+    :type processes: int | None
+    :param algorithm: name of the hashlib algorithm to use
+    :type algorithm: str
+
+    :returns: (path, hex digest) pairs, in the order of paths
+    :rtype: list(tuple(str, str))
+    """
+    work = [(path, algorithm) for path in paths]
+    if processes == 1 or len(work) < 2:
+        return [_hash_file_worker(args) for args in work]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_hash_file_worker, work)
+    finally:
+        pool.close()
+        pool.join()
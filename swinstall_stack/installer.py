@@ -0,0 +1,285 @@
+"""
+installer.py
+
+Installation of files, and of whole directory trees, into swinstall_stack
+managed destinations.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+import ctypes
+import errno
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from .concurrency import ConcurrentModificationError
+from .hashing import hash_file
+from .links import update_links
+from .manager import SwinstallStackMgr
+from .metrics import flushed
+from .schemas import import_schemas
+
+__all__ = ("copy_file", "install_file", "install_tree")
+
+LOG = logging.getLogger(__name__)
+
+# largest number of bytes requested from the kernel per zero copy call
+_COPY_CHUNK = 1 << 30
+
+def _libc_function(name, *argtypes):
+    """Return a linux libc function through ctypes, or None if it is unavailable.
+    The os module of python 2 exposes neither copy_file_range nor sendfile."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        function = getattr(ctypes.CDLL(None, use_errno=True), name)
+    except (AttributeError, OSError):
+        return None
+    function.restype = ctypes.c_ssize_t
+    function.argtypes = argtypes
+    return function
+
+# copy_file_range(fd_in, off_in, fd_out, off_out, len, flags), glibc 2.27
+_copy_file_range = _libc_function("copy_file_range", ctypes.c_int,
+                                  ctypes.POINTER(ctypes.c_int64), ctypes.c_int,
+                                  ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t,
+                                  ctypes.c_uint)
+# sendfile(out_fd, in_fd, offset, count)
+_sendfile = _libc_function("sendfile", ctypes.c_int, ctypes.c_int,
+                           ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t)
+
+def _copy_kernel(src, dst, size):
+    """Copy size bytes from the start of src to the start of dst inside the
+    kernel, with copy_file_range, or sendfile where copy_file_range cannot
+    copy between the files.
+
+    :param src: file descriptor to copy from
+    :type src: int
+    :param dst: empty file descriptor, open for writing, to copy to
+    :type dst: int
+    :param size: number of bytes to copy
+    :type size: int
+
+    :returns: True if size bytes were copied, False if no zero copy call is
+              available or the source ended early
+    :rtype: bool
+
+    :raises: OSError if a zero copy call fails
+    """
+    copy_file_range = _copy_file_range
+    if copy_file_range is None and _sendfile is None:
+        return False
+    offset = ctypes.c_int64(0)
+    while offset.value < size:
+        count = min(_COPY_CHUNK, size - offset.value)
+        if copy_file_range is not None:
+            # both calls advance offset by the number of bytes copied
+            out_offset = ctypes.c_int64(offset.value)
+            copied = copy_file_range(src, ctypes.byref(offset), dst,
+                                     ctypes.byref(out_offset), count, 0)
+        else:
+            copied = _sendfile(dst, src, ctypes.byref(offset), count)
+        if copied < 0:
+            err = ctypes.get_errno()
+            # cross filesystem copies are unsupported on older kernels
+            if copy_file_range is not None and not offset.value and _sendfile is not None and \
+               err in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                copy_file_range = None
+                continue
+            raise OSError(err, os.strerror(err))
+        if not copied:
+            break
+    return offset.value == size
+
+def _stage_file(source_file, dest_file):
+    """Copy source_file to a temporary file alongside dest_file, using zero copy
+    system calls where available.
+
+    :returns: full path to the temporary file
+    :rtype: str
+    """
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_file),
+                                        prefix=".{}".format(os.path.basename(dest_file)))
+    try:
+        with os.fdopen(handle, "wb") as dst, open(source_file, "rb") as src:
+            if not _copy_kernel(src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size):
+                # sendfile moves the position of dst, and a source which has
+                # changed size since it was stat'ed is copied as it is now
+                dst.seek(0)
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+                dst.truncate()
+        shutil.copymode(source_file, tmp_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+def copy_file(source_file, dest_file):
+    """Copy source_file to dest_file, using zero copy system calls where
+    available. The copy is written under a temporary name and renamed into
+    place, so dest_file never holds partial contents.
+
+    :param source_file: full path to the file to copy
+    :type source_file: str
+    :param dest_file: full path to the copy
+    :type dest_file: str
+    """
+    tmp_path = _stage_file(source_file, dest_file)
+    try:
+        os.rename(tmp_path, dest_file)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def _install_version(schema, staged_file, hash_str, date_time, revision, claimed):
+    """Link the staged contents to the versioned file of the next version of a
+    schema 2 stack, and record the install. Applied through schema._commit, so
+    that it is re-applied with a later version when another installer wins the
+    race for the next version.
+
+    :param claimed: single item list holding the versioned file linked by a
+                    previous attempt, if any
+    :type claimed: list
+
+    :returns: the installed versioned file, or None if the contents are
+              identical to those of the current version
+    :rtype: str | None
+    """
+    if len(schema.root) and schema.current().hash == hash_str:
+        LOG.info("contents are identical to current version %s of %s. skipping install",
+                 schema.current_version(), schema.versionless_filename())
+        return None
+    versioned_file = schema._versioned_file(schema.next_version())
+    if versioned_file != claimed[0]:
+        try:
+            os.link(staged_file, versioned_file)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            raise ConcurrentModificationError("{} was claimed by another installer"\
+                                              .format(versioned_file))
+        if claimed[0] is not None:
+            os.remove(claimed[0])
+        claimed[0] = versioned_file
+    schema.insert_element(hash_str, date_time, revision)
+    return versioned_file
+
+def install_file(source_file, dest_dir, date_time=None, revision=None, link=True):
+    """Install source_file into dest_dir. The stack is created if this is the
+    first install of the file, the contents are copied to the versioned file in
+    the bak directory, and only then is the install recorded in the stack.
+
+    :param source_file: full path to the file to install
+    :type source_file: str
+    :param dest_dir: directory to install the file into
+    :type dest_dir: str
+    :param date_time: time of the install. Defaults to now
+    :type date_time: datetime
+    :param revision: None|str - The optional scm revision number
+    :param link: whether to point the versionless file at the new version
+    :type link: bool
+
+    :returns: the installed versioned file, or None if the contents are
+              identical to those of the current version of a schema 2 stack
+    :rtype: str | None
+    """
+    import_schemas()
+    date_time = date_time or datetime.now()
+    versionless_path = os.path.join(dest_dir, os.path.basename(source_file))
+    schema = SwinstallStackMgr().parse(versionless_path, create=True)
+
+    if schema.schema_version == "2":
+        hash_str = hash_file(source_file)
+        staged_file = _stage_file(source_file, schema.swinstall_stack)
+        claimed = [None]
+        try:
+            versioned_file = schema._commit(_install_version, staged_file, hash_str,
+                                            date_time, revision, claimed)
+        except Exception:
+            if claimed[0] is not None:
+                os.remove(claimed[0])
+            raise
+        finally:
+            os.remove(staged_file)
+        if versioned_file is None:
+            return None
+    else:
+        versioned_file = schema._versioned_file(date_time, revision)
+        copy_file(source_file, versioned_file)
+        schema.insert_element(date_time, revision)
+
+    if link:
+        schema.update_link()
+    LOG.debug("installed %s as %s", source_file, versioned_file)
+    return versioned_file
+
+@flushed
+def _install_dir_worker(args):
+    """Pool worker installing the files of a single directory, and updating
+    their versionless links with one directory fsync. Must be module level to
+    be picklable.
+    """
+    source_files, dest_dir, date_time, revision = args
+    installed = []
+    links = []
+    for source_file in source_files:
+        try:
+            versioned_file = install_file(source_file, dest_dir, date_time, revision, link=False)
+        except Exception as err:
+            LOG.error("unable to install %s: %s", source_file, err)
+            versioned_file = None
+        else:
+            if versioned_file is not None:
+                links.append((os.path.join(dest_dir, os.path.basename(source_file)),
+                              versioned_file))
+        installed.append((source_file, versioned_file))
+    update_links(links, threads=1)
+    return installed
+
+def install_tree(source_dir, dest_dir, processes=None, date_time=None, revision=None):
+    """Install every file under source_dir into the matching directory under
+    dest_dir. Files are grouped per directory, and directories are installed in
+    parallel by a pool of worker processes.
+
+    :param source_dir: directory to install
+    :type source_dir: str
+    :param dest_dir: directory to install into
+    :type dest_dir: str
+    :param processes: number of worker processes. Defaults to the number of cpus.
+                      A value of 1 installs in the calling process.
+    :type processes: int | None
+    :param date_time: time recorded for every install. Defaults to now
+    :type date_time: datetime
+    :param revision: None|str - The optional scm revision number
+
+    :returns: generator of (source file, installed versioned file) tuples. The
+              versioned file is None for files which were skipped or failed
+    :rtype: generator(tuple(str, str | None))
+    """
+    date_time = date_time or datetime.now()
+    by_dir = defaultdict(list)
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        dirnames.sort()
+        dest = os.path.normpath(os.path.join(dest_dir, os.path.relpath(dirpath, source_dir)))
+        for filename in sorted(filenames):
+            by_dir[dest].append(os.path.join(dirpath, filename))
+    work = [(by_dir[dest], dest, date_time, revision) for dest in sorted(by_dir)]
+    LOG.debug("installing %s directories from %s into %s", len(work), source_dir, dest_dir)
+
+    if processes == 1:
+        for args in work:
+            for result in _install_dir_worker(args):
+                yield result
+        return
+
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        for installed in pool.imap_unordered(_install_dir_worker, work):
+            for result in installed:
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,131 @@
+"""
+links.py
+
+Maintenance of the versionless symlinks pointing at the current versioned
+file of each swinstall_stack.
+"""
+
+import errno
+import itertools
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+
+__all__ = ("fsync_dir", "relink_tree", "update_link", "update_links")
+
+LOG = logging.getLogger(__name__)
+
+_COUNTER = itertools.count()
+
+def fsync_dir(dirname):
+    """Flush a directory's entries to disk, making renames within it durable.
+
+    :param dirname: full path to the directory
+    :type dirname: str
+    """
+    handle = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(handle)
+    finally:
+        os.close(handle)
+
+def _swap_link(versionless_path, versioned_path):
+    """Atomically point versionless_path at versioned_path, by creating a symlink
+    under a temporary name and renaming it over the versionless path. The link
+    is relative, so trees may be moved or mounted elsewhere.
+    """
+    dirname, name = os.path.split(versionless_path)
+    target = os.path.relpath(versioned_path, dirname)
+    while True:
+        tmp_path = os.path.join(dirname, ".{}.{}.{}.lnk".format(name, os.getpid(), next(_COUNTER)))
+        try:
+            os.symlink(target, tmp_path)
+            break
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+    try:
+        os.rename(tmp_path, versionless_path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+    LOG.debug("linked %s -> %s", versionless_path, target)
+
+def update_link(versionless_path, versioned_path, fsync=True):
+    """Atomically point the versionless file at a versioned file.
+
+    :param versionless_path: full path to the versionless file
+    :type versionless_path: str
+    :param versioned_path: full path to the versioned file
+    :type versioned_path: str
+    :param fsync: whether to fsync the directory so the link survives a crash
+    :type fsync: bool
+    """
+    _swap_link(versionless_path, versioned_path)
+    if fsync:
+        fsync_dir(os.path.dirname(versionless_path))
+
+def update_links(links, threads=8, fsync=True):
+    """Atomically update many versionless links in one pass. Links are swapped
+    in parallel, and each directory is fsynced once after all of its links have
+    been swapped, rather than once per link.
+
+    :param links: (versionless path, versioned path) pairs
+    :type links: iterable(tuple(str, str))
+    :param threads: number of worker threads
+    :type threads: int
+    :param fsync: whether to fsync the directories containing the links
+    :type fsync: bool
+
+    :returns: number of links updated
+    :rtype: int
+    """
+    links = list(links)
+    if not links:
+        return 0
+
+    pool = ThreadPool(threads)
+    try:
+        def swap(link):
+            _swap_link(*link)
+
+        # links of the same directory are swapped concurrently; each
+        # directory is fsynced once every swap has finished
+        for _ in pool.imap_unordered(swap, links):
+            pass
+        if fsync:
+            dirnames = sorted(set(os.path.dirname(versionless_path)
+                                  for versionless_path, _ in links))
+            for _ in pool.imap_unordered(fsync_dir, dirnames):
+                pass
+        return len(links)
+    finally:
+        pool.close()
+        pool.join()
+
+def relink_tree(root, threads=8, fsync=True):
+    """Point every versionless file under root at the current entry of its
+    swinstall_stack.
+
+    :param root: directory to relink
+    :type root: str
+    :param threads: number of worker threads
+    :type threads: int
+    :param fsync: whether to fsync the directories containing the links
+    :type fsync: bool
+
+    :returns: number of links updated
+    :rtype: int
+    """
+    from .manager import SwinstallStackMgr
+    from .schemas import import_schemas
+    from .utils import find_swinstalled_files
+    import_schemas()
+    mgr = SwinstallStackMgr()
+
+    def current(swinstalled_file):
+        return (swinstalled_file, mgr.parse(swinstalled_file).current().path)
+
+    return update_links((current(swinstalled_file)
+                         for swinstalled_file in find_swinstalled_files(root)),
+                        threads, fsync)
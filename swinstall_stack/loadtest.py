@@ -0,0 +1,349 @@
+"""
+loadtest.py
+
+Load test of concurrent writers to swinstall_stacks. A number of worker
+processes apply a random mix of installs, rollbacks and queries to a set of
+stacks in a local directory, each operation parsing the stack afresh as a
+separate installer would. The run reports throughput, latency percentiles
+and the conflicts met by the writers, then verifies the final state of each
+stack against the modifications the writers committed, so that locking and
+retry strategies may be compared.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import logging
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from . import metrics
+from .concurrency import ConcurrentModificationError
+from .manager import SwinstallStackMgr
+from .metrics import CONFLICTS, Metrics, flushed
+from .schemas import import_schemas
+
+__all__ = ("INSERT", "ROLLBACK", "CURRENT", "DEFAULT_MIX", "LoadTestResult", "loadtest",
+           "parse_mix", "verify_stack")
+
+LOG = logging.getLogger(__name__)
+
+INSERT = "insert"
+ROLLBACK = "rollback"
+CURRENT = "current"
+OPERATIONS = (INSERT, ROLLBACK, CURRENT)
+
+# relative weights of the operations
+DEFAULT_MIX = ((INSERT, 2), (ROLLBACK, 1), (CURRENT, 2))
+
+# number of entries installed in each stack before the run
+SEED_ENTRIES = 3
+# seconds allowed for the worker processes to start before operations begin
+START_DELAY = 0.5
+
+class LoadTestResult(namedtuple("LoadTestResult",
+                                "processes elapsed counts latencies conflicts failures "
+                                "rejections lost_updates errors")):
+    """Outcome of a load test. counts holds the number of completed operations,
+    and latencies their sorted durations in seconds, by operation. conflicts
+    is the number of saves retried after another writer saved the stack
+    first, failures the number of operations which gave up retrying, and
+    rejections the number the stack refused, such as rolling back past its
+    first entry. lost_updates lists the (stack, revision) of committed
+    installs missing from the final stacks, and errors any other problem
+    found in them.
+    """
+    __slots__ = ()
+
+    @property
+    def operations(self):
+        """Number of completed operations"""
+        return sum(self.counts.values())
+
+    @property
+    def throughput(self):
+        """Completed operations per second"""
+        return self.operations / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def correct(self):
+        """Whether every committed modification is reflected in the final stacks"""
+        return not self.lost_updates and not self.errors
+
+    def percentile(self, operation, fraction):
+        """Return the latency of an operation at the supplied percentile, by the
+        nearest rank method.
+
+        :param operation: name of the operation
+        :type operation: str
+        :param fraction: percentile, between 0 and 1
+        :type fraction: float
+
+        :returns: latency in seconds, or None if no such operation completed
+        :rtype: float | None
+        """
+        latencies = self.latencies.get(operation)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, max(0, int(math.ceil(fraction * len(latencies))) - 1))]
+
+    def __str__(self):
+        lines = ["{} operations by {} processes in {:.3f}s: {:.1f} ops/s"\
+                 .format(self.operations, self.processes, self.elapsed, self.throughput)]
+        for operation in OPERATIONS:
+            if not self.latencies.get(operation):
+                continue
+            lines.append("  {:<9} {:>6}  p50 {:>8.2f}ms  p90 {:>8.2f}ms  p99 {:>8.2f}ms  max {:>8.2f}ms"\
+                         .format(operation, self.counts[operation],
+                                 *[self.percentile(operation, fraction) * 1000
+                                   for fraction in (0.5, 0.9, 0.99, 1.0)]))
+        lines.append("conflicts retried: {}  failed: {}  rejected: {}"\
+                     .format(self.conflicts, self.failures, self.rejections))
+        lines.append("lost updates: {}".format(len(self.lost_updates)))
+        for error in self.errors:
+            lines.append("error: {}".format(error))
+        lines.append("final state: {}".format("correct" if self.correct else "INCORRECT"))
+        return "\n".join(lines)
+
+
+def parse_mix(mix):
+    """Parse an operation mix of the form "insert=2,rollback=1,current=2".
+
+    :param mix: comma separated operation=weight pairs
+    :type mix: str
+
+    :returns: operation and weight pairs
+    :rtype: tuple(tuple(str, float))
+
+    :raises: ValueError if the mix names an unknown operation or has no weight
+    """
+    pairs = []
+    for item in mix.split(","):
+        operation, _, weight = item.strip().partition("=")
+        if operation not in OPERATIONS:
+            raise ValueError("unknown operation: {}. Available operations: {}"\
+                             .format(operation, OPERATIONS))
+        pairs.append((operation, float(weight or 1)))
+    if not sum(weight for _, weight in pairs) > 0:
+        raise ValueError("operation mix {} has no weight".format(mix))
+    return tuple(pairs)
+
+def _stack_path(directory, index):
+    return os.path.join(directory, "stack{}.xml".format(index))
+
+def _revision(worker, sequence):
+    """Revision identifying an install, unique across the run"""
+    return "w{}o{}".format(worker, sequence)
+
+def _installed_revisions(schema):
+    """Return the revisions of the install entries of a stack"""
+    revisions = []
+    for elt in schema.root:
+        if schema.schema_version == "1":
+            version = elt.attrib.get("version", "")
+            revisions.append(version.split("_")[-1] if "_" in version else None)
+        elif elt.attrib.get("action") == "install":
+            revisions.append(elt.attrib.get("revision"))
+    return revisions
+
+def _seed(directory, stacks, schema_version):
+    """Create the stacks of the run, returning the generation of each"""
+    import_schemas()
+    mgr = SwinstallStackMgr()
+    generations = []
+    for index in xrange(stacks):
+        swinstalled_file = _stack_path(directory, index)
+        mgr.create(swinstalled_file, schema_version)
+        for sequence in xrange(SEED_ENTRIES):
+            schema = mgr.parse(swinstalled_file)
+            if schema_version == "1":
+                schema.insert_element(datetime.now(), _revision("seed", sequence))
+            else:
+                schema.insert_element("{:032x}".format(sequence), datetime.now(),
+                                      _revision("seed", sequence))
+        generations.append(mgr.parse(swinstalled_file).generation or 0)
+    return generations
+
+def _apply(schema, operation, worker, sequence, strategy):
+    """Apply an operation to a freshly parsed stack, returning the revision of
+    the entry installed, if any."""
+    for name, value in strategy.items():
+        setattr(schema, name, value)
+    if operation == CURRENT:
+        schema.current()
+        return None
+    if operation == ROLLBACK:
+        schema.rollback_element(datetime.now())
+        return None
+    revision = _revision(worker, sequence)
+    if schema.schema_version == "1":
+        schema.insert_element(datetime.now(), revision)
+    else:
+        schema.insert_element("{:032x}".format(random.getrandbits(128)), datetime.now(), revision)
+    return revision
+
+@flushed
+def _worker(args):
+    """Apply a worker's share of the operations. Must be module level to be picklable."""
+    directory, worker, stacks, operations, mix, strategy, seed, start = args
+    import_schemas()
+    rng = random.Random(seed * 1000003 + worker if seed is not None else None)
+    choices, weights = zip(*mix)
+    total = float(sum(weights))
+    latencies = dict((operation, []) for operation in OPERATIONS)
+    installed = []
+    writes = [0] * stacks
+    failures = rejections = 0
+    errors = []
+    # conflicts are counted by the metrics of _commit, in a registry of the run's own
+    registry, metrics.METRICS = metrics.METRICS, Metrics()
+    try:
+        time.sleep(max(0.0, start - time.time()))
+        mgr = SwinstallStackMgr()
+        for sequence in xrange(operations):
+            threshold = rng.random() * total
+            for operation, weight in zip(choices, weights):
+                threshold -= weight
+                if threshold < 0:
+                    break
+            index = rng.randrange(stacks)
+            began = time.time()
+            try:
+                revision = _apply(mgr.parse(_stack_path(directory, index)), operation,
+                                  worker, sequence, strategy)
+            except ConcurrentModificationError:
+                failures += 1
+                continue
+            except (IndexError, KeyError):
+                rejections += 1
+                continue
+            except Exception as err:
+                errors.append("{} {}: {}".format(operation, _stack_path(directory, index), err))
+                continue
+            latencies[operation].append(time.time() - began)
+            if operation != CURRENT:
+                writes[index] += 1
+            if revision is not None:
+                installed.append((index, revision))
+        conflicts = sum(value for key, value in metrics.METRICS.samples().items()
+                        if key == '{}{{outcome="retried"}}'.format(CONFLICTS))
+    finally:
+        metrics.METRICS = registry
+    return (latencies, installed, writes, conflicts, failures, rejections, errors)
+
+def verify_stack(swinstalled_file, revisions, generation):
+    """Verify the final state of a stack after a load test.
+
+    :param swinstalled_file: full path to the versionless swinstalled file
+    :type swinstalled_file: str
+    :param revisions: revisions of the installs committed to the stack
+    :type revisions: list(str)
+    :param generation: generation the stack should have reached, or None to
+                       skip the check
+    :type generation: int | None
+
+    :returns: revisions of the committed installs missing from the stack, and
+              other problems found
+    :rtype: tuple(list(str), list(str))
+    """
+    try:
+        schema = SwinstallStackMgr().parse(swinstalled_file)
+        schema.current()
+    except Exception as err:
+        return ([], ["{}: unreadable: {}".format(swinstalled_file, err)])
+    found = _installed_revisions(schema)
+    counts = {}
+    for revision in found:
+        counts[revision] = counts.get(revision, 0) + 1
+    lost = [revision for revision in revisions if revision not in counts]
+    errors = ["{}: {} installed {} times".format(swinstalled_file, revision, count)
+              for revision, count in sorted(counts.items()) if count > 1]
+    committed = set(revisions)
+    errors.extend("{}: {} installed but never committed".format(swinstalled_file, revision)
+                  for revision in sorted(counts)
+                  if revision not in committed and not str(revision).startswith("wseed"))
+    if generation is not None and schema.generation != generation:
+        errors.append("{}: generation {} after {} saves".format(swinstalled_file,
+                                                                schema.generation, generation))
+    return (lost, errors)
+
+def loadtest(directory=None, processes=None, stacks=1, operations=100, mix=DEFAULT_MIX,
+             schema_version="2", seed=None, **strategy):
+    """Run a load test, returning its result.
+
+    :param directory: directory to create the stacks in. Defaults to a temporary
+                      directory, removed after the run
+    :type directory: str | None
+    :param processes: number of worker processes. Defaults to the number of cpus.
+                      A value of 1 applies the operations in the calling process.
+    :type processes: int | None
+    :param stacks: number of stacks the operations are spread over
+    :type stacks: int
+    :param operations: number of operations applied by each worker
+    :type operations: int
+    :param mix: relative weights of the operations. See parse_mix
+    :type mix: tuple(tuple(str, float))
+    :param schema_version: schema version of the stacks
+    :type schema_version: str
+    :param seed: seed of the random choice of operations and stacks
+    :type seed: int | None
+    :param strategy: retry settings of the schemas, such as max_retries,
+                     retry_delay and max_retry_delay
+    :type strategy: dict
+
+    :rtype: LoadTestResult
+    """
+    tmpdir = None
+    if directory is None:
+        directory = tmpdir = tempfile.mkdtemp(prefix="swinstall_loadtest")
+    processes = processes or multiprocessing.cpu_count()
+    try:
+        generations = _seed(directory, stacks, schema_version)
+        start = time.time() + (START_DELAY if processes > 1 else 0.0)
+        work = [(directory, worker, stacks, operations, mix, strategy, seed, start)
+                for worker in xrange(processes)]
+        if processes == 1:
+            results = [_worker(args) for args in work]
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_worker, work, 1)
+            finally:
+                pool.terminate()
+                pool.join()
+        elapsed = time.time() - start
+
+        latencies = dict((operation, []) for operation in OPERATIONS)
+        installed = [[] for _ in xrange(stacks)]
+        writes = [0] * stacks
+        conflicts = failures = rejections = 0
+        errors = []
+        for result in results:
+            for operation, values in result[0].items():
+                latencies[operation].extend(values)
+            for index, revision in result[1]:
+                installed[index].append(revision)
+            for index, count in enumerate(result[2]):
+                writes[index] += count
+            conflicts += result[3]
+            failures += result[4]
+            rejections += result[5]
+            errors.extend(result[6])
+        lost_updates = []
+        for index in xrange(stacks):
+            swinstalled_file = _stack_path(directory, index)
+            lost, stack_errors = verify_stack(swinstalled_file, installed[index],
+                                              generations[index] + writes[index])
+            lost_updates.extend((swinstalled_file, revision) for revision in lost)
+            errors.extend(stack_errors)
+        for values in latencies.values():
+            values.sort()
+        counts = dict((operation, len(values)) for operation, values in latencies.items())
+        return LoadTestResult(processes, elapsed, counts, latencies, conflicts, failures,
+                              rejections, lost_updates, errors)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
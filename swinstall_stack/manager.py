@@ -5,11 +5,15 @@ entrypoint for swinstall stack parsing
 """
 
 #from datetime import datetime
-import time
+import errno
 import logging
 import os
-import xml.etree.ElementTree as ET
+import tempfile
+from .backend import Element, fromstring, serialize
+from .cache import NegativeCache, StackCache
+from .concurrency import file_mode, read_stack_token, stat_token
 from .constants import DEFAULT_SCHEMA
+from .metrics import CACHE, PARSES, PARSE_SECONDS, increment, timer
 
 LOG = logging.getLogger(__name__)
 
@@ -24,6 +28,8 @@ class SwinstallStackMgr(object):
     uses at runtime to draw upon.
     """
     registry = {}
+    # stacks recently found not to exist, shared by the managers of a process
+    missing = NegativeCache.from_environment()
 
     @classmethod
     def register(cls, schema):
@@ -37,9 +43,22 @@ class SwinstallStackMgr(object):
         """
         cls.registry[schema.schema_version] = schema
 
-    def __init__(self):
-        """Initialize the parent class"""
+    def __init__(self, cache=None, missing=None):
+        """Initialize the parent class
+
+        :param cache: local cache of parsed stacks, consulted before a stack is
+                      read. Defaults to the cache configured by
+                      SWINSTALL_STACK_CACHE, if any
+        :type cache: cache.StackCache | None
+        :param missing: cache of stacks found not to exist. Defaults to the one
+                        shared by the managers of the process, whose ttl is set
+                        by SWINSTALL_STACK_MISSING_TTL
+        :type missing: cache.NegativeCache | None
+        """
         super(SwinstallStackMgr, self).__init__()
+        self.cache = cache if cache is not None else StackCache.from_environment()
+        if missing is not None:
+            self.missing = missing
 
     @staticmethod
     def _swinstall_stack_from_file(swinstalled_file):
@@ -57,31 +76,164 @@ class SwinstallStackMgr(object):
         return os.path.join(dir_name, "bak", file_name, \
                 "{}_swinstall_stack".format(file_name))
 
-    def parse(self, swinstalled_file):
+    def exists(self, swinstalled_file):
+        """Return whether a swinstalled file has a swinstall_stack. Stacks found
+        missing are remembered for a short while, so repeated probes do not
+        each reach the file server.
+
+        :param swinstalled_file: fullpath to swinstalled file
+        :type swinstalled_file: str
+
+        :rtype: bool
+        """
+        stack = self._swinstall_stack_from_file(swinstalled_file)
+        if stack in self.missing:
+            return False
+        if os.path.exists(stack):
+            return True
+        self.missing.add(stack)
+        return False
+
+    def create(self, swinstalled_file, schema_version="2"):
+        """Create the bak directory and an empty swinstall_stack for a swinstalled
+        file which has never been installed. The stack is written under a temporary
+        name and hard linked into place, so concurrent creators never observe a
+        partially written stack, and an existing stack is never overwritten.
+
+        :param swinstalled_file: fullpath to swinstalled file
+        :type swinstalled_file: str
+        :param schema_version: schema version of the new stack
+        :type schema_version: str
+
+        :returns: True if the stack was created, False if it already existed
+        :rtype: bool
+
+        :raises: KeyError if the schema version is not registered
+        """
+        if not self.__class__.registry.has_key(schema_version):
+            raise KeyError("Schema registry missing schema version: {}. Registered versions:{}"\
+            .format(schema_version, self.__class__.registry.keys()))
+        stack = self._swinstall_stack_from_file(swinstalled_file)
+        self.missing.discard(stack)
+        if os.path.exists(stack):
+            return False
+        dirname = os.path.dirname(stack)
+        try:
+            os.makedirs(dirname)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+        root = Element("stack_history", attrib={"path": stack, "schema": schema_version})
+        handle, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".swinstall_stack")
+        try:
+            with os.fdopen(handle, "wb") as filehandle:
+                filehandle.write(serialize(root))
+                filehandle.flush()
+                os.fsync(filehandle.fileno())
+            os.chmod(tmp_path, file_mode(stack))
+            os.link(tmp_path, stack)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            LOG.debug("%s was created concurrently", stack)
+            return False
+        finally:
+            os.remove(tmp_path)
+        LOG.info("created swinstall_stack %s", stack)
+        return True
+
+    def _check_missing(self, swinstall_stack):
+        """Raise the error reading a stack would, if it was recently found missing."""
+        if swinstall_stack in self.missing:
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), swinstall_stack)
+
+    def _read(self, swinstall_stack):
+        """Read and parse a swinstall_stack, through the cache if there is one.
+
+        :returns: root element, compression codec and token of the stack
+        :rtype: tuple(Element, str | None, concurrency.StackToken)
+
+        :raises: IOError if the stack does not exist
+        """
+        self._check_missing(swinstall_stack)
+        with timer(PARSE_SECONDS, reader="tree"):
+            cache = self.cache
+            if cache is not None:
+                token = stat_token(swinstall_stack)
+                cached = cache.get(swinstall_stack, token) if token is not None else None
+                increment(CACHE, result="miss" if cached is None else "hit")
+                if cached is not None:
+                    return cached + (token,)
+            try:
+                data, codec, token = read_stack_token(swinstall_stack)
+            except IOError as err:
+                if err.errno == errno.ENOENT:
+                    self.missing.add(swinstall_stack)
+                raise
+            root = fromstring(data)
+            if cache is not None:
+                cache.put(swinstall_stack, token, codec, root)
+            return (root, codec, token)
+
+    def parse(self, swinstalled_file, create=False):
         """Given the full path to a versionless swinstalled file, locate the swinstall
         stack and parse the stack to determine the schema version. then,
         invoke the approprate subclass parsing method, returning an initialized
-        subclass of SchemaCommon.
+        subclass of SchemaCommon. Compressed stacks are decompressed transparently.
 
         :param swinstalled_file: fullpath to swinstalled file
         :type swinstalled_file: str
+        :param create: create an empty stack if the file has never been installed.
+                       See create
+        :type create: bool
 
         :returns: SchemaCommon subclass instance
         :rtype: SchemaCommon subclass
 
         :raises: ValueError if unable to identify schema version
+        :raises: IOError if the stack does not exist
         """
         cls = self.__class__
-        start_time = int(time.time())
+        if create:
+            self.create(swinstalled_file)
 
-        tree = ET.parse(self._swinstall_stack_from_file(swinstalled_file))
-        root = tree.getroot()
+        root, codec, token = self._read(self._swinstall_stack_from_file(swinstalled_file))
         schema_version = root.attrib.get("schema", DEFAULT_SCHEMA)
         
         if schema_version:
             if not cls.registry.has_key(schema_version):
                 raise KeyError("Schema registry missing schema version: {}. Registered versions:{}"\
                 .format(schema_version, cls.registry.keys()))
-            return cls.registry.get(schema_version)(root, start_time)
+            increment(PARSES, schema=schema_version, reader="tree")
+            return cls.registry.get(schema_version)(root, token, codec)
 
         raise ValueError("Root xml element does not have schema attribute")
+
+    def parse_columns(self, swinstalled_file):
+        """Given the full path to a versionless swinstalled file, read its swinstall
+        stack into columns rather than ElementTree nodes. The returned schema
+        answers the same read queries as the one returned by parse, holding far
+        less memory per entry, but cannot modify the stack.
+
+        :param swinstalled_file: fullpath to swinstalled file
+        :type swinstalled_file: str
+
+        :returns: read only schema
+        :rtype: columnar.ColumnarSchema1 | columnar.ColumnarSchema2
+
+        :raises: KeyError if the schema version is not supported
+        :raises: IOError if the stack does not exist
+        """
+        from .columnar import parse_columns
+        stack = self._swinstall_stack_from_file(swinstalled_file)
+        self._check_missing(stack)
+        try:
+            with timer(PARSE_SECONDS, reader="columnar"):
+                schema = parse_columns(stack)
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                self.missing.add(stack)
+            raise
+        increment(PARSES, schema=schema.schema_version, reader="columnar")
+        return schema
@@ -0,0 +1,354 @@
+"""
+metrics.py
+
+Counters and histograms of stack operations, optionally written to a file in
+the Prometheus text exposition format, for collection by the node_exporter
+textfile collector. Events are accumulated in memory and merged into the
+textfile at most once per flush interval and at exit, so recording an event
+costs a dictionary update. Every process on a host may share one textfile:
+each flush adds the process's counts to those already in the file. A forked
+process starts from an empty registry, as its parent flushes the counts it
+had recorded, and pool workers, which exit without running atexit handlers,
+flush at the end of each task.
+"""
+
+import atexit
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from .concurrency import atomic_write
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ("BUCKETS", "FAMILIES", "Metrics", "counted", "flushed", "increment", "observe",
+           "timer")
+
+LOG = logging.getLogger(__name__)
+
+# environment variables used to configure the textfile
+TEXTFILE_ENV = "SWINSTALL_STACK_METRICS_TEXTFILE"
+INTERVAL_ENV = "SWINSTALL_STACK_METRICS_INTERVAL"
+
+PARSES = "swinstall_stack_parses_total"
+PARSE_SECONDS = "swinstall_stack_parse_seconds"
+CACHE = "swinstall_stack_cache_lookups_total"
+LOOKUPS = "swinstall_stack_lookups_total"
+OPERATIONS = "swinstall_stack_operations_total"
+SAVE_SECONDS = "swinstall_stack_save_seconds"
+CONFLICTS = "swinstall_stack_conflicts_total"
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+# type and help text of each metric family, in the order they are written
+FAMILIES = (
+    (PARSES, COUNTER, "Stacks parsed, by schema version and reader."),
+    (PARSE_SECONDS, HISTOGRAM, "Time spent reading and parsing a stack, by reader."),
+    (CACHE, COUNTER, "Lookups in the local stack cache, by result."),
+    (LOOKUPS, COUNTER, "Queries answered by a stack, by method."),
+    (OPERATIONS, COUNTER, "Modifications of a stack committed, by operation."),
+    (SAVE_SECONDS, HISTOGRAM, "Time spent saving a stack, waiting for its lock included."),
+    (CONFLICTS, COUNTER,
+     "Saves which found the stack modified by another writer, by outcome."),
+)
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(labels):
+    """Format labels as they appear in a sample."""
+    return ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for name, value in labels)
+
+def _sample(name, labels):
+    return "{}{{{}}}".format(name, _labels(labels)) if labels else name
+
+def _bound(bound):
+    return repr(float(bound))
+
+
+class Metrics(object):
+    """Registry of counters and histograms, flushed to a textfile if one is set.
+    """
+    DEFAULT_INTERVAL = 10.0
+
+    def __init__(self, textfile=None, flush_interval=DEFAULT_INTERVAL):
+        """
+        :param textfile: path of the file metrics are written to. None keeps
+                         them in memory only
+        :type textfile: str | None
+        :param flush_interval: minimum number of seconds between writes to the textfile
+        :type flush_interval: float
+        """
+        self.textfile = textfile
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # counts recorded since the last flush. counters by (name, labels),
+        # histograms by (name, labels) as per bucket counts followed by the sum
+        self._counters = {}
+        self._histograms = {}
+        self._next_flush = time.time() + flush_interval
+        # process the counts were recorded in
+        self._pid = os.getpid()
+
+    def __repr__(self):
+        return "Metrics <textfile:{} flush_interval:{}>".format(self.textfile, self.flush_interval)
+
+    @classmethod
+    def from_environment(cls, environ=None):
+        """Construct the registry writing to SWINSTALL_STACK_METRICS_TEXTFILE every
+        SWINSTALL_STACK_METRICS_INTERVAL seconds.
+
+        :param environ: mapping to read the configuration from. Defaults to os.environ
+        :type environ: dict
+
+        :rtype: Metrics
+        """
+        environ = os.environ if environ is None else environ
+        return cls(environ.get(TEXTFILE_ENV) or None,
+                   float(environ.get(INTERVAL_ENV, cls.DEFAULT_INTERVAL)))
+
+    def _check_fork(self):
+        """Forget the counts inherited from the parent process after a fork, as
+        the parent flushes them itself. The lock is replaced too, as another
+        thread of the parent may have held it when the process forked."""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._lock = threading.Lock()
+            self._counters = {}
+            self._histograms = {}
+            self._next_flush = time.time() + self.flush_interval
+            self._pid = pid
+
+    def increment(self, name, labels=(), value=1):
+        """Add value to a counter.
+
+        :param name: name of the counter
+        :type name: str
+        :param labels: sorted (name, value) pairs of labels
+        :type labels: tuple(tuple(str, str))
+        :param value: amount to add
+        :type value: int | float
+        """
+        key = (name, labels)
+        self._check_fork()
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, value, labels=()):
+        """Record a value in a histogram.
+
+        :param name: name of the histogram
+        :type name: str
+        :param value: observed value, in seconds
+        :type value: float
+        :param labels: sorted (name, value) pairs of labels
+        :type labels: tuple(tuple(str, str))
+        """
+        key = (name, labels)
+        self._check_fork()
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            histogram[bisect_left(BUCKETS, value)] += 1
+            histogram[-1] += value
+        self._maybe_flush()
+
+    @contextmanager
+    def timer(self, name, labels=()):
+        """Record the time spent in a block in a histogram, whether or not it
+        raises."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, labels)
+
+    def samples(self):
+        """Return the samples recorded since the last flush, as they are written
+        to the textfile: histograms as cumulative buckets, sum and count.
+
+        :returns: value by sample
+        :rtype: dict(str, float)
+        """
+        self._check_fork()
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict((key, list(value)) for key, value in self._histograms.items())
+        return _samples(counters, histograms)
+
+    def _maybe_flush(self):
+        if self.textfile is not None and time.time() >= self._next_flush:
+            self.flush()
+
+    def _merge(self, counters, histograms):
+        """Add counts taken from the registry back into it."""
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, value in histograms.items():
+                histogram = self._histograms.setdefault(key, [0] * len(value))
+                for index, count in enumerate(value):
+                    histogram[index] += count
+
+    def flush(self):
+        """Add the samples recorded since the last flush to those in the textfile.
+        Concurrent flushes from other processes are serialized by a lock file
+        next to the textfile. Errors are logged rather than raised, so that
+        metrics never fail a stack operation; the samples are kept for the
+        next flush.
+        """
+        self._next_flush = time.time() + self.flush_interval
+        if self.textfile is None:
+            return
+        self._check_fork()
+        with self._lock:
+            counters, histograms = self._counters, self._histograms
+            self._counters, self._histograms = {}, {}
+        if not counters and not histograms:
+            return
+        try:
+            with open(self.textfile + ".lock", "a") as lock:
+                if fcntl is not None:
+                    fcntl.lockf(lock, fcntl.LOCK_EX)
+                samples = _read_textfile(self.textfile)
+                for sample, value in _samples(counters, histograms).items():
+                    samples[sample] = samples.get(sample, 0) + value
+                atomic_write(self.textfile, _render(samples))
+        except (IOError, OSError) as err:
+            LOG.warning("unable to write metrics to %s: %s", self.textfile, err)
+            self._merge(counters, histograms)
+
+    def reset(self):
+        """Forget the samples recorded since the last flush."""
+        self._check_fork()
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+
+def _samples(counters, histograms):
+    """Convert counts to samples. See Metrics.samples"""
+    samples = {}
+    for (name, labels), value in counters.items():
+        samples[_sample(name, labels)] = value
+    for (name, labels), histogram in histograms.items():
+        count = 0
+        for bound, bucket in zip(BUCKETS + (None,), histogram[:-1]):
+            count += bucket
+            le = _bound(bound) if bound is not None else "+Inf"
+            samples[_sample(name + "_bucket", labels + (("le", le),))] = count
+        samples[_sample(name + "_sum", labels)] = histogram[-1]
+        samples[_sample(name + "_count", labels)] = count
+    return samples
+
+def _read_textfile(path):
+    """Read the samples in a textfile written by _render."""
+    samples = {}
+    try:
+        with open(path) as filehandle:
+            for line in filehandle:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                sample, _, value = line.rstrip("\n").rpartition(" ")
+                try:
+                    samples[sample] = float(value)
+                except ValueError:
+                    LOG.debug("skipping malformed sample in %s: %s", path, line)
+    except IOError:
+        pass
+    return samples
+
+def _family(sample):
+    name = sample.split("{", 1)[0]
+    for family, kind, _ in FAMILIES:
+        if name == family or (kind == HISTOGRAM and name in (family + "_bucket", family + "_sum",
+                                                             family + "_count")):
+            return family
+    return None
+
+def _render(samples):
+    """Format samples in the Prometheus text exposition format."""
+    by_family = {}
+    for sample, value in samples.items():
+        by_family.setdefault(_family(sample), []).append((sample, value))
+    lines = []
+    for family, kind, help_text in FAMILIES:
+        if family not in by_family:
+            continue
+        lines.append("# HELP {} {}".format(family, help_text))
+        lines.append("# TYPE {} {}".format(family, kind))
+        for sample, value in sorted(by_family[family], key=_sort_key):
+            lines.append("{} {}".format(sample, _value(value)))
+    # samples of families this version does not know about are kept as they are
+    for sample, value in sorted(by_family.get(None, ())):
+        lines.append("{} {}".format(sample, _value(value)))
+    return "\n".join(lines) + "\n"
+
+def _sort_key(item):
+    """Order samples by name and labels, and buckets by their bound."""
+    sample = item[0]
+    if '_bucket{' in sample:
+        prefix, _, bound = sample.rpartition('le="')
+        bound = bound.rstrip('"}')
+        return (prefix, float("inf") if bound == "+Inf" else float(bound))
+    return (sample, 0)
+
+def _value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# registry of the process
+METRICS = Metrics.from_environment()
+atexit.register(lambda: METRICS.flush())
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+def increment(name, value=1, **labels):
+    """Add value to a counter of the process registry. See Metrics.increment"""
+    METRICS.increment(name, _key(labels), value)
+
+def observe(name, value, **labels):
+    """Record a value in a histogram of the process registry. See Metrics.observe"""
+    METRICS.observe(name, value, _key(labels))
+
+def timer(name, **labels):
+    """Time a block into a histogram of the process registry. See Metrics.timer"""
+    return METRICS.timer(name, _key(labels))
+
+def counted(name, **labels):
+    """Decorate a function so that each call increments a counter of the process
+    registry."""
+    labels = _key(labels)
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            METRICS.increment(name, labels)
+            return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def flushed(function):
+    """Decorate a pool worker so that the counts recorded by each task are
+    flushed when it returns, as pool workers exit without running atexit
+    handlers. Called in the main process, as when a pool of one process runs
+    its tasks serially, the function is left to the regular flushes."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if multiprocessing.current_process().name != "MainProcess":
+                METRICS.flush()
+    return wrapper
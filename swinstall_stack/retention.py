@@ -0,0 +1,254 @@
+"""
+retention.py
+
+Garbage collection of the versioned files kept in bak directories. A
+retention policy decides which versions of each swinstalled file are kept;
+the versioned files of every other version installed by its stack are
+removed. The stack itself keeps its full history. It records the datetime of
+the newest entry whose file was collected, so that fsck does not report the
+collected files as missing.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+import errno
+import logging
+import os
+from .constants import COLLECTED_UNTIL
+from .manager import SwinstallStackMgr
+from .metrics import flushed
+from .schemas import import_schemas
+from .utils import (datetime_from_str, datetime_revision_from_str, datetime_to_str,
+                    find_swinstalled_files, init_worker_throttle, pool_worker, rate_limited_pool,
+                    worker_throttle)
+
+__all__ = ("COLLECTED_UNTIL", "Collection", "RetentionPolicy", "collect_stack", "gc", "plan")
+
+LOG = logging.getLogger(__name__)
+
+class RetentionPolicy(object):
+    """Which versions of a swinstalled file to keep. A version is kept if it is
+    one of the keep_last most recently installed, if an entry referring to it
+    is newer than keep_days, if it is current, or if it is the target of a
+    single step rollback or of a rollforward from the current version.
+    """
+    def __init__(self, keep_last=None, keep_days=None):
+        """
+        :param keep_last: number of most recently installed versions to keep
+        :type keep_last: int | None
+        :param keep_days: age in days under which versions are kept
+        :type keep_days: float | None
+
+        :raises: ValueError if neither keep_last nor keep_days is supplied
+        """
+        if keep_last is None and keep_days is None:
+            raise ValueError("a retention policy requires keep_last and/or keep_days")
+        self.keep_last = keep_last
+        self.keep_days = keep_days
+
+    def __repr__(self):
+        return "RetentionPolicy <keep_last:{} keep_days:{}>".format(self.keep_last, self.keep_days)
+
+    def cutoff(self, now=None):
+        """Return the datetime before which entries are too old to keep a version.
+
+        :param now: time the policy is applied at. Defaults to now
+        :type now: datetime | None
+
+        :rtype: datetime | None
+        """
+        if self.keep_days is None:
+            return None
+        return (now or datetime.now()) - timedelta(days=self.keep_days)
+
+
+class Collection(namedtuple("Collection", "swinstalled_file paths size")):
+    """The versioned files collected from a swinstalled file's bak directory,
+    and their total size in bytes.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "{}: {} files {} bytes".format(self.swinstalled_file, len(self.paths), self.size)
+
+
+def _schema1_history(schema):
+    """Return the version and datetime of each entry of a schema 1 stack, newest
+    first, the versions a rollback or rollforward may target, and the
+    versioned file of each version."""
+    versions = [elt.attrib.get("version") for elt in schema.root]
+    current = schema._current_index()
+    history = [(version, datetime_revision_from_str(version)[0])
+               for version in reversed(versions)]
+    targets = set(versions[max(0, current - 1):])
+    files = dict((version, schema._versioned_file(*datetime_revision_from_str(version)))
+                 for version in versions)
+    return history, targets, files
+
+def _schema2_history(schema):
+    """See _schema1_history. Only installs have a versioned file of their own."""
+    history = []
+    files = {}
+    for elt in schema._elements():
+        version = elt.attrib.get("version")
+        history.append((version, datetime_from_str(elt.attrib.get("datetime"))))
+        if elt.attrib.get("action") == "install":
+            files[version] = schema._versioned_file(version)
+    current = schema.current_version()
+    targets = set(str(version)
+                  for version in xrange(current - 1, schema._max_installed_version() + 1))
+    return history, targets, files
+
+def plan(schema, policy, now=None):
+    """Determine the versioned files of a stack which a policy does not keep.
+    Only files which exist are returned.
+
+    :param schema: the parsed stack
+    :type schema: Schema1 | Schema2
+    :param policy: retention policy
+    :type policy: RetentionPolicy
+    :param now: time the policy is applied at. Defaults to now
+    :type now: datetime | None
+
+    :returns: path and size of each file to collect, and the datetime of the
+              newest entry referring to one of them
+    :rtype: tuple(list(tuple(str, int)), datetime | None)
+    """
+    if not len(schema.root):
+        return ([], None)
+    if schema.schema_version == "1":
+        history, kept, files = _schema1_history(schema)
+    else:
+        history, kept, files = _schema2_history(schema)
+    cutoff = policy.cutoff(now)
+    installed = []
+    newest = {}
+    for version, date_time in history:
+        newest.setdefault(version, date_time)
+        if version in files and version not in installed:
+            installed.append(version)
+        if cutoff is not None and date_time > cutoff:
+            kept.add(version)
+    if policy.keep_last is not None:
+        kept.update(installed[:max(1, policy.keep_last)])
+
+    collected = []
+    until = None
+    for version in installed:
+        if version in kept:
+            continue
+        try:
+            size = os.stat(files[version]).st_size
+        except OSError:
+            # already collected, or never installed
+            continue
+        collected.append((files[version], size))
+        until = newest[version] if until is None else max(until, newest[version])
+    return (collected, until)
+
+def _mark_collected(schema, policy, now, collection):
+    """Plan the collection of a stack and record it in the stack. Applied through
+    schema._commit, so that the plan is remade from the stack as saved by any
+    writer that got there first.
+
+    :param collection: single item list receiving the plan
+    :type collection: list
+    """
+    collected, until = plan(schema, policy, now)
+    collection[0] = collected
+    if not collected:
+        return
+    previous = schema.root.attrib.get(COLLECTED_UNTIL)
+    if previous is None or datetime_from_str(previous) < until:
+        schema.root.attrib[COLLECTED_UNTIL] = datetime_to_str(until)
+        schema._save()
+
+def collect_stack(swinstalled_file, policy, dry_run=False, throttle=None, now=None):
+    """Remove the versioned files of a swinstalled file which a policy does not
+    keep. The collection is recorded in the stack before any file is removed.
+
+    :param swinstalled_file: full path to the versionless swinstalled file
+    :type swinstalled_file: str
+    :param policy: retention policy
+    :type policy: RetentionPolicy
+    :param dry_run: whether to only report the files which would be removed
+    :type dry_run: bool
+    :param throttle: optional callable, called with 1 before each file is removed,
+                     used to rate limit removals. See utils.RateLimiter
+    :type throttle: callable | None
+    :param now: time the policy is applied at. Defaults to now
+    :type now: datetime | None
+
+    :returns: the files removed, or which would be removed by a dry run
+    :rtype: Collection
+    """
+    import_schemas()
+    schema = SwinstallStackMgr().parse(swinstalled_file)
+    if dry_run:
+        collected = plan(schema, policy, now)[0]
+    else:
+        collection = [[]]
+        schema._commit(_mark_collected, policy, now, collection)
+        collected = []
+        for path, size in collection[0]:
+            if throttle is not None:
+                throttle(1)
+            try:
+                os.remove(path)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                continue
+            collected.append((path, size))
+    LOG.debug("%s %s files from %s", "would collect" if dry_run else "collected",
+              len(collected), swinstalled_file)
+    return Collection(swinstalled_file, [path for path, _ in collected],
+                      sum(size for _, size in collected))
+
+@flushed
+@pool_worker("collect", lambda swinstalled_file, err: Collection(swinstalled_file, [], 0))
+def _collect_stack_worker(args):
+    """Pool worker wrapping collect_stack."""
+    swinstalled_file, policy, dry_run, now = args
+    return collect_stack(swinstalled_file, policy, dry_run, worker_throttle(), now)
+
+def gc(root, policy, processes=None, dry_run=False, rate_limit=None, now=None):
+    """Collect the versioned files of every swinstall_stack under root which a
+    policy does not keep, yielding what was collected from each stack as it
+    completes. Stacks are collected in parallel by a pool of worker processes.
+
+    :param root: directory to collect
+    :type root: str
+    :param policy: retention policy
+    :type policy: RetentionPolicy
+    :param processes: number of worker processes. Defaults to the number of cpus.
+                      A value of 1 collects stacks in the calling process.
+    :type processes: int | None
+    :param dry_run: whether to only report the files which would be removed
+    :type dry_run: bool
+    :param rate_limit: maximum number of files removed per second, shared
+                       between the worker processes
+    :type rate_limit: float | None
+    :param now: time the policy is applied at. Defaults to now
+    :type now: datetime | None
+
+    :returns: generator of collections
+    :rtype: generator(Collection)
+    """
+    now = now or datetime.now()
+    work = [(swinstalled_file, policy, dry_run, now)
+            for swinstalled_file in find_swinstalled_files(root)]
+    pool = None
+    try:
+        if processes == 1:
+            init_worker_throttle(rate_limit)
+            results = (_collect_stack_worker(args) for args in work)
+        else:
+            pool = rate_limited_pool(processes, rate_limit)
+            results = pool.imap_unordered(_collect_stack_worker, work)
+        for collection in results:
+            yield collection
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
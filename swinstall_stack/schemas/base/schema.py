@@ -4,29 +4,76 @@ schema.py
 base classes for swinstall stack schemas
 """
 
+from datetime import datetime
+import functools
 import logging
 import os
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
-from ...constants import DEFAULT_SCHEMA
-
-__all__ = ("SchemaCommon", "SchemaBase")
+import time
+from ...backend import fromstring, serialize
+from ...compression import compress, site_policy
+from ...concurrency import (GENERATION, ConcurrentModificationError, StackToken,
+                            atomic_write, read_stack_token,
+                            retry_delays, stack_lock)
+from ...constants import COLLECTED_UNTIL, DEFAULT_SCHEMA
+from ...links import update_link
+from ...metrics import CONFLICTS, OPERATIONS, SAVE_SECONDS, increment, timer
+from ...utils import datetime_from_str, epoch_from_datetime, epoch_from_str
+
+__all__ = ("SchemaCommon", "SchemaBase", "rebase_on_conflict", "serialize")
 
 LOG = logging.getLogger(__name__)
 
+# operation label of the metrics of methods which modify the stack, where it
+# differs from the name of the method
+_OPERATIONS = {"insert_element": "install", "install_hash": "install",
+               "_install_version": "install",
+               "rollback_element": "rollback", "rollback_to": "rollback",
+               "rollforward_element": "rollforward", "_mark_collected": "gc",
+               "_save_batch": "batch"}
+
+def rebase_on_conflict(method):
+    """Decorate a method which modifies and saves the stack, so that if the
+    save finds the stack was modified by another writer, the stack is reloaded
+    and the method re-applied to the fresh stack. See SchemaCommon._commit
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self._commit(method, *args, **kwargs)
+    return wrapper
+
 class SchemaCommon(object):
     """Superclass with common methods.
     """
     schema_version = None
-
-    def __init__(self, root, start_time):
+    # CompressionPolicy deciding how the stack is written by _save. None
+    # defers to the site policy configured in the environment.
+    compression_policy = None
+    # number of times a conflicting save is rebased before giving up, and
+    # the bounds in seconds of the backoff between attempts
+    max_retries = 8
+    retry_delay = 0.01
+    max_retry_delay = 0.5
+
+    def __init__(self, root, start_time, codec=None):
         """Initialize the BaseSchema class, validating the schema_version registered
         on the parent class against the schema version declared in the root xml element.
 
         :param root: Root xml Element of class ElementTree.Node
         :type root: ElementTree.Element
+        :param start_time: token of the stack file the root was read from. An edit
+                           start time (seconds since the epoch or a datetime) is
+                           accepted for stacks constructed by hand, in which case
+                           saves are checked against the file modification time.
+        :type start_time: StackToken | datetime | int
+        :param codec: compression codec the stack was read with, if any
+        :type codec: str | None
         """
         self._start_time = start_time
+        self._codec = codec
+        self._committing = False
+        # set while a writebehind.WriteBehind applies queued modifications,
+        # which it saves together
+        self._deferred = False
         self._validate_schema_version(root)
         self._root = root
         self._swinstall_stack = root.attrib.get("path")
@@ -51,25 +98,155 @@ class SchemaCommon(object):
         """
         return os.path.basename(self.root_dirname())
 
+    def versionless_path(self):
+        """Return the full path to the versionless swinstalled file, which lives
+        alongside the bak directory holding the stack.
+
+        :returns: full path to the versionless swinstalled file
+        :rtype: str
+        """
+        return os.path.join(os.path.dirname(os.path.dirname(self.root_dirname())),
+                            self.versionless_filename())
+
+    def update_link(self, fsync=True):
+        """Atomically point the versionless swinstalled file at the versioned file
+        of the current entry.
+
+        :param fsync: whether to fsync the directory containing the link
+        :type fsync: bool
+
+        :returns: None
+        """
+        update_link(self.versionless_path(), self.current().path, fsync)
+
+    def _check_not_collected(self, version, date_time, versioned_file):
+        """Verify that a rollback or rollforward target still has its versioned
+        file. Retention records the newest entry whose file it collected; an
+        entry at or before it whose file is gone may not be made current, as
+        the versionless file would be left pointing at nothing.
+
+        :param version: version of the target, for the error message
+        :param date_time: datetime of the newest entry referring to the target
+        :type date_time: datetime
+        :param versioned_file: full path to the versioned file of the target
+        :type versioned_file: str
+
+        :raises: LookupError if the versioned file of the target was collected
+        """
+        collected_until = self.root.attrib.get(COLLECTED_UNTIL)
+        if collected_until is None or date_time > datetime_from_str(collected_until):
+            return
+        if not os.path.exists(versioned_file):
+            raise LookupError("version {} of {} was collected: {} no longer exists"\
+                              .format(version, self.swinstall_stack, versioned_file))
+
+    def _check_unmodified(self, filehandle):
+        """Verify that the stack on disk is the one this instance was read from.
+
+        :param filehandle: the stack file, open and locked
+        :type filehandle: file
+
+        :raises: ConcurrentModificationError if another writer has saved the stack
+        """
+        output = filehandle.name
+        if isinstance(self._start_time, StackToken):
+            # a touch also changes the token. It is treated as a conflict, as
+            # tools which predate generations rewrite the stack keeping the
+            # generation they read, and the rebase costs no more than a reload
+            if StackToken.from_stat(os.fstat(filehandle.fileno())) == self._start_time:
+                return
+            raise ConcurrentModificationError("{} was modified after it was read".format(output))
+
+        start_time = self._start_time
+        if isinstance(start_time, datetime):
+            start_time = time.mktime(start_time.timetuple())
+        mod_time = int(os.fstat(filehandle.fileno()).st_mtime)
+        LOG.debug("start time: %s mod time: %s", start_time, mod_time)
+        if mod_time > int(start_time):
+            raise ConcurrentModificationError("{} modification time: {} later than edit start time: {}"\
+                                              .format(output, mod_time, start_time))
+
     def _save(self):
-        # TODO - validate that file modification time < self.start_time or raise RuntimeError
+        """Write the stack to disk, bumping its generation. The stack is written
+        under the stack lock, to a temporary file which is renamed into place.
+        Does nothing while saves are deferred.
 
-        xmlstr = minidom.parseString(ET.tostring(self.root))\
-            .toprettyxml(indent="   ", encoding='UTF-8')
-        xmlstr = os.linesep.join([s for s in xmlstr.splitlines() if s.strip()])
+        :raises: ConcurrentModificationError if another writer has saved the stack
+                 since it was read
+        """
+        if self._deferred:
+            return
         output = self.root.attrib.get("path")
         LOG.debug("outputing to %s", output)
-        mod_time = int(os.path.getmtime(output))
-        LOG.debug("start time: {}".format(self._start_time))
-        LOG.debug("mod time: {}".format(mod_time))
-        if mod_time > self._start_time:
-            raise RuntimeError("{} modification time: {} later than edit start time: {}",
-                output,
-                mod_time,
-                self._start_time
-            )
-        with open(output, "w") as filehandle:
-            filehandle.write(xmlstr)
+        with timer(SAVE_SECONDS, schema=self.schema_version), stack_lock(output) as filehandle:
+            self._check_unmodified(filehandle)
+            generation = self.root.attrib.get(GENERATION)
+            self.root.attrib[GENERATION] = str((self.generation or 0) + 1)
+            try:
+                xmlstr = serialize(self.root)
+                codec = (self.compression_policy or site_policy()).codec_for(xmlstr, self._codec)
+                token = atomic_write(output, compress(xmlstr, codec))
+            except Exception:
+                if generation is None:
+                    del self.root.attrib[GENERATION]
+                else:
+                    self.root.attrib[GENERATION] = generation
+                raise
+        self._codec = codec
+        self._start_time = token
+
+    def _reload(self):
+        """Replace the instance's stack with the one on disk."""
+        data, codec, token = read_stack_token(self.root.attrib.get("path"))
+        root = fromstring(data)
+        self._validate_schema_version(root)
+        self._root = root
+        self._codec = codec
+        self._start_time = token
+        self._reset()
+
+    def _reset(self):
+        """Discard any state derived from the stack, after it has been reloaded.
+        Subclasses caching such state extend this."""
+        pass
+
+    def _commit(self, method, *args, **kwargs):
+        """Apply a method which modifies and saves the stack. If the save finds
+        that another writer has saved the stack since it was read, the stack is
+        reloaded and the method applied again, with a backoff between attempts,
+        so that the modification is rebased upon the other writer's.
+
+        :param method: unbound method to apply
+        :type method: function
+
+        :returns: the result of the method
+
+        :raises: ConcurrentModificationError if the method still conflicts after
+                 max_retries attempts
+        """
+        if self._committing:
+            return method(self, *args, **kwargs)
+        self._committing = True
+        try:
+            delays = retry_delays(self.max_retries, self.retry_delay, self.max_retry_delay)
+            while True:
+                try:
+                    result = method(self, *args, **kwargs)
+                except ConcurrentModificationError as err:
+                    delay = next(delays, None)
+                    if delay is None:
+                        increment(CONFLICTS, outcome="failed")
+                        raise
+                    increment(CONFLICTS, outcome="retried")
+                    LOG.debug("%s. retrying %s in %.3fs", err, method.__name__, delay)
+                    time.sleep(delay)
+                    self._reload()
+                else:
+                    operation = _OPERATIONS.get(method.__name__, method.__name__)
+                    increment(OPERATIONS, operation=operation, schema=self.schema_version)
+                    return result
+        finally:
+            self._committing = False
 
     def _validate_schema_version(self, root):
         """Validate the schema version of the calling class against the schema version
@@ -87,6 +264,24 @@ class SchemaCommon(object):
             raise ValueError("wrong schema version {} for class: {} schema:{}"\
             .format(root_schema_version, self.__class__.__name__, self.__class__.schema_version))
 
+    @staticmethod
+    def _history_bounds(start, end):
+        """Convert the start and end of a history query to seconds since the epoch.
+
+        :param start: datetime | str | None
+        :param end: datetime | str | None
+
+        :returns: start and end as epoch seconds. missing bounds are unbounded
+        :rtype: tuple(float, float)
+        """
+        def to_epoch(value, default):
+            if value is None:
+                return default
+            if isinstance(value, basestring):
+                return epoch_from_str(value)
+            return epoch_from_datetime(value)
+        return (to_epoch(start, float("-inf")), to_epoch(end, float("inf")))
+
     @property
     def swinstall_stack(self):
         """The full path to the swinstall_stack file.
@@ -96,6 +291,25 @@ class SchemaCommon(object):
         """
         return self._swinstall_stack
 
+    @property
+    def generation(self):
+        """The number of times the stack has been saved.
+
+        :returns: generation of the stack, or None if it has never been saved
+        :rtype: int | None
+        """
+        generation = self.root.attrib.get(GENERATION)
+        return int(generation) if generation is not None else None
+
+    @property
+    def codec(self):
+        """The compression codec the stack is stored with.
+
+        :returns: name of the codec, or None for a plain stack
+        :rtype: str | None
+        """
+        return self._codec
+
     @property
     def root(self):
         """The root Element of the schemas document.
@@ -146,25 +360,53 @@ class SchemaBase(object):
         """
         raise NotImplementedError()
 
+    def history(self, start=None, end=None, actions=None):
+        """Generate metadata for the entries in the stack, newest first.
+
+        :param start: only entries on or after start are generated
+        :type start: datetime | str
+        :param end: only entries on or before end are generated
+        :type end: datetime | str
+        :param actions: only entries whose action is in actions are generated
+        :type actions: sequence(str) | None
+
+        :returns: generator of metadata
+        :rtype: generator(FileMetadata)
+        """
+        raise NotImplementedError()
+
     def insert_element(self, *args, **kwargs):
         """Insert a new element with the supplied properties
         """
         raise NotImplementedError()
 
-    def rollback_element(self, date_time):
-        """Rollback the current entry to point at the previous entry.
+    def rollback_element(self, date_time=None, count=1):
+        """Rollback the current entry to point at the entry count versions before it.
 
         :param date_time: The datetime at which the rollback occured
         :type date_type: datetime instance
+        :param count: number of versions to roll back
+        :type count: int
         """
         raise NotImplementedError()
 
-    def rollforward_element(self, date_time):
-        """Undo a rollback. This only works if the current element was
-        set via a rollback.
+    def rollback_to(self, version, date_time=None):
+        """Rollback the current entry to point at the entry with the supplied version.
 
+        :param version: version of interest
+        :type version: cls._version_type
         :param date_time: The datetime at which the rollback occured
         :type date_type: datetime instance
         """
         raise NotImplementedError()
 
+    def rollforward_element(self, date_time=None, count=1):
+        """Undo a rollback. This only works if the current element was
+        set via a rollback.
+
+        :param date_time: The datetime at which the rollforward occured
+        :type date_type: datetime instance
+        :param count: number of versions to roll forward
+        :type count: int
+        """
+        raise NotImplementedError()
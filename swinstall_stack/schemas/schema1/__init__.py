@@ -8,13 +8,14 @@ Implements Schema1
 from datetime import datetime
 import logging
 import os
-from xml.dom import minidom
 import xml.etree.ElementTree as ET
 from swinstall_stack.manager import SwinstallStackMgr
-from ..base.schema import SchemaCommon, SchemaBase
+from ..base.schema import SchemaCommon, SchemaBase, rebase_on_conflict
 from ...constants import (ELEM, DEFAULT_SCHEMA)
+from ...metrics import LOOKUPS, counted
 from .file_metadata import FileMetadata
-from ...utils import (datetime_from_str, datetime_revision_from_str, datetime_to_str)
+from ...utils import (bisect_descending, datetime_from_str, datetime_revision_from_str,
+                      datetime_to_str, epoch_from_str)
 
 __all__ = ("Schema1",)
 
@@ -28,25 +29,92 @@ class Schema1(SchemaCommon, SchemaBase):
     _action = "action"
     _install = "install"
     _version = "version"
+    # root attribute caching the version of the current entry
+    _current = "current"
 
-    def __init__(self, root, start_time):
+    def __init__(self, root, start_time, codec=None):
         """Initialize Schema1 with the root element of the schemas xml tree.
 
         :param root: root element of document.
-        :type root: ElementTree.Element"""
-        super(Schema1, self).__init__(root, start_time)
+        :type root: ElementTree.Element
+        :param codec: compression codec the stack was read with, if any
+        :type codec: str | None
+        """
+        super(Schema1, self).__init__(root, start_time, codec)
 
+    @counted(LOOKUPS, method="current")
     def current(self):
         """Return metadata corresponding with the current file in the swinstall stack.
         """
+        version = self._current_version_str()
+        date_time, revision = datetime_revision_from_str(version)
+        versioned_filepath = self._versioned_file(date_time, revision)
+        return FileMetadata.init_from_version_str(versioned_filepath, "True", version)
+
+    def _current_version_str(self):
+        """Return the version string of the current entry, trusting the current
+        attribute of the root element, and falling back to scanning for the
+        entry flagged is_current when it is missing.
+
+        :returns: version string of the current entry
+        :rtype: str
+
+        :raises: ValueError if there is no current entry
+        """
+        current = self.root.attrib.get(self._current)
+        if current is not None:
+            return current
         for elt in self.root:
             if elt.attrib.get("is_current") == "True":
-                date_time, revision = datetime_revision_from_str(elt.attrib.get("version"))
-                versioned_filepath = self._versioned_file(date_time, revision)
-                return FileMetadata.init_from_version_str(versioned_filepath, **elt.attrib)
-
+                self.root.attrib[self._current] = elt.attrib.get("version")
+                return elt.attrib.get("version")
         raise ValueError("Unable to find current")
 
+    def _current_index(self):
+        """Return the index of the current entry within the root element. The
+        search runs from the most recent entry backwards, so it only scales with
+        the number of entries which have been rolled back past.
+
+        :returns: index of the current entry
+        :rtype: int
+
+        :raises: ValueError if there is no current entry
+        """
+        current = self._current_version_str()
+        for index in xrange(len(self.root) - 1, -1, -1):
+            if self.root[index].attrib.get("version") == current:
+                return index
+        raise ValueError("Unable to find current version {}".format(current))
+
+    def _set_current(self, index):
+        """Flag the entry at index as current, clearing the flag of the previous
+        current entry. Does not save.
+
+        :param index: index of the new current entry
+        :type index: int
+        """
+        try:
+            self.root[self._current_index()].attrib["is_current"] = "False"
+        except ValueError:
+            LOG.debug("no current entry in %s", self.swinstall_stack)
+        self.root[index].attrib["is_current"] = "True"
+        self.root.attrib[self._current] = self.root[index].attrib.get("version")
+
+    def _make_current(self, index):
+        """Flag the entry at index as current and save, unless the versioned file
+        of the entry was collected.
+
+        :param index: index of the new current entry
+        :type index: int
+
+        :raises: LookupError if the versioned file of the entry was collected
+        """
+        version = self.root[index].attrib.get("version")
+        date_time, revision = datetime_revision_from_str(version)
+        self._check_not_collected(version, date_time, self._versioned_file(date_time, revision))
+        self._set_current(index)
+        self._save()
+
     def next_version(self):
         """Not implmemented for Schema 1.
 
@@ -60,11 +128,12 @@ class Schema1(SchemaCommon, SchemaBase):
         :returns: Current version
         :rtype: datetime
         """
-        for elt in self.root:
-            if elt.attrib.get("is_current") == "True":
-                return datetime_revision_from_str(elt.attrib.get("version"))[0]
-        raise ValueError("No current version")
+        try:
+            return datetime_revision_from_str(self._current_version_str())[0]
+        except ValueError:
+            raise ValueError("No current version")
 
+    @counted(LOOKUPS, method="version")
     def version(self, version):
         """retrieve metadata for the swinstalled file entry with the supplied
         version number.
@@ -87,6 +156,7 @@ class Schema1(SchemaCommon, SchemaBase):
                 return FileMetadata.init_from_version_str(versioned_filepath, **elt.attrib)
         raise KeyError("no version: {} has been published".format(version))
 
+    @counted(LOOKUPS, method="file_on")
     def file_on(self, date_time):
         """Retrieve the versioned file corresponding to the specified date.
 
@@ -133,6 +203,40 @@ class Schema1(SchemaCommon, SchemaBase):
 
         raise LookupError("no version less than or equal to {}".format(datetime_to_str(date_time)))
 
+    def history(self, start=None, end=None, actions=None):
+        """Generate metadata for the entries in the stack, newest first. Entries
+        are appended in chronological order, so the newest entry on or before end
+        is found by binary search, and entries are only decoded as the generator
+        is consumed. Schema 1 only records installs.
+
+        :param start: only entries on or after start are generated
+        :type start: datetime | str
+        :param end: only entries on or before end are generated
+        :type end: datetime | str
+        :param actions: only entries whose action is in actions are generated
+        :type actions: sequence(str) | None
+
+        :returns: generator of metadata
+        :rtype: generator(FileMetadata)
+        """
+        if actions is not None and self._install not in actions:
+            return
+        start, end = self._history_bounds(start, end)
+        last = len(self.root) - 1
+
+        def epoch(index):
+            """seconds since the epoch of the index'th newest element"""
+            return epoch_from_str(self.root[last - index].attrib.get("version"))
+
+        for index in xrange(bisect_descending(last + 1, epoch, end), last + 1):
+            if epoch(index) < start:
+                return
+            elt = self.root[last - index]
+            date_time, revision = datetime_revision_from_str(elt.attrib.get("version"))
+            yield FileMetadata.init_from_version_str(self._versioned_file(date_time, revision),
+                                                     elt.attrib.get("is_current"),
+                                                     elt.attrib.get("version"))
+
     def _versioned_file(self, date_time, revision_str):
         """Given a date_time (datetime | str) and an optional revision_str, return
         the full path to the versioned file"""
@@ -144,10 +248,10 @@ class Schema1(SchemaCommon, SchemaBase):
                                              revision))
 
     def _insert_element_into_root(self, element):
-        for child in self.root:
-            if child.attrib.get("is_current") == "True":
-                child.attrib['is_current'] = "False"
+        # the new element only becomes current once the previous one is cleared
+        element.attrib["is_current"] = "False"
         self.root.append(element)
+        self._set_current(len(self.root) - 1)
         LOG.debug("Added child: %s to root: %s", element.attrib, self.root.attrib)
         self._save()
 
@@ -164,6 +268,7 @@ class Schema1(SchemaCommon, SchemaBase):
                                  "True", date_time, revision)
         self._insert_element_into_root(next_file.element())
 
+    @rebase_on_conflict
     def insert_element(self, *args, **kwargs):
         """Insert a new element with the supplied properties.
         accepts args / kwargs, which should map to the following:
@@ -175,26 +280,64 @@ class Schema1(SchemaCommon, SchemaBase):
         """
         self._insert_element_process_args(*args, **kwargs)
 
-    def rollback_element(self, date_time=datetime.now()):
-        """Rollback the current entry to point at the previous entry.
+    @rebase_on_conflict
+    def rollback_element(self, date_time=None, count=1):
+        """Rollback the current entry to point at the entry count places before it.
+        The stack is saved once, however many steps are rolled back.
 
         :param date_time: The datetime at which the rollback occured
         :type date_type: datetime instance
+        :param count: number of entries to roll back
+        :type count: int
+
+        :raises: IndexError if this would roll back before the first entry
+        :raises: LookupError if the versioned file of the entry was collected
+        :raises: ValueError if count is less than 1
         """
-        # iterate through elements, looking for current
-        # set current to false
-        # set current element index -1 to true
-        # save
-        cnt = 0
-        for elt in self.root:
-            if elt.attrib.get("is_current") == "True":
-                elt.attrib["is_current"] = "False"
-                lookup = cnt -1
-                if lookup < 0:
-                    raise IndexError("Attempt to roll back before start")
-                list(self.root)[lookup].attrib["is_current"] = "True"
-                break
-            cnt += 1
-        self._save()
+        if count < 1:
+            raise ValueError("rollback count must be at least 1, not {}".format(count))
+        lookup = self._current_index() - count
+        if lookup < 0:
+            raise IndexError("Attempt to roll back before start")
+        self._make_current(lookup)
+
+    @rebase_on_conflict
+    def rollback_to(self, version, date_time=None):
+        """Rollback the current entry to point at the entry with the supplied version.
+
+        :param version: version of interest, which must be older than the current one
+        :type version: datetime or str
+        :param date_time: The datetime at which the rollback occured
+        :type date_type: datetime instance
+
+        :raises: KeyError if no entry before the current one has the version
+        :raises: LookupError if the versioned file of the entry was collected
+        """
+        version = datetime_from_str(version) if isinstance(version, basestring) else version
+        for index in xrange(self._current_index() - 1, -1, -1):
+            if datetime_revision_from_str(self.root[index].attrib.get("version"))[0] == version:
+                self._make_current(index)
+                return
+        raise KeyError("no version: {} before the current version".format(version))
+
+    @rebase_on_conflict
+    def rollforward_element(self, date_time=None, count=1):
+        """Undo a rollback, pointing the current entry at the entry count places after it.
+
+        :param date_time: The datetime at which the rollforward occured
+        :type date_type: datetime instance
+        :param count: number of entries to roll forward
+        :type count: int
+
+        :raises: IndexError if this would roll forward past the last entry
+        :raises: LookupError if the versioned file of the entry was collected
+        :raises: ValueError if count is less than 1
+        """
+        if count < 1:
+            raise ValueError("rollforward count must be at least 1, not {}".format(count))
+        lookup = self._current_index() + count
+        if lookup >= len(self.root):
+            raise IndexError("Attempt to roll forward past end")
+        self._make_current(lookup)
 
 SwinstallStackMgr.register(Schema1)
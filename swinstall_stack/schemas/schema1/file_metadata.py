@@ -6,8 +6,8 @@ Implementation of FileMetadata for Schema1.
 """
 import os
 from datetime import datetime
-import xml.etree.ElementTree as ET
 from ..base.file_metadata import FileMetadataBase
+from ...backend import Element
 from ...constants import ELEM
 from ...utils import datetime_from_str, datetime_to_str
 
@@ -119,7 +119,7 @@ class FileMetadata(FileMetadataBase):
             "version": to_version()
         }
 
-        return ET.Element(ELEM, attrib=attrib_dict)
+        return Element(ELEM, attrib=attrib_dict)
 
     @property
     def is_current(self):
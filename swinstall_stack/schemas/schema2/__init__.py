@@ -7,13 +7,16 @@ Implements crud operations on swinstall_stack with schema version 2
 from datetime import datetime
 import logging
 import os
-import xml.etree.ElementTree as ET
 
+from ...archive import segment_path, read_segment, write_segment
+from ...backend import Element
+from ...hashing import hash_file
 from ...manager import SwinstallStackMgr
-from ..base.schema import SchemaCommon, SchemaBase
+from ...metrics import LOOKUPS, counted
+from ..base.schema import SchemaCommon, SchemaBase, rebase_on_conflict
 from ...constants import ELEM
 from .file_metadata import FileMetadata
-from ...utils import datetime_from_str
+from ...utils import bisect_descending, datetime_from_str, epoch_from_str
 
 __all__ = ("Schema2",)
 
@@ -27,14 +30,88 @@ class Schema2(SchemaCommon, SchemaBase):
     _action = "action"
     _install = "install"
     _version = "version"
-
-    def __init__(self, root, start_time):
+    _segments = "segments"
+    # root attribute holding the datetime of the newest archived entry
+    _archived_until = "archived_until"
+    # root attributes caching the current and highest installed versions
+    _current = "current"
+    _max_version = "max_version"
+
+    def __init__(self, root, start_time, codec=None):
         """Initialize Schema2 with the root element of the schemas xml tree.
 
         :param root: root element of document.
         :type root: ElementTree.Element
+        :param codec: compression codec the stack was read with, if any
+        :type codec: str | None
+        """
+        super(Schema2, self).__init__(root, start_time, codec)
+        self._segment_roots = {}
+
+    def _reset(self):
+        """Discard the archive segments paged in from the previous stack."""
+        self._segment_roots = {}
+
+    def segment_count(self):
+        """Return the number of archive segments holding compacted history.
+
+        :returns: number of archive segments
+        :rtype: int
         """
-        super(Schema2, self).__init__(root, start_time)
+        return int(self.root.attrib.get(self._segments, 0))
+
+    def _set_segment_count(self, count):
+        """Record the number of archive segments in the root element."""
+        if count:
+            self.root.attrib[self._segments] = str(count)
+        else:
+            self.root.attrib.pop(self._segments, None)
+
+    def _segment(self, index):
+        """Return the root element of the archive segment with the supplied
+        index, reading it from disk the first time it is requested.
+
+        :param index: index of the segment
+        :type index: int
+
+        :returns: root element of the segment
+        :rtype: ElementTree.Element
+        """
+        if index not in self._segment_roots:
+            self._segment_roots[index] = read_segment(
+                segment_path(self.root.attrib.get("path"), index))
+        return self._segment_roots[index]
+
+    def _element_sequences(self, since=None):
+        """Iterate over the live root element followed by the root element of
+        each archive segment, newest first. Each segment is only paged in when
+        the iteration reaches it.
+
+        :param since: seconds since the epoch. If every archived entry is older,
+                      the archive segments are skipped.
+        :type since: float | None
+
+        :returns: generator of root elements
+        :rtype: generator(ElementTree.Element)
+        """
+        yield self.root
+        archived_until = self.root.attrib.get(self._archived_until)
+        if since is not None and archived_until is not None and \
+           epoch_from_str(archived_until) < since:
+            return
+        for index in range(self.segment_count(), 0, -1):
+            yield self._segment(index)
+
+    def _elements(self):
+        """Iterate over every element in the stack, newest first. Archived
+        segments are only paged in once the live window has been exhausted.
+
+        :returns: generator of elements
+        :rtype: generator(ElementTree.Element)
+        """
+        for elements in self._element_sequences():
+            for child in elements:
+                yield child
 
     def _versioned_file(self, version):
 
@@ -42,18 +119,23 @@ class Schema2(SchemaCommon, SchemaBase):
                             "{}_{}".format(self.versionless_filename(),
                                            version))
 
+    @counted(LOOKUPS, method="current")
     def current(self):
         """Return the current file_metadata metadata.
 
         :returns:  metadata describing current swinstalled file
         :rtype: FileMetadata
+
+        :raises: LookupError if nothing has been installed
         """
-        elem = self.root.iter(ELEM).next()
-        return FileMetadata(self._versioned_file(elem.attrib.get("version")),
-                            **elem.attrib)
+        for elem in self.root.iter(ELEM):
+            return FileMetadata(self._versioned_file(elem.attrib.get("version")),
+                                **elem.attrib)
+        raise LookupError("{} has no entries".format(self.swinstall_stack))
 
     def next_version(self):
-        """Returns the next version number after the current one.
+        """Returns the next version number after the current one. This is read
+        from the max_version attribute of the root element when present.
 
         :returns: Next version number
         :rtype: int
@@ -61,19 +143,40 @@ class Schema2(SchemaCommon, SchemaBase):
         if len(self.root) == 0:
             LOG.debug("no children under root tag. returning 1 as next version")
             return 1
-        for child in self.root:
+        return self._max_installed_version() + 1
+
+    def _max_installed_version(self):
+        """Return the highest installed version number, trusting the max_version
+        attribute of the root element, and falling back to scanning for the most
+        recent install when it is missing.
+
+        :returns: highest installed version
+        :rtype: int
+
+        :raises: RuntimeError if the stack has no install entries
+        """
+        max_version = self.root.attrib.get(self._max_version)
+        if max_version is not None:
+            return int(max_version)
+        for child in self._elements():
             if child.attrib.get(self._action) == self._install:
-                return int(child.attrib.get(self._version)) + 1
+                self.root.attrib[self._max_version] = child.attrib.get(self._version)
+                return int(child.attrib.get(self._version))
 
         raise RuntimeError("unable to find next version")
 
     def current_version(self):
-        """Returns the current version number.
+        """Returns the current version number. This is read from the current
+        attribute of the root element when present.
 
         :returns: The current version number
         :rtype: int"""
+        current = self.root.attrib.get(self._current)
+        if current is not None:
+            return int(current)
         return int(self.root.iter(ELEM).next().attrib.get(self._version))
 
+    @counted(LOOKUPS, method="version")
     def version(self, version):
         """retrieve the version passed in
 
@@ -84,13 +187,20 @@ class Schema2(SchemaCommon, SchemaBase):
         :rtype:  FileMetadata
         :raises KeyError: if the version passed in does not exist
         """
-        for child in self.root:
+        for child in self._elements():
             if child.attrib.get(self._version) == str(version):
                 return FileMetadata(self._versioned_file(child.attrib.get("version")),
                                     **child.attrib)
         raise KeyError("no version: {} has been published", format(version))
 
     def _insert_element_into_root(self, element):
+        version = element.attrib.get(self._version)
+        if element.attrib.get(self._action) == self._install:
+            self.root.attrib[self._max_version] = version
+        elif len(self.root):
+            # make sure the header is complete before it is written
+            self._max_installed_version()
+        self.root.attrib[self._current] = version
         self.root.insert(0, element)
         self._save()
 
@@ -116,6 +226,7 @@ class Schema2(SchemaCommon, SchemaBase):
                                  revision)
         self._insert_element_into_root(hash_elem.element())
 
+    @rebase_on_conflict
     def insert_element(self, *args, **kwargs):
         """Generate a new element from a given date_time object.
 
@@ -129,26 +240,120 @@ class Schema2(SchemaCommon, SchemaBase):
         """
         self._insert_element(*args, **kwargs)
 
-    def rollback_element(self, date_time=datetime.now()):
-        """A rollback sets the new current version to old current version - 1
+    def install(self, source_file, date_time=None, revision=None):
+        """Record the installation of source_file, using a hash of its contents
+        as the hash of the new entry. If the contents are identical to those of
+        the current entry, the install is a no-op and the stack is not rewritten.
 
-        :param date_time: (datetime) of the rollback operation. It defaults to datetime.now()
-        :returns None:"""
-        new_version = self.current_version() - 1
+        :param source_file: full path to the file being installed
+        :type source_file: str
+        :param date_time: time of the install. Defaults to now
+        :type date_time: datetime
+        :param revision: None|str - The optional scm revision number
+
+        :returns: metadata of the new entry, or None if the install was skipped
+        :rtype: FileMetadata | None
+        """
+        return self.install_hash(hash_file(source_file), date_time, revision)
+
+    @rebase_on_conflict
+    def install_hash(self, hash_str, date_time=None, revision=None):
+        """Record the installation of contents with the given hash. If the hash
+        is that of the current entry, the install is a no-op and the stack is
+        not rewritten.
+
+        :param hash_str: hash of the contents installed
+        :type hash_str: str
+        :param date_time: time of the install. Defaults to now
+        :type date_time: datetime
+        :param revision: None|str - The optional scm revision number
+
+        :returns: metadata of the new entry, or None if the install was skipped
+        :rtype: FileMetadata | None
+        """
+        if len(self.root) and self.current().hash == hash_str:
+            LOG.info("%s is identical to current version %s. skipping install",
+                     hash_str, self.current_version())
+            return None
+        self._insert_element(hash_str, date_time or datetime.now(), revision)
+        return self.current()
+
+    def _insert_rollback(self, action, new_version, date_time):
+        """Insert an entry making new_version current again.
+
+        :param action: action recorded by the entry (rollback|rollforward)
+        :type action: str
+        :param new_version: the version to make current
+        :type new_version: int
+        :param date_time: (datetime) of the operation. It defaults to datetime.now()
+
+        :raises KeyError: if new_version has not been published
+        :raises LookupError: if the versioned file of new_version was collected
+        """
         installfile = self.version(new_version)
+        self._check_not_collected(new_version, installfile.datetime,
+                                  self._versioned_file(new_version))
         rollback = FileMetadata(self._versioned_file(new_version),
-                                "rollback",
+                                action,
                                 new_version,
-                                date_time,
+                                date_time or datetime.now(),
                                 installfile.hash,
                                 installfile.revision)
         self._insert_element_into_root(rollback.element())
 
-    def rollforward_element(self, date_time):
-        """undo a rollback
-        """
-        pass
+    @rebase_on_conflict
+    def rollback_element(self, date_time=None, count=1):
+        """A rollback sets the new current version to old current version - count.
+        However many steps are rolled back, a single entry is added and the stack
+        is saved once.
 
+        :param date_time: (datetime) of the rollback operation. It defaults to datetime.now()
+        :param count: (int) number of versions to roll back
+        :returns None:
+        :raises KeyError: if the resulting version has not been published
+        :raises LookupError: if the versioned file of the version was collected
+        :raises ValueError: if count is less than 1"""
+        if count < 1:
+            raise ValueError("rollback count must be at least 1, not {}".format(count))
+        self._insert_rollback("rollback", self.current_version() - count, date_time)
+
+    @rebase_on_conflict
+    def rollback_to(self, version, date_time=None):
+        """Roll back to a specific version, which must be older than the current one.
+
+        :param version: (int) the version to make current
+        :param date_time: (datetime) of the rollback operation. It defaults to datetime.now()
+        :returns None:
+        :raises KeyError: if version has not been published
+        :raises LookupError: if the versioned file of the version was collected
+        :raises ValueError: if version is not older than the current version"""
+        version = int(version)
+        if version >= self.current_version():
+            raise ValueError("cannot roll back to version {} from version {}"\
+                             .format(version, self.current_version()))
+        self._insert_rollback("rollback", version, date_time)
+
+    @rebase_on_conflict
+    def rollforward_element(self, date_time=None, count=1):
+        """Undo a rollback, setting the current version to old current version + count.
+        The most recent install always carries the highest version, so the limit
+        is read from the max_version attribute rather than replaying the history.
+
+        :param date_time: (datetime) of the rollforward operation. It defaults to datetime.now()
+        :param count: (int) number of versions to roll forward
+        :returns None:
+        :raises IndexError: if this would roll forward past the latest install
+        :raises LookupError: if the versioned file of the version was collected
+        :raises ValueError: if count is less than 1"""
+        if count < 1:
+            raise ValueError("rollforward count must be at least 1, not {}".format(count))
+        new_version = self.current_version() + count
+        if new_version > self._max_installed_version():
+            raise IndexError("Attempt to roll forward past latest install {}"\
+                             .format(self._max_installed_version()))
+        self._insert_rollback("rollforward", new_version, date_time)
+
+    @counted(LOOKUPS, method="file_on")
     def file_on(self, date_time):
         """Given a datetime instance, find the most recent action which is less than or
         equal to the datetime.
@@ -163,7 +368,7 @@ class Schema2(SchemaCommon, SchemaBase):
                              supplied datetime instance"""
         datetime_val = datetime_from_str(date_time) \
                         if isinstance(date_time, basestring) else date_time
-        for child in self.root:
+        for child in self._elements():
             if datetime_from_str(child.attrib.get("datetime")) <= datetime_val:
                 return FileMetadata(self._versioned_file(child.attrib.get("version")),
                                     **child.attrib)
@@ -171,5 +376,107 @@ class Schema2(SchemaCommon, SchemaBase):
         raise LookupError("unable to find version of {} installed on or before {}"\
                           .format(basename, date_time))
 
+    def history(self, start=None, end=None, actions=None):
+        """Generate metadata for the entries in the stack, newest first. Entries
+        are recorded in chronological order, so the first entry on or before end
+        is found by binary search, and entries are only decoded as the generator
+        is consumed. Archived segments are paged in only if the range reaches them.
+
+        :param start: only entries on or after start are generated
+        :type start: datetime | str which can be converted to datetime via
+                     utils.datetime_from_str
+        :param end: only entries on or before end are generated
+        :type end: datetime | str which can be converted to datetime via
+                   utils.datetime_from_str
+        :param actions: only entries whose action is in actions are generated
+        :type actions: sequence(str) | None
+
+        :returns: generator of metadata
+        :rtype: generator(FileMetadata)
+        """
+        start, end = self._history_bounds(start, end)
+        for elements in self._element_sequences(start):
+            def epoch(index):
+                """seconds since the epoch of the element at index"""
+                return epoch_from_str(elements[index].attrib.get("datetime"))
+
+            for index in xrange(bisect_descending(len(elements), epoch, end), len(elements)):
+                if epoch(index) < start:
+                    return
+                elt = elements[index]
+                if actions is None or elt.attrib.get(self._action) in actions:
+                    yield FileMetadata(self._versioned_file(elt.attrib.get("version")),
+                                       **elt.attrib)
+
+    @rebase_on_conflict
+    def compact(self, keep=None, cutoff=None):
+        """Move older entries out of the live swinstall_stack into a new
+        compressed archive segment. An entry stays in the live stack if it is
+        one of the *keep* most recent entries, or if it is newer than *cutoff*.
+        The current entry always stays in the live stack.
+
+        :param keep: number of most recent entries to keep in the live stack
+        :type keep: int
+        :param cutoff: entries whose datetime is later than cutoff stay live
+        :type cutoff: datetime | str which can be converted to datetime via
+                      utils.datetime_from_str
+
+        :returns: number of entries moved into the archive
+        :rtype: int
+
+        :raises: ValueError if neither keep nor cutoff is supplied
+        """
+        if keep is None and cutoff is None:
+            raise ValueError("compact requires keep and/or cutoff")
+        live = max(1, keep or 0)
+        if cutoff is not None:
+            cutoff = datetime_from_str(cutoff) \
+                        if isinstance(cutoff, basestring) else cutoff
+            newer = 0
+            for child in self.root:
+                if datetime_from_str(child.attrib.get("datetime")) <= cutoff:
+                    break
+                newer += 1
+            live = max(live, newer)
+
+        archived = list(self.root)[live:]
+        if not archived:
+            LOG.debug("nothing to compact in %s", self.swinstall_stack)
+            return 0
+        # the header must not depend upon the archived entries
+        self._max_installed_version()
+        self.root.attrib[self._current] = str(self.current_version())
+
+        index = self.segment_count() + 1
+        path = segment_path(self.root.attrib.get("path"), index)
+        segment = Element(self.root.tag, attrib={
+            "path": self.root.attrib.get("path"),
+            "schema": self.schema_version,
+            "segment": str(index)
+        })
+        segment.extend(archived)
+        write_segment(path, segment)
+
+        archived_until = self.root.attrib.get(self._archived_until)
+        del self.root[live:]
+        self._set_segment_count(index)
+        self.root.attrib[self._archived_until] = archived[0].attrib.get("datetime")
+        try:
+            self._save()
+        except Exception:
+            # restore the live stack so that the instance stays consistent
+            # with what is on disk
+            self.root.extend(archived)
+            self._set_segment_count(index - 1)
+            if archived_until is None:
+                del self.root.attrib[self._archived_until]
+            else:
+                self.root.attrib[self._archived_until] = archived_until
+            os.remove(path)
+            raise
+        self._segment_roots[index] = segment
+        LOG.debug("archived %s entries to %s", len(archived), path)
+        return len(archived)
+
 
 SwinstallStackMgr.register(Schema2)
@@ -8,7 +8,7 @@ the swinstall_stack
 
 from datetime import datetime
 import os
-import xml.etree.ElementTree as ET
+from ...backend import Element
 from ...constants import (DATETIME_FORMAT, ELEM)
 from ...utils import datetime_from_str
 from ..base.file_metadata import FileMetadataBase
@@ -79,7 +79,7 @@ class FileMetadata(FileMetadataBase):
         if self.revision:
             attrib_dict["revision"] = self.revision
 
-        return ET.Element(ELEM, attrib=attrib_dict)
+        return Element(ELEM, attrib=attrib_dict)
 
     def is_current(self):
         """Test to see if the metadata points at a current
@@ -0,0 +1,362 @@
+"""
+snapshot.py
+
+Shared, read only snapshot of resolved swinstall_stacks for hosts running
+many concurrent readers. One process resolves the stacks and publishes a
+compact table of versionless path to current and time indexed versioned
+files into a memory mapped file, by default under /dev/shm. Other processes
+attach to the table and answer current and file_on queries with a binary
+search over the mapping, without reading or parsing any stack.
+
+The file consists of a header, a table of stacks sorted by versionless path,
+a table of entries, oldest first within each stack, and the strings the
+tables refer to.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import tempfile
+import time
+from .concurrency import StackToken, atomic_write, stat_token
+from .manager import SwinstallStackMgr
+from .metrics import LOOKUPS, counted, flushed
+from .schemas import import_schemas
+from .utils import datetime_from_str, epoch_from_datetime, pool_worker
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ("Snapshot", "default_snapshot_path", "publish")
+
+LOG = logging.getLogger(__name__)
+
+# environment variable overriding the location of the snapshot
+SNAPSHOT_ENV = "SWINSTALL_STACK_SNAPSHOT"
+SNAPSHOT_NAME = "swinstall_stack_snapshot"
+
+_MAGIC = "SWSNAP01"
+# magic, stack count, generation, time published
+_HEADER = struct.Struct("<8sIQd")
+# versionless path offset and length, directory offset and length, first
+# entry and entry count, and the token of the stack when it was read
+_STACK = struct.Struct("<IIIIIIQQQ")
+# epoch, versioned file name offset and length
+_ENTRY = struct.Struct("<qII")
+
+def default_snapshot_path():
+    """Return the path of the snapshot: SWINSTALL_STACK_SNAPSHOT if set, else
+    a file under /dev/shm, or under the temporary directory on hosts without
+    /dev/shm.
+
+    :rtype: str
+    """
+    path = os.environ.get(SNAPSHOT_ENV)
+    if path:
+        return path
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, SNAPSHOT_NAME)
+
+@flushed
+@pool_worker("resolve")
+def _resolve(swinstalled_file):
+    """Resolve the stack of a swinstalled file into the token of the stack, the
+    directory holding its versioned files and its timeline: the epoch and
+    versioned file name of each entry, oldest first, ending with the current
+    entry. The versioned file on a date is the last entry at or before it.
+
+    :returns: versionless path, token, directory and timeline, or None if the
+              stack is empty or cannot be read
+    :rtype: tuple | None
+    """
+    import_schemas()
+    mgr = SwinstallStackMgr()
+    # taken before the stack is read, so that a save racing the read shows
+    # up as a changed stack rather than going unnoticed
+    token = stat_token(mgr._swinstall_stack_from_file(swinstalled_file))
+    schema = mgr.parse_columns(swinstalled_file)
+    if schema.schema_version == "1":
+        # schema 1 stacks ignore entries past the current one
+        timeline = [(schema.columns.epochs[index], schema._versioned_file(index))
+                    for index in xrange(schema._current_index() + 1)]
+    else:
+        timeline = [(epoch_from_datetime(metadata.datetime), metadata.path)
+                    for metadata in schema.history()]
+        timeline.reverse()
+    if token is None or not timeline:
+        return None
+    directory = schema.root_dirname()
+    return (swinstalled_file, token, directory,
+            [(epoch, os.path.relpath(path, directory)) for epoch, path in timeline])
+
+def _pack(resolved, generation):
+    """Lay out resolved stacks as the contents of a snapshot."""
+    resolved = sorted(resolved)
+    strings = []
+    offsets = {}
+    # offset of the next string, in a list so that string() may update it
+    position = [_HEADER.size + len(resolved) * _STACK.size
+                + sum(len(timeline) for _, _, _, timeline in resolved) * _ENTRY.size]
+
+    def string(value):
+        if value not in offsets:
+            offsets[value] = position[0]
+            position[0] += len(value)
+            strings.append(value)
+        return (offsets[value], len(value))
+
+    stacks = []
+    entries = []
+    for swinstalled_file, token, directory, timeline in resolved:
+        first = len(entries)
+        for epoch, name in timeline:
+            entries.append(_ENTRY.pack(epoch, *string(name)))
+        stacks.append(_STACK.pack(*(string(swinstalled_file) + string(directory) +
+                                    (first, len(timeline)) + tuple(token))))
+    return "".join([_HEADER.pack(_MAGIC, len(stacks), generation, time.time())]
+                   + stacks + entries + strings)
+
+def _read_generation(path):
+    """Return the generation of the snapshot at path, or None if there is none."""
+    try:
+        with open(path, "rb") as filehandle:
+            header = filehandle.read(_HEADER.size)
+    except IOError:
+        return None
+    if len(header) < _HEADER.size or not header.startswith(_MAGIC):
+        return None
+    return _HEADER.unpack(header)[2]
+
+@contextmanager
+def _publish_lock(path):
+    """Hold an exclusive lock serializing the publishers of the snapshot at
+    path, so that each publishes a generation of its own. The snapshot is
+    replaced by rename, so the lock is taken on a sibling file which never
+    is. flock rather than lockf, so that publishing threads of one process
+    exclude one another too. Locking is skipped on platforms without fcntl.
+
+    :param path: path of the snapshot
+    :type path: str
+    """
+    with open(path + ".lock", "a") as filehandle:
+        if fcntl is not None:
+            fcntl.flock(filehandle.fileno(), fcntl.LOCK_EX)
+        yield
+
+def publish(swinstalled_files, path=None, processes=None):
+    """Resolve the stacks of swinstalled files and publish them as a snapshot,
+    atomically replacing any previous snapshot. Processes attached to the
+    previous snapshot keep reading it until they refresh.
+
+    :param swinstalled_files: full paths to versionless swinstalled files
+    :type swinstalled_files: iterable(str)
+    :param path: path of the snapshot. Defaults to default_snapshot_path()
+    :type path: str | None
+    :param processes: number of worker processes resolving stacks. Defaults
+                      to the number of cpus. A value of 1 resolves stacks in
+                      the calling process.
+    :type processes: int | None
+
+    :returns: generation of the published snapshot
+    :rtype: int
+    """
+    path = path or default_snapshot_path()
+    swinstalled_files = list(swinstalled_files)
+    if processes == 1:
+        resolved = [_resolve(swinstalled_file) for swinstalled_file in swinstalled_files]
+    else:
+        pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+        try:
+            resolved = pool.map(_resolve, swinstalled_files)
+        finally:
+            pool.terminate()
+            pool.join()
+    resolved = [stack for stack in resolved if stack is not None]
+    with _publish_lock(path):
+        generation = (_read_generation(path) or 0) + 1
+        atomic_write(path, _pack(resolved, generation))
+    LOG.debug("published %s stacks to %s at generation %s", len(resolved), path, generation)
+    return generation
+
+
+class Snapshot(object):
+    """Read only view of a published snapshot. Queries are answered straight
+    from the memory mapped file.
+    """
+    def __init__(self, path=None):
+        """Attach to a published snapshot.
+
+        :param path: path of the snapshot. Defaults to default_snapshot_path()
+        :type path: str | None
+
+        :raises: IOError if there is no snapshot at path
+        :raises: ValueError if the file at path is not a snapshot
+        """
+        self.path = path or default_snapshot_path()
+        self._map = None
+        self._attach()
+
+    def __repr__(self):
+        return "Snapshot <path:{} generation:{} stacks:{}>"\
+               .format(self.path, self.generation, self._count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, swinstalled_file):
+        return self._find(swinstalled_file) is not None
+
+    def _attach(self):
+        with open(self.path, "rb") as filehandle:
+            mapped = mmap.mmap(filehandle.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped.size() < _HEADER.size or mapped[:len(_MAGIC)] != _MAGIC:
+            mapped.close()
+            raise ValueError("{} is not a swinstall_stack snapshot".format(self.path))
+        self.close()
+        self._map = mapped
+        _, self._count, self.generation, published = _HEADER.unpack_from(mapped)
+        self.published = datetime.fromtimestamp(published)
+
+    def close(self):
+        """Detach from the snapshot."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _string(self, offset, length):
+        return self._map[offset:offset + length]
+
+    def _stack(self, index):
+        return _STACK.unpack_from(self._map, _HEADER.size + index * _STACK.size)
+
+    def _find(self, swinstalled_file):
+        """Return the record of a stack, by binary search over the table of stacks."""
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            record = self._stack(mid)
+            key = self._string(record[0], record[1])
+            if key < swinstalled_file:
+                low = mid + 1
+            elif key > swinstalled_file:
+                high = mid
+            else:
+                return record
+        return None
+
+    def _record(self, swinstalled_file):
+        record = self._find(swinstalled_file)
+        if record is None:
+            raise KeyError("{} is not in snapshot {}".format(swinstalled_file, self.path))
+        return record
+
+    def _entries_start(self):
+        return _HEADER.size + self._count * _STACK.size
+
+    def _path(self, record, entry):
+        epoch, offset, length = _ENTRY.unpack_from(
+            self._map, self._entries_start() + entry * _ENTRY.size)
+        return os.path.join(self._string(record[2], record[3]), self._string(offset, length))
+
+    def paths(self):
+        """Generate the versionless paths of the stacks in the snapshot, sorted."""
+        for index in xrange(self._count):
+            record = self._stack(index)
+            yield self._string(record[0], record[1])
+
+    @counted(LOOKUPS, method="current")
+    def current(self, swinstalled_file):
+        """Return the current versioned file of a swinstalled file.
+
+        :param swinstalled_file: full path to the versionless swinstalled file
+        :type swinstalled_file: str
+
+        :returns: full path to the versioned file
+        :rtype: str
+
+        :raises: KeyError if the swinstalled file is not in the snapshot
+        """
+        record = self._record(swinstalled_file)
+        return self._path(record, record[4] + record[5] - 1)
+
+    @counted(LOOKUPS, method="file_on")
+    def file_on(self, swinstalled_file, date_time):
+        """Return the versioned file of a swinstalled file that was current on a
+        date. See Schema2.file_on
+
+        :param swinstalled_file: full path to the versionless swinstalled file
+        :type swinstalled_file: str
+        :param date_time: date of interest
+        :type date_time: datetime | str
+
+        :returns: full path to the versioned file
+        :rtype: str
+
+        :raises: KeyError if the swinstalled file is not in the snapshot
+        :raises: LookupError if nothing was installed on or before date_time
+        """
+        record = self._record(swinstalled_file)
+        date_time = datetime_from_str(date_time) if isinstance(date_time, basestring) else date_time
+        target = epoch_from_datetime(date_time)
+        start = self._entries_start()
+        # first entry after target, by binary search over the stack's entries
+        low, high = record[4], record[4] + record[5]
+        while low < high:
+            mid = (low + high) // 2
+            if _ENTRY.unpack_from(self._map, start + mid * _ENTRY.size)[0] <= target:
+                low = mid + 1
+            else:
+                high = mid
+        if low == record[4]:
+            raise LookupError("unable to find version of {} installed on or before {}"\
+                              .format(swinstalled_file, date_time))
+        return self._path(record, low - 1)
+
+    def token(self, swinstalled_file):
+        """Return the token of a swinstalled file's stack when it was snapshotted.
+
+        :raises: KeyError if the swinstalled file is not in the snapshot
+        :rtype: StackToken
+        """
+        return StackToken(*self._record(swinstalled_file)[6:])
+
+    def changed(self, swinstalled_file):
+        """Return whether the stack of a swinstalled file has been saved since it
+        was snapshotted. Costs a single stat of the stack.
+
+        :raises: KeyError if the swinstalled file is not in the snapshot
+        :rtype: bool
+        """
+        stack = SwinstallStackMgr._swinstall_stack_from_file(swinstalled_file)
+        return stat_token(stack) != self.token(swinstalled_file)
+
+    def stale(self):
+        """Return whether a newer snapshot has been published since this one was
+        attached.
+
+        :rtype: bool
+        """
+        return _read_generation(self.path) != self.generation
+
+    def refresh(self):
+        """Attach to the latest published snapshot if this one is stale.
+
+        :returns: whether the snapshot was replaced
+        :rtype: bool
+        """
+        if not self.stale():
+            return False
+        self._attach()
+        return True
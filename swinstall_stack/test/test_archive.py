@@ -0,0 +1,117 @@
+#initialize testing environment
+import env
+# library imports
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.archive import segment_path, read_segment
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20181221-142313" hash="c618755af9b63728411bc536d2c60cf2" version="5"/>
+   <elt action="install" datetime="20181221-142248" hash="5c8fdabe2ae7fa9287c0672b88ef6593" version="4"/>
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(self.fullpath)
+        self.schemas = os.path.join(self.fullpath, "packages.xml_swinstall_stack")
+
+        with open(self.schemas,'w') as fh:
+            fh.write(STACK.format(self.schemas))
+
+        self.schema = SwinstallStackMgr().parse(self.versionless_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        del self.schema
+
+    def reparse(self):
+        return SwinstallStackMgr().parse(self.versionless_file)
+
+    def test_compact_keep(self):
+        archived = self.schema.compact(keep=2)
+
+        self.assertEqual(archived, 3)
+        self.assertEqual(len(self.schema.root), 2)
+        segment = read_segment(segment_path(self.schemas, 1))
+        self.assertEqual([elt.attrib["version"] for elt in segment], ["3", "2", "1"])
+        self.assertEqual(self.reparse().segment_count(), 1)
+
+    def test_compact_cutoff(self):
+        archived = self.schema.compact(cutoff="20180101-103813")
+
+        self.assertEqual(archived, 2)
+        self.assertEqual([elt.attrib["version"] for elt in self.schema.root],
+                         ["5", "4", "3"])
+
+    def test_compact_keeps_current(self):
+        self.schema.compact(keep=0)
+        self.assertEqual(len(self.schema.root), 1)
+        self.assertEqual(self.reparse().current_version(), 5)
+
+    def test_compact_nothing(self):
+        self.assertEqual(self.schema.compact(keep=10), 0)
+        self.assertFalse(os.path.exists(segment_path(self.schemas, 1)))
+
+    def test_compact_requires_policy(self):
+        with self.assertRaises(ValueError):
+            self.schema.compact()
+
+    def test_version_pages_in_archive(self):
+        self.schema.compact(keep=2)
+        schema = self.reparse()
+
+        self.assertEqual(schema.version(5).hash, "c618755af9b63728411bc536d2c60cf2")
+        self.assertEqual(schema._segment_roots, {})
+        self.assertEqual(schema.version(1).hash, "294fc86579b14b7d39")
+        self.assertEqual(list(schema._segment_roots.keys()), [1])
+
+    def test_file_on_pages_in_archive(self):
+        self.schema.compact(keep=1)
+        self.schema.compact(keep=0)
+        schema = self.reparse()
+
+        file_on = schema.file_on("20180702-124204")
+
+        self.assertEqual(schema.segment_count(), 1)
+        self.assertEqual(file_on.path, os.path.join(self.fullpath, "packages.xml_2"))
+        with self.assertRaises(LookupError):
+            schema.file_on("20001010-111111")
+
+    def test_multiple_segments(self):
+        self.schema.compact(keep=4)
+        self.schema.compact(keep=2)
+        schema = self.reparse()
+
+        self.assertEqual(schema.segment_count(), 2)
+        self.assertEqual(schema.version(1).version, 1)
+        self.assertEqual(schema.file_on("20180702-144204").version, 3)
+
+    def test_rollback_into_archive(self):
+        self.schema.compact(keep=1)
+        schema = self.reparse()
+
+        schema.rollback_element(datetime_from_str("20181222-000000"))
+
+        self.assertEqual(schema.current_version(), 4)
+        self.assertEqual(schema.next_version(), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
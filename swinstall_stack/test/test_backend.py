@@ -0,0 +1,63 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import unittest
+import xml.etree.ElementTree as ET
+# local imports
+from swinstall_stack import backend
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<!-- swinstall_stack -->
+<stack_history schema="2" path="/dd/facility/etc/bak/packages.xml/packages.xml_swinstall_stack">
+    <elt version="3" action="install" datetime="20180702-144204" hash="194f835569a79ba433"/>
+  <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2" revision="a&amp;b&lt;&gt;&quot;"/>
+</stack_history>
+'''
+
+EXPECTED = os.linesep.join([
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<stack_history path="/dd/facility/etc/bak/packages.xml/packages.xml_swinstall_stack" schema="2">',
+    '   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>',
+    '   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" revision="a&amp;b&lt;&gt;&quot;" version="2"/>',
+    '</stack_history>'])
+
+class BackendTest(unittest.TestCase):
+    def test_stdlib_serialize(self):
+        self.assertEqual(backend._serialize_minidom(ET.fromstring(STACK)), EXPECTED)
+
+    def test_serialize(self):
+        root = backend.fromstring(STACK)
+        self.assertEqual(len(root), 2)
+        self.assertEqual(backend.serialize(root), EXPECTED)
+
+    def test_serialize_built(self):
+        root = backend.Element("stack_history", attrib={"schema": "2", "path": "/tmp/x"})
+        self.assertEqual(backend.serialize(root), os.linesep.join([
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<stack_history path="/tmp/x" schema="2"/>']))
+        backend.SubElement(root, "elt", attrib={"version": "1", "action": "install"})
+        self.assertEqual(backend.serialize(root),
+                         backend._serialize_minidom(ET.fromstring(backend.tostring(root))))
+
+    @unittest.skipIf(lxml_etree is None, "lxml is not installed")
+    def test_lxml_matches_minidom(self):
+        root = lxml_etree.fromstring(STACK, backend._PARSER)
+        self.assertEqual(backend._serialize_lxml(root), EXPECTED)
+
+    @unittest.skipIf(lxml_etree is None, "lxml is not installed")
+    def test_lxml_falls_back(self):
+        root = lxml_etree.fromstring(STACK, backend._PARSER)
+        root[0].set("revision", "multi\nline")
+        self.assertEqual(backend._serialize_lxml(root), None)
+        self.assertEqual(backend.serialize(root),
+                         backend._serialize_minidom(ET.fromstring(lxml_etree.tostring(root))))
+
+
+if __name__ == '__main__':
+    unittest.main()
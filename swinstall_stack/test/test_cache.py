@@ -0,0 +1,157 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import time
+import unittest
+# local imports
+from swinstall_stack.backend import serialize
+from swinstall_stack.cache import NegativeCache, StackCache
+from swinstall_stack.concurrency import stat_token
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2" revision="r12"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+class StackCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(fullpath)
+        self.schemas = os.path.join(fullpath, "packages.xml_swinstall_stack")
+        with open(self.schemas, 'w') as fh:
+            fh.write(STACK.format(self.schemas))
+        self.cache = StackCache(os.path.join(self.tmpdir, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hit(self):
+        schema = SwinstallStackMgr(self.cache).parse(self.versionless_file)
+        self.assertIsNotNone(self.cache.get(self.schemas, stat_token(self.schemas)))
+
+        cached = SwinstallStackMgr(self.cache).parse(self.versionless_file)
+        self.assertEqual(serialize(cached.root), serialize(schema.root))
+        self.assertEqual(cached.current_version(), 3)
+        self.assertEqual(cached.version(2).revision, "r12")
+
+    def test_miss_after_save(self):
+        schema = SwinstallStackMgr(self.cache).parse(self.versionless_file)
+        schema.insert_element("123456789", datetime_from_str("20181216-124101"))
+
+        self.assertIsNone(self.cache.get(self.schemas, stat_token(self.schemas)))
+        self.assertEqual(SwinstallStackMgr(self.cache).parse(self.versionless_file)\
+                         .current_version(), 4)
+
+    def test_save_from_cached(self):
+        SwinstallStackMgr(self.cache).parse(self.versionless_file)
+        schema = SwinstallStackMgr(self.cache).parse(self.versionless_file)
+        schema.insert_element("123456789", datetime_from_str("20181216-124101"))
+
+        self.assertEqual(SwinstallStackMgr().parse(self.versionless_file).current_version(), 4)
+
+    def test_corrupt_entry(self):
+        SwinstallStackMgr(self.cache).parse(self.versionless_file)
+        for name in os.listdir(self.cache.directory):
+            with open(os.path.join(self.cache.directory, name), "wb") as fh:
+                fh.write("garbage")
+
+        self.assertIsNone(self.cache.get(self.schemas, stat_token(self.schemas)))
+        self.assertEqual(SwinstallStackMgr(self.cache).parse(self.versionless_file)\
+                         .current_version(), 3)
+
+    def test_evict_least_recently_used(self):
+        root = SwinstallStackMgr().parse(self.versionless_file).root
+        token = stat_token(self.schemas)
+        for index in range(3):
+            self.cache.put("/stack/{}".format(index), token, None, root)
+        paths = dict((index, self.cache._entry_path("/stack/{}".format(index)))
+                     for index in range(3))
+        for index, path in paths.items():
+            os.utime(path, (time.time() - 100 + index, time.time() - 100 + index))
+        self.cache.get("/stack/0", token)
+
+        self.cache.max_size = os.path.getsize(paths[0]) * 2
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertFalse(os.path.exists(paths[1]))
+        self.assertTrue(os.path.exists(paths[0]))
+
+    def test_from_environment(self):
+        self.assertIsNone(StackCache.from_environment({}))
+        cache = StackCache.from_environment({"SWINSTALL_STACK_CACHE": "/tmp/cache",
+                                             "SWINSTALL_STACK_CACHE_SIZE": "1024"})
+        self.assertEqual((cache.directory, cache.max_size), ("/tmp/cache", 1024))
+
+
+class NegativeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.schemas = SwinstallStackMgr._swinstall_stack_from_file(self.versionless_file)
+        self.mgr = SwinstallStackMgr(missing=NegativeCache(ttl=60))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_stack(self):
+        os.makedirs(os.path.dirname(self.schemas))
+        with open(self.schemas, 'w') as fh:
+            fh.write(STACK.format(self.schemas))
+
+    def test_probe_is_remembered(self):
+        self.assertFalse(self.mgr.exists(self.versionless_file))
+        self.assertTrue(self.schemas in self.mgr.missing)
+        # the stack appearing behind the manager's back is not seen until the ttl expires
+        self.write_stack()
+        self.assertFalse(self.mgr.exists(self.versionless_file))
+        with self.assertRaises(IOError):
+            self.mgr.parse(self.versionless_file)
+        with self.assertRaises(IOError):
+            self.mgr.parse_columns(self.versionless_file)
+
+        self.mgr.missing.ttl = 0
+        self.mgr.missing.clear()
+        self.assertTrue(self.mgr.exists(self.versionless_file))
+
+    def test_parse_remembers_missing(self):
+        with self.assertRaises(IOError):
+            self.mgr.parse(self.versionless_file)
+        self.assertTrue(self.schemas in self.mgr.missing)
+
+    def test_create_invalidates(self):
+        self.assertFalse(self.mgr.exists(self.versionless_file))
+        self.assertTrue(self.mgr.create(self.versionless_file))
+        self.assertTrue(self.mgr.exists(self.versionless_file))
+        self.assertEqual(len(self.mgr.parse(self.versionless_file).root), 0)
+
+    def test_expiry(self):
+        missing = NegativeCache(ttl=60, max_entries=2)
+        missing.add("/a")
+        missing._expiry["/a"] = time.time() - 1
+        self.assertFalse("/a" in missing)
+        missing.add("/b")
+        missing.add("/c")
+        missing._expiry["/b"] = time.time() - 1
+        missing.add("/d")
+        self.assertEqual(sorted(missing._expiry), ["/c", "/d"])
+
+    def test_disabled(self):
+        missing = NegativeCache.from_environment({"SWINSTALL_STACK_MISSING_TTL": "0"})
+        missing.add("/a")
+        self.assertFalse("/a" in missing)
+
+
+if __name__ == '__main__':
+    unittest.main()
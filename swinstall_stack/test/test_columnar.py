@@ -0,0 +1,129 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.columnar import ColumnarSchema1, ColumnarSchema2, StackColumns
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+
+import_schemas()
+
+STACK1='''<stack_history path="{}">
+    <elt is_current="False" version="20161213-093146_r575055" />
+    <elt is_current="False" version="20181102-144204" />
+    <elt is_current="True" version="20181105-103813" />
+    <elt is_current="False" version="20181110-104603" />
+</stack_history>
+'''
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="rollforward" datetime="20181222-100000" hash="c618755af9b63728411bc536d2c60cf2" version="5"/>
+   <elt action="rollback" datetime="20181221-150000" hash="5c8fdabe2ae7fa9287c0672b88ef6593" version="4"/>
+   <elt action="install" datetime="20181221-142313" hash="c618755af9b63728411bc536d2c60cf2" version="5"/>
+   <elt action="install" datetime="20181221-142248" hash="5c8fdabe2ae7fa9287c0672b88ef6593" version="4" revision="r12"/>
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+class ColumnarTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_stack(self, name, stack):
+        fullpath = os.path.join(self.tmpdir, "bak", name)
+        os.makedirs(fullpath)
+        schemas = os.path.join(fullpath, "{}_swinstall_stack".format(name))
+        with open(schemas, 'w') as fh:
+            fh.write(stack.format(schemas))
+        versionless_file = os.path.join(self.tmpdir, name)
+        return (SwinstallStackMgr().parse(versionless_file),
+                SwinstallStackMgr().parse_columns(versionless_file))
+
+    def assertSameLookup(self, tree, columns, method, *args):
+        try:
+            expected = getattr(tree, method)(*args)
+        except Exception as err:
+            with self.assertRaises(err.__class__):
+                getattr(columns, method)(*args)
+        else:
+            self.assertEqual(getattr(columns, method)(*args), expected)
+
+    def test_columns(self):
+        columns = StackColumns.from_xml(STACK2.format("/tmp/stack"))
+
+        self.assertEqual(len(columns), 7)
+        self.assertEqual(columns.attrib, {"path": "/tmp/stack", "schema": "2"})
+        self.assertEqual(list(columns.versions), [5, 4, 5, 4, 3, 2, 1])
+        self.assertEqual([columns.action(i) for i in range(3)],
+                         ["rollforward", "rollback", "install"])
+        self.assertTrue(columns.hashes[0] is columns.hashes[2])
+        self.assertEqual(columns.revisions[3], "r12")
+
+    def test_schema2(self):
+        tree, columns = self.make_stack("packages.xml", STACK2)
+
+        self.assertTrue(isinstance(columns, ColumnarSchema2))
+        self.assertEqual(columns.current(), tree.current())
+        self.assertEqual(columns.current_version(), tree.current_version())
+        self.assertEqual(columns.next_version(), tree.next_version())
+        for version in range(0, 7):
+            self.assertSameLookup(tree, columns, "version", version)
+        for date_time in ("20000101-000000", "20171106-104603", "20180702-144203",
+                          "20181221-142300", "20181221-150000", "20190101-000000"):
+            self.assertSameLookup(tree, columns, "file_on", date_time)
+        self.assertEqual(list(columns.history()), list(tree.history()))
+        self.assertEqual(list(columns.history("20180101-103813", "20181221-150000", ["install"])),
+                         list(tree.history("20180101-103813", "20181221-150000", ["install"])))
+
+    def test_schema2_empty(self):
+        versionless_file = os.path.join(self.tmpdir, "empty.xml")
+        SwinstallStackMgr().create(versionless_file, "2")
+        for schema in (SwinstallStackMgr().parse(versionless_file),
+                       SwinstallStackMgr().parse_columns(versionless_file)):
+            with self.assertRaises(LookupError):
+                schema.current()
+
+    def test_schema2_segments(self):
+        tree, _ = self.make_stack("packages.xml", STACK2)
+        tree.compact(keep=3)
+        columns = SwinstallStackMgr().parse_columns(os.path.join(self.tmpdir, "packages.xml"))
+
+        self.assertEqual(columns.version(2), tree.version(2))
+        self.assertEqual(columns.file_on("20180101-103813"), tree.file_on("20180101-103813"))
+        self.assertEqual(list(columns.history()), list(tree.history()))
+        self.assertEqual(list(columns._segment_columns.keys()), [1])
+
+    def test_schema1(self):
+        tree, columns = self.make_stack("packages.xml", STACK1)
+
+        self.assertTrue(isinstance(columns, ColumnarSchema1))
+        self.assertEqual(columns.current(), tree.current())
+        self.assertEqual(columns.current_version(), tree.current_version())
+        for version in ("20161213-093146", "20181102-144204", "20181110-104603",
+                        "20181110-104604"):
+            self.assertSameLookup(tree, columns, "version", version)
+        for date_time in ("20000101-000000", "20161213-093146", "20181103-000000",
+                          "20181106-000000", "20190101-000000"):
+            self.assertSameLookup(tree, columns, "file_on", date_time)
+        self.assertEqual(list(columns.history()), list(tree.history()))
+        self.assertEqual(list(columns.history(end="20181103-000000")),
+                         list(tree.history(end="20181103-000000")))
+
+    def test_read_only(self):
+        _, columns = self.make_stack("packages.xml", STACK2)
+        with self.assertRaises(NotImplementedError):
+            columns.rollback_element()
+
+
+if __name__ == '__main__':
+    unittest.main()
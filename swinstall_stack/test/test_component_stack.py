@@ -0,0 +1,180 @@
+#initialize testing environment
+import env
+# library imports
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.component_stack import ComponentStack
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="rollback" datetime="20180801-100000" hash="c94f6266789a483a43" revision="r12" version="2"/>
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" revision="r12" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+class ComponentStackTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(self.fullpath)
+        self.schemas = os.path.join(self.fullpath, "packages.xml_swinstall_stack")
+        with open(self.schemas,'w') as fh:
+            fh.write(STACK.format(self.schemas))
+        self.stack = ComponentStack(self.schemas, "packages.xml")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load(self):
+        self.assertEqual(list(self.stack.getStack()), [1, 2, 3])
+        self.assertEqual(self.stack.getStackLength(), 3)
+        self.assertEqual(self.stack.getCurrent(), 2)
+        self.assertEqual(self.stack.getCurrentIndex(), 1)
+
+    def test_missing_file(self):
+        stack = ComponentStack(os.path.join(self.fullpath, "missing"), "missing")
+        self.assertEqual(stack.getStackLength(), 0)
+        self.assertEqual(stack.getCurrent(), None)
+        self.assertEqual(stack.timestamp, None)
+
+    def test_getitem(self):
+        self.assertEqual(self.stack[0], 1)
+        self.assertEqual(list(self.stack[1:]), [2, 3])
+        self.assertEqual(list(self.stack[::-1]), [3, 2, 1])
+
+    def test_previous_next(self):
+        self.assertEqual(self.stack.previousVersion(), 1)
+        self.assertEqual(self.stack.nextVersion(), 3)
+        self.assertEqual(self.stack.nextVersion(5), 3)
+        with self.assertRaises(IndexError):
+            self.stack.previousVersion(2)
+
+    def test_roll(self):
+        self.stack.rollForward()
+        self.assertEqual(self.stack.getCurrent(), 3)
+        self.stack.rollBack(2)
+        self.assertEqual(self.stack.getCurrent(), 1)
+        with self.assertRaises(RuntimeError):
+            self.stack.rollBack()
+        self.assertEqual(self.stack.getCurrent(), 1)
+        with self.assertRaises(RuntimeError):
+            self.stack.rollForward(5)
+        self.assertEqual(self.stack.getCurrent(), 3)
+
+    def test_push_version(self):
+        self.stack.rollForward()
+        self.stack.pushVersion(self.stack.nextVersionNumber(), "abc")
+        self.assertEqual(list(self.stack.getStack()), [1, 2, 3, 4])
+        self.assertEqual(self.stack.getCurrent(), 4)
+
+    def test_push_after_rollback(self):
+        stack = ComponentStack(os.path.join(self.tmpdir, "new_swinstall_stack"), "new")
+        for version in (1, 2, 3):
+            stack.pushVersion(version, str(version))
+        stack.rollBack(2)
+        stack.pushVersion(stack.nextVersionNumber(), "4")
+        self.assertEqual(list(stack.getStack()), [1, 2, 3, 4])
+        self.assertEqual(stack.previousVersion(), 3)
+        stack.saveFile()
+
+        reloaded = ComponentStack(stack.file_path, "new")
+        self.assertEqual(list(reloaded.getStack()), list(stack.getStack()))
+        self.assertEqual(reloaded.getCurrent(), stack.getCurrent())
+        self.assertEqual(reloaded.previousVersion(), stack.previousVersion())
+
+    def test_clear_redo(self):
+        self.stack.clearRedo()
+        self.assertEqual(list(self.stack.getStack()), [1, 2])
+        self.assertEqual(self.stack.getCurrent(), 2)
+
+    def test_filter_version(self):
+        self.stack.filterVersion(1)
+        self.assertEqual(list(self.stack.getStack()), [2, 3])
+        self.assertEqual(self.stack.getCurrent(), 2)
+        with self.assertRaises(RuntimeError):
+            self.stack.filterVersion(2)
+
+    def test_copy(self):
+        clone = copy.deepcopy(self.stack)
+        clone.rollForward()
+        self.assertEqual(self.stack.getCurrent(), 2)
+        self.assertEqual(clone.getCurrent(), 3)
+
+    def test_save_roundtrip(self):
+        self.stack.rollForward(date_time=datetime_from_str("20180901-100000"))
+        self.stack.pushVersion(4, "abc", datetime_from_str("20180902-100000"))
+        self.stack.saveFile()
+
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        self.assertEqual(schema.current_version(), 4)
+        self.assertEqual(schema.next_version(), 5)
+        self.assertEqual(schema.version(2).revision, "r12")
+        self.assertEqual(schema.file_on("20180901-120000").action, "rollforward")
+        self.assertEqual(len(schema.root), 6)
+        self.assertEqual(ComponentStack(self.schemas, "packages.xml").getCurrent(), 4)
+
+    def compact(self):
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        schema.compact(keep=1)
+        return ComponentStack(self.schemas, "packages.xml")
+
+    def test_compacted(self):
+        # only the rollback to 2 is live; the installs are archived
+        stack = self.compact()
+        self.assertEqual(stack.getCurrent(), 2)
+        self.assertEqual(list(stack.getStack()), [1, 2, 3])
+        stack.rollForward(date_time=datetime_from_str("20180901-100000"))
+        stack.saveFile()
+
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        self.assertEqual(schema.segment_count(), 1)
+        self.assertEqual(schema.root.attrib.get("archived_until"), "20180702-144204")
+        self.assertEqual(len(schema.root), 2)
+        self.assertEqual(len(list(schema.history())), 5)
+        self.assertEqual((schema.current_version(), schema.next_version()), (3, 4))
+
+    def test_save_keeps_root_attributes(self):
+        with open(self.schemas,'w') as fh:
+            fh.write(STACK.format(self.schemas).replace(
+                'schema="2"', 'schema="2" collected_until="20171106-104603"'))
+        stack = ComponentStack(self.schemas, "packages.xml")
+        stack.saveFile()
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        self.assertEqual(schema.root.attrib.get("collected_until"), "20171106-104603")
+
+    def test_filter_archived(self):
+        stack = self.compact()
+        stack.clearRedo()
+        self.assertEqual(stack.nextVersionNumber(), 4)
+        stack.saveFile()
+
+        stack = ComponentStack(self.schemas, "packages.xml")
+        self.assertEqual(list(stack.getStack()), [1, 2])
+        # removed versions are not reused
+        self.assertEqual(stack.nextVersionNumber(), 4)
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        self.assertEqual([entry.version for entry in schema.history()], [2, 2, 1])
+
+    def test_save_conflict(self):
+        with open(self.schemas,'w') as fh:
+            fh.write(STACK.format(self.schemas) + "\n")
+        with self.assertRaises(RuntimeError):
+            self.stack.saveFile()
+        self.stack.reloadFile()
+        self.stack.saveFile()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.compression import (CODECS, CompressionPolicy, compress,
+                                         decompress, detect_codec, read_stack)
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.schemas.schema2 import Schema2
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+class CodecTest(unittest.TestCase):
+    def test_roundtrip(self):
+        data = STACK.format("/dd/facility/etc/bak/packages.xml/packages.xml_swinstall_stack")
+        for codec in CODECS:
+            compressed = compress(data, codec)
+            self.assertEqual(detect_codec(compressed), codec)
+            self.assertEqual(decompress(compressed), (data, codec))
+
+    def test_plain(self):
+        self.assertEqual(detect_codec(STACK), None)
+        self.assertEqual(decompress(STACK), (STACK, None))
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            compress(STACK, "zip")
+        with self.assertRaises(ValueError):
+            CompressionPolicy("zip")
+
+
+class CompressionPolicyTest(unittest.TestCase):
+    def test_preserve(self):
+        policy = CompressionPolicy()
+        self.assertEqual(policy.codec_for(STACK, "bz2"), "bz2")
+        self.assertEqual(policy.codec_for(STACK, None), None)
+
+    def test_none(self):
+        policy = CompressionPolicy("none")
+        self.assertEqual(policy.codec_for(STACK, "gzip"), None)
+
+    def test_min_size(self):
+        policy = CompressionPolicy("gzip", min_size=len(STACK) + 1)
+        self.assertEqual(policy.codec_for(STACK, None), None)
+        self.assertEqual(policy.codec_for(STACK * 2, None), "gzip")
+
+    def test_from_environment(self):
+        policy = CompressionPolicy.from_environment({
+            "SWINSTALL_STACK_COMPRESSION": "zlib",
+            "SWINSTALL_STACK_COMPRESSION_MIN_SIZE": "4096"})
+        self.assertEqual(policy.codec, "zlib")
+        self.assertEqual(policy.min_size, 4096)
+        self.assertEqual(CompressionPolicy.from_environment({}).codec, "preserve")
+
+
+class CompressedStackTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(self.fullpath)
+        self.schemas = os.path.join(self.fullpath, "packages.xml_swinstall_stack")
+
+        with open(self.schemas,'wb') as fh:
+            fh.write(compress(STACK.format(self.schemas), "gzip"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        Schema2.compression_policy = None
+
+    def test_parse_compressed(self):
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        self.assertEqual(schema.codec, "gzip")
+        self.assertEqual(schema.current_version(), 3)
+
+    def test_save_preserves_codec(self):
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        schema.insert_element("123456789", datetime_from_str("20181216-124101"))
+
+        self.assertEqual(read_stack(self.schemas)[1], "gzip")
+        self.assertEqual(SwinstallStackMgr().parse(self.versionless_file).current_version(), 4)
+
+    def test_save_honors_policy(self):
+        Schema2.compression_policy = CompressionPolicy("none")
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        schema.insert_element("123456789", datetime_from_str("20181216-124101"))
+
+        self.assertEqual(read_stack(self.schemas)[1], None)
+        self.assertEqual(schema.codec, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
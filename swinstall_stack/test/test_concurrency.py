@@ -0,0 +1,149 @@
+#initialize testing environment
+import env
+# library imports
+import copy
+from datetime import datetime
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+# local imports
+from swinstall_stack.backend import serialize
+from swinstall_stack.concurrency import (ConcurrentModificationError, StackToken,
+                                         read_stack_token, stat_token)
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.schemas.schema2 import Schema2
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+def _insert_worker(args):
+    """insert count elements into the stack of versionless_file"""
+    versionless_file, count = args
+    for index in range(count):
+        schema = SwinstallStackMgr().parse(versionless_file)
+        schema.insert_element("hash{}".format(index), datetime.now())
+    return count
+
+class ConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(self.fullpath)
+        self.schemas = os.path.join(self.fullpath, "packages.xml_swinstall_stack")
+
+        with open(self.schemas,'w') as fh:
+            fh.write(STACK.format(self.schemas))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self):
+        return SwinstallStackMgr().parse(self.versionless_file)
+
+    def test_token(self):
+        token = read_stack_token(self.schemas)[2]
+        self.assertTrue(isinstance(token, StackToken))
+        self.assertEqual(token, stat_token(self.schemas))
+        self.assertEqual(stat_token(os.path.join(self.tmpdir, "missing")), None)
+
+    def test_save_bumps_generation(self):
+        schema = self.parse()
+        self.assertEqual(schema.generation, None)
+        schema.insert_element("123456789", datetime_from_str("20181216-124101"))
+        schema.rollback_element(datetime_from_str("20181216-124102"))
+
+        self.assertEqual(schema.generation, 2)
+        self.assertEqual(self.parse().generation, 2)
+        self.assertEqual(os.listdir(self.fullpath), ["packages.xml_swinstall_stack"])
+
+    def test_rebase_insert(self):
+        first = self.parse()
+        second = self.parse()
+        first.insert_element("first", datetime_from_str("20181216-124101"))
+        second.insert_element("second", datetime_from_str("20181216-124102"))
+
+        schema = self.parse()
+        self.assertEqual(schema.current_version(), 5)
+        self.assertEqual(schema.version(4).hash, "first")
+        self.assertEqual(schema.version(5).hash, "second")
+
+    def test_rebase_rollback(self):
+        first = self.parse()
+        second = self.parse()
+        first.insert_element("first", datetime_from_str("20181216-124101"))
+        second.rollback_element(datetime_from_str("20181216-124102"))
+
+        self.assertEqual(self.parse().current_version(), 3)
+
+    def test_touch_is_rebased(self):
+        self.parse().insert_element("first", datetime_from_str("20181216-124101"))
+        schema = self.parse()
+        os.utime(self.schemas, (0, 0))
+        schema.insert_element("second", datetime_from_str("20181216-124102"))
+
+        self.assertEqual(self.parse().current_version(), 5)
+
+    def test_rewrite_keeping_generation(self):
+        self.parse().insert_element("first", datetime_from_str("20181216-124101"))
+        schema = self.parse()
+        schema.max_retries = 0
+        # a tool predating generations rewrites the stack, keeping the generation it read
+        legacy = self.parse()
+        rollback = copy.deepcopy(legacy.root[0])
+        rollback.attrib.update({"action": "rollback", "datetime": "20181216-124102", "version": "3"})
+        legacy.root.insert(0, rollback)
+        with open(self.schemas, "w") as fh:
+            fh.write(serialize(legacy.root))
+
+        with self.assertRaises(ConcurrentModificationError):
+            schema.insert_element("second", datetime_from_str("20181216-124103"))
+
+    def test_retries_exhausted(self):
+        first = self.parse()
+        second = self.parse()
+        second.max_retries = 0
+        first.insert_element("first", datetime_from_str("20181216-124101"))
+
+        with self.assertRaises(ConcurrentModificationError):
+            second.insert_element("second", datetime_from_str("20181216-124102"))
+        self.assertEqual(self.parse().current_version(), 4)
+
+    def test_legacy_start_time(self):
+        schema = Schema2(ET.parse(self.schemas).getroot(), datetime.now())
+        schema.insert_element("123456789", datetime_from_str("20181216-124101"))
+        self.assertEqual(self.parse().current_version(), 4)
+
+        stale = Schema2(ET.parse(self.schemas).getroot(), datetime(2000, 1, 1))
+        stale.max_retries = 0
+        with self.assertRaises(RuntimeError):
+            stale.insert_element("123456789", datetime_from_str("20181216-124101"))
+
+    def test_concurrent_installers(self):
+        pool = multiprocessing.Pool(4)
+        try:
+            total = sum(pool.map(_insert_worker, [(self.versionless_file, 5)] * 4))
+        finally:
+            pool.close()
+            pool.join()
+
+        schema = self.parse()
+        self.assertEqual(len(schema.root), 3 + total)
+        self.assertEqual(schema.current_version(), 3 + total)
+        self.assertEqual(schema.generation, total)
+
+
+if __name__ == '__main__':
+    unittest.main()
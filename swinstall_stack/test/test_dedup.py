@@ -0,0 +1,116 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.dedup import HARDLINK, REFLINK, dedup, stack_files
+from swinstall_stack.hashing import hash_file
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{path}" schema="2">
+   <elt action="rollback" datetime="20180705-000000" hash="{one}" version="1"/>
+   <elt action="install" datetime="20180704-000000" hash="{one}" version="4"/>
+   <elt action="install" datetime="20180703-000000" hash="{one}" version="3"/>
+   <elt action="install" datetime="20180702-000000" hash="{two}" version="2"/>
+   <elt action="install" datetime="20180701-000000" hash="{one}" version="1"/>
+</stack_history>
+'''
+
+STACK1='''<stack_history path="{path}">
+    <elt is_current="False" version="20180701-000000" />
+    <elt is_current="True" version="20180702-000000" />
+</stack_history>
+'''
+
+def write_stack(root, name, template, contents, **kwargs):
+    bak = os.path.join(root, "bak", name)
+    os.makedirs(bak)
+    path = os.path.join(bak, "{}_swinstall_stack".format(name))
+    with open(path, "w") as fh:
+        fh.write(template.format(path=path, **kwargs))
+    for version, data in contents:
+        with open(os.path.join(bak, "{}_{}".format(name, version)), "w") as fh:
+            fh.write(data)
+    return bak
+
+class DedupTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        source = os.path.join(self.tmpdir, "source")
+        with open(source, "w") as fh:
+            fh.write("one")
+        one = hash_file(source)
+        os.remove(source)
+        # version 4 records the hash of "one" but its contents differ
+        self.bak2 = write_stack(self.tmpdir, "packages.xml", STACK2,
+                                [("1", "one"), ("2", "two"), ("3", "one"), ("4", "ONE")],
+                                one=one, two="0" * 32)
+        self.bak1 = write_stack(os.path.join(self.tmpdir, "sub"), "tools.xml", STACK1,
+                                [("20180701-000000", "one"), ("20180702-000000", "one")])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, bak, version):
+        name = os.path.basename(bak)
+        return os.path.join(bak, "{}_{}".format(name, version))
+
+    def inode(self, bak, version):
+        return os.stat(self.path(bak, version)).st_ino
+
+    def test_stack_files(self):
+        files = stack_files(os.path.join(self.tmpdir, "packages.xml"))
+        self.assertEqual([path for _, path in files],
+                         [self.path(self.bak2, version) for version in (4, 3, 2, 1)])
+        files = stack_files(os.path.join(self.tmpdir, "sub", "tools.xml"))
+        self.assertEqual(set(hash_str for hash_str, _ in files), set([files[0][0]]))
+
+    def test_within_stacks(self):
+        results = sorted(dedup(self.tmpdir, processes=1))
+        self.assertEqual([(result.original, result.duplicates, result.size) for result in results],
+                         [(self.path(self.bak2, 1), [self.path(self.bak2, 3)], 3),
+                          (self.path(self.bak1, "20180701-000000"),
+                           [self.path(self.bak1, "20180702-000000")], 3)])
+        self.assertEqual(self.inode(self.bak2, 1), self.inode(self.bak2, 3))
+        self.assertNotEqual(self.inode(self.bak2, 1), self.inode(self.bak2, 4))
+        self.assertNotEqual(self.inode(self.bak2, 1), self.inode(self.bak1, "20180701-000000"))
+        with open(self.path(self.bak2, 3)) as fh:
+            self.assertEqual(fh.read(), "one")
+        # nothing is left to do
+        self.assertEqual(list(dedup(self.tmpdir, processes=1)), [])
+
+    def test_across_stacks(self):
+        results = list(dedup(self.tmpdir, across_stacks=True, processes=2))
+        self.assertEqual(sum(len(result.duplicates) for result in results), 3)
+        self.assertEqual(sum(result.size for result in results), 9)
+        self.assertEqual(len(set([self.inode(self.bak2, 1), self.inode(self.bak2, 3),
+                                  self.inode(self.bak1, "20180701-000000"),
+                                  self.inode(self.bak1, "20180702-000000")])), 1)
+
+    def test_dry_run(self):
+        results = list(dedup(self.tmpdir, across_stacks=True, processes=1, dry_run=True))
+        self.assertEqual(sum(result.size for result in results), 9)
+        self.assertNotEqual(self.inode(self.bak2, 1), self.inode(self.bak2, 3))
+
+    def test_reflink(self):
+        # reflinks are only supported by some filesystems; either way the
+        # versioned files must keep their contents
+        for result in dedup(self.tmpdir, method=REFLINK, processes=1):
+            for path in result.duplicates:
+                self.assertNotEqual(os.stat(path).st_ino, os.stat(result.original).st_ino)
+        for version in ("1", "3"):
+            with open(self.path(self.bak2, version)) as fh:
+                self.assertEqual(fh.read(), "one")
+        self.assertEqual(sorted(name for name in os.listdir(self.bak2)
+                                if name.startswith(".")), [])
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            list(dedup(self.tmpdir, method="symlink"))
+
+
+if __name__ == '__main__':
+    unittest.main()
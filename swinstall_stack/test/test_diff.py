@@ -0,0 +1,79 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.diff import DiffEntry, DiffError, diff_stack, diff_tree
+from swinstall_stack.utils import datetime_from_str
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{path}" schema="2">
+{entries}
+</stack_history>
+'''
+
+ENTRY = '   <elt action="install" datetime="{}" hash="{}" version="{}"/>'
+
+def write_stack(root, name, datetimes):
+    bak = os.path.join(root, "bak", name)
+    os.makedirs(bak)
+    path = os.path.join(bak, "{}_swinstall_stack".format(name))
+    entries = [ENTRY.format(date_time, version, version)
+               for version, date_time in reversed(list(enumerate(datetimes, 1)))]
+    with open(path, "w") as fh:
+        fh.write(STACK.format(path=path, entries="\n".join(entries)))
+    return os.path.join(root, name)
+
+class DiffTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.changed = write_stack(self.tmpdir, "changed.xml",
+                                   ["20180101-000000", "20180601-000000"])
+        self.unchanged = write_stack(self.tmpdir, "unchanged.xml", ["20170101-000000"])
+        self.added = write_stack(os.path.join(self.tmpdir, "sub"), "added.xml",
+                                 ["20180301-000000"])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def versioned(self, swinstalled_file, version):
+        name = os.path.basename(swinstalled_file)
+        return os.path.join(os.path.dirname(swinstalled_file), "bak", name,
+                            "{}_{}".format(name, version))
+
+    def test_diff_stack(self):
+        entry = diff_stack(self.changed, "20180201-000000", datetime_from_str("20180701-000000"))
+        self.assertEqual(entry, DiffEntry(self.changed,
+                                          self.versioned(self.changed, 1),
+                                          self.versioned(self.changed, 2)))
+        self.assertEqual(diff_stack(self.unchanged, "20180201-000000", "20180701-000000"), None)
+
+    def test_diff_stack_not_yet_installed(self):
+        entry = diff_stack(self.added, "20180201-000000", "20180701-000000")
+        self.assertEqual(entry.old_path, None)
+        self.assertEqual(entry.new_path, self.versioned(self.added, 1))
+
+    def test_diff_tree(self):
+        for processes in (1, 2):
+            entries = list(diff_tree(self.tmpdir, "20180201-000000", "20180701-000000",
+                                     processes))
+            self.assertEqual([entry.swinstalled_file for entry in entries],
+                             [self.changed, self.added])
+
+    def test_diff_tree_unreadable(self):
+        stack = os.path.join(self.tmpdir, "bak", "unchanged.xml", "unchanged.xml_swinstall_stack")
+        with open(stack, "w") as fh:
+            fh.write("not a stack")
+        for processes in (1, 2):
+            entries = list(diff_tree(self.tmpdir, "20180201-000000", "20180701-000000",
+                                     processes))
+            self.assertEqual([entry.swinstalled_file for entry in entries],
+                             [self.changed, self.unchanged, self.added])
+            self.assertIsInstance(entries[1], DiffError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#initialize testing environment
+import env
+# library imports
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+# local imports
+from swinstall_stack.export import ExportEntry, export, export_entries, stack_entries
+
+STACK1='''<stack_history path="{}">
+    <elt is_current="False" version="20161213-093146_r575055" />
+    <elt is_current="True" version="20181105-103813" />
+    <elt is_current="False" version="20181110-104603" />
+</stack_history>
+'''
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="rollback" datetime="20181221-150000" hash="5c8fdabe2ae7fa9287c0672b88ef6593" version="4"/>
+   <elt action="install" datetime="20181221-142313" hash="c618755af9b63728411bc536d2c60cf2" version="5"/>
+   <elt action="install" datetime="20181221-142248" hash="5c8fdabe2ae7fa9287c0672b88ef6593" version="4" revision="r12"/>
+</stack_history>
+'''
+
+def write_stack(root, name, stack):
+    bak = os.path.join(root, "bak", name)
+    os.makedirs(bak)
+    path = os.path.join(bak, "{}_swinstall_stack".format(name))
+    with open(path, "w") as fh:
+        fh.write(stack.format(path))
+    return os.path.join(root, name)
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.schema1 = write_stack(self.tmpdir, "a.xml", STACK1)
+        self.schema2 = write_stack(os.path.join(self.tmpdir, "sub"), "b.xml", STACK2)
+        write_stack(self.tmpdir, "broken.xml", "<stack_history")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stack_entries(self):
+        self.assertEqual(stack_entries(self.schema1), [
+            ExportEntry(self.schema1, "1", "20181110-104603", "20181110-104603", "install",
+                        None, None, False),
+            ExportEntry(self.schema1, "1", "20181105-103813", "20181105-103813", "install",
+                        None, None, True),
+            ExportEntry(self.schema1, "1", "20161213-093146_r575055", "20161213-093146",
+                        "install", None, "r575055", False)])
+        self.assertEqual(stack_entries(self.schema2), [
+            ExportEntry(self.schema2, "2", 4, "20181221-150000", "rollback",
+                        "5c8fdabe2ae7fa9287c0672b88ef6593", None, True),
+            ExportEntry(self.schema2, "2", 5, "20181221-142313", "install",
+                        "c618755af9b63728411bc536d2c60cf2", None, False),
+            ExportEntry(self.schema2, "2", 4, "20181221-142248", "install",
+                        "5c8fdabe2ae7fa9287c0672b88ef6593", "r12", False)])
+
+    def test_export_entries_order(self):
+        expected = stack_entries(self.schema1) + stack_entries(self.schema2)
+        for processes in (1, 2):
+            self.assertEqual(list(export_entries(self.tmpdir, processes)), expected)
+
+    def test_jsonl(self):
+        output = StringIO()
+        self.assertEqual(export(self.tmpdir, output, "jsonl", processes=1), 6)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 6)
+        record = json.loads(lines[3])
+        self.assertEqual(record, {"path": self.schema2, "schema": "2", "version": 4,
+                                  "datetime": "20181221-150000", "action": "rollback",
+                                  "hash": "5c8fdabe2ae7fa9287c0672b88ef6593",
+                                  "revision": None, "is_current": True})
+        self.assertTrue(lines[0].startswith('{"path": '))
+
+    def test_csv(self):
+        output = StringIO()
+        export(self.tmpdir, output, "csv", processes=1)
+        rows = list(csv.reader(StringIO(output.getvalue())))
+        self.assertEqual(rows[0], list(ExportEntry._fields))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[-1][2:7], ["4", "20181221-142248", "install",
+                                         "5c8fdabe2ae7fa9287c0672b88ef6593", "r12"])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            export(self.tmpdir, StringIO(), "xml")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.fsck import (CURRENT_COUNT, HASH_MISMATCH, MISSING, DANGLING_ROLLBACK,
+                                  check_stack, fsck, load_checkpoint)
+from swinstall_stack.hashing import hash_file
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{path}" schema="2">
+   <elt action="rollback" datetime="20180702-150000" hash="{hash1}" version="4"/>
+   <elt action="install" datetime="20180702-144204" hash="{hash2}" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="{hash1}" version="1"/>
+</stack_history>
+'''
+
+STACK1='''<stack_history path="{path}">
+    <elt is_current="True" version="20181102-144204" />
+    <elt is_current="True" version="20181105-103813" />
+</stack_history>
+'''
+
+def write_stack(root, name, template, **kwargs):
+    bak = os.path.join(root, "bak", name)
+    os.makedirs(bak)
+    path = os.path.join(bak, "{}_swinstall_stack".format(name))
+    with open(path, "w") as fh:
+        fh.write(template.format(path=path, **kwargs))
+    return os.path.join(root, name)
+
+def write_file(path, contents):
+    with open(path, "w") as fh:
+        fh.write(contents)
+
+class FsckTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.good = os.path.join(self.tmpdir, "good")
+        bak = os.path.join(self.good, "bak", "packages.xml")
+        source = os.path.join(self.tmpdir, "source")
+        write_file(source, "one")
+        hash1 = hash_file(source)
+        write_file(source, "two")
+        hash2 = hash_file(source)
+        self.schema2 = write_stack(self.good, "packages.xml", STACK2, hash1=hash1, hash2=hash2)
+        write_file(os.path.join(bak, "packages.xml_1"), "one")
+        write_file(os.path.join(bak, "packages.xml_2"), "two")
+        self.bak = bak
+
+        self.schema1 = write_stack(os.path.join(self.tmpdir, "bad"), "tools.xml", STACK1)
+        bak1 = os.path.join(self.tmpdir, "bad", "bak", "tools.xml")
+        write_file(os.path.join(bak1, "tools.xml_20181102-144204"), "a")
+        write_file(os.path.join(bak1, "tools.xml_20181105-103813"), "b")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def problems(self, issues):
+        return sorted(issue.problem for issue in issues)
+
+    def test_check_schema2_dangling_rollback(self):
+        self.assertEqual(self.problems(check_stack(self.schema2)), [DANGLING_ROLLBACK])
+
+    def test_check_schema2_hash_mismatch(self):
+        write_file(os.path.join(self.bak, "packages.xml_2"), "changed")
+        self.assertEqual(self.problems(check_stack(self.schema2)),
+                         [DANGLING_ROLLBACK, HASH_MISMATCH])
+        self.assertEqual(self.problems(check_stack(self.schema2, verify_hashes=False)),
+                         [DANGLING_ROLLBACK])
+
+    def test_check_schema2_missing(self):
+        os.remove(os.path.join(self.bak, "packages.xml_1"))
+        self.assertEqual(self.problems(check_stack(self.schema2)), [DANGLING_ROLLBACK, MISSING])
+
+    def test_check_schema1_current_count(self):
+        self.assertEqual(self.problems(check_stack(self.schema1)), [CURRENT_COUNT])
+
+    def test_fsck_tree(self):
+        for processes in (1, 2):
+            issues = list(fsck(self.tmpdir, processes=processes))
+            self.assertEqual(self.problems(issues), [CURRENT_COUNT, DANGLING_ROLLBACK])
+
+    def test_fsck_checkpoint(self):
+        checkpoint = os.path.join(self.tmpdir, "checkpoint")
+        issues = fsck(self.tmpdir, processes=1, checkpoint=checkpoint)
+        # interrupt the run while reporting on the second stack
+        next(issues)
+        next(issues)
+        issues.close()
+        self.assertEqual(load_checkpoint(checkpoint), set([self.schema1]))
+
+        resumed = list(fsck(self.tmpdir, processes=1, checkpoint=checkpoint))
+
+        self.assertEqual(self.problems(resumed), [DANGLING_ROLLBACK])
+        self.assertEqual(load_checkpoint(checkpoint), set([self.schema1, self.schema2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
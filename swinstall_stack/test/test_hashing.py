@@ -0,0 +1,99 @@
+#initialize testing environment
+import env
+# library imports
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack import hashing
+from swinstall_stack.hashing import hash_file, hash_files
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+</stack_history>
+'''
+
+class HashingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.paths = []
+        for index in range(3):
+            path = os.path.join(self.tmpdir, "file{}".format(index))
+            with open(path, "wb") as fh:
+                fh.write("contents {}\n".format(index) * (index + 1))
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self, path):
+        with open(path, "rb") as fh:
+            return hashlib.md5(fh.read()).hexdigest()
+
+    def test_hash_file(self):
+        self.assertEqual(hash_file(self.paths[0]), self.expected(self.paths[0]))
+
+    def test_hash_file_mmap(self):
+        threshold = hashing.MMAP_THRESHOLD
+        hashing.MMAP_THRESHOLD = 1
+        try:
+            self.assertEqual(hash_file(self.paths[2]), self.expected(self.paths[2]))
+        finally:
+            hashing.MMAP_THRESHOLD = threshold
+
+    def test_hash_file_throttle(self):
+        requested = []
+        self.assertEqual(hash_file(self.paths[1], throttle=requested.append),
+                         self.expected(self.paths[1]))
+        self.assertTrue(requested)
+
+    def test_hash_files(self):
+        expected = [(path, self.expected(path)) for path in self.paths]
+        self.assertEqual(hash_files(self.paths, processes=2), expected)
+        self.assertEqual(hash_files(self.paths, processes=1), expected)
+
+
+class InstallTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(self.fullpath)
+        self.schemas = os.path.join(self.fullpath, "packages.xml_swinstall_stack")
+        with open(self.schemas,'w') as fh:
+            fh.write(STACK.format(self.schemas))
+        self.source = os.path.join(self.tmpdir, "source.xml")
+        with open(self.source, "w") as fh:
+            fh.write("<packages/>")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_install(self):
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+
+        metadata = schema.install(self.source, datetime_from_str("20181216-124101"))
+
+        self.assertEqual(metadata.version, 4)
+        self.assertEqual(metadata.hash, hash_file(self.source))
+
+    def test_install_identical_is_noop(self):
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        schema.install(self.source, datetime_from_str("20181216-124101"))
+        mtime = os.path.getmtime(self.schemas)
+
+        self.assertEqual(schema.install(self.source), None)
+        self.assertEqual(schema.current_version(), 4)
+        self.assertEqual(os.path.getmtime(self.schemas), mtime)
+
+
+if __name__ == '__main__':
+    unittest.main()
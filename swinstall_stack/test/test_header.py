@@ -0,0 +1,112 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK1='''<stack_history path="{}">
+    <elt is_current="False" version="20161213-093146_r575055" />
+    <elt is_current="False" version="20181102-144204" />
+    <elt is_current="True" version="20181105-103813" />
+    <elt is_current="False" version="20181110-104603" />
+</stack_history>
+'''
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+class HeaderTestBase(unittest.TestCase):
+    stack = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(self.fullpath)
+        self.schemas = os.path.join(self.fullpath, "packages.xml_swinstall_stack")
+        with open(self.schemas,'w') as fh:
+            fh.write(self.stack.format(self.schemas))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self):
+        return SwinstallStackMgr().parse(self.versionless_file)
+
+
+class Schema1HeaderTest(HeaderTestBase):
+    stack = STACK1
+
+    def test_fallback_without_header(self):
+        schema = self.parse()
+        self.assertEqual(schema.current_version(), datetime_from_str("20181105-103813"))
+
+    def test_insert_maintains_header(self):
+        self.parse().insert_element(datetime_from_str("20181216-124101"))
+
+        schema = self.parse()
+        self.assertEqual(schema.root.attrib["current"], "20181216-124101")
+        currents = [elt.attrib["version"] for elt in schema.root
+                    if elt.attrib["is_current"] == "True"]
+        self.assertEqual(currents, ["20181216-124101"])
+
+    def test_rollback_maintains_header(self):
+        self.parse().rollback_element()
+
+        schema = self.parse()
+        self.assertEqual(schema.root.attrib["current"], "20181102-144204")
+        self.assertEqual(schema.root[1].attrib["is_current"], "True")
+        self.assertEqual(schema.root[2].attrib["is_current"], "False")
+
+    def test_header_is_trusted(self):
+        schema = self.parse()
+        schema.root.attrib["current"] = "20181110-104603"
+        self.assertEqual(schema.current().version, datetime_from_str("20181110-104603"))
+
+
+class Schema2HeaderTest(HeaderTestBase):
+    stack = STACK2
+
+    def test_fallback_without_header(self):
+        schema = self.parse()
+        self.assertEqual(schema.next_version(), 4)
+        self.assertEqual(schema.current_version(), 3)
+
+    def test_insert_maintains_header(self):
+        self.parse().insert_element("123456789", datetime_from_str("20181216-124101"))
+
+        schema = self.parse()
+        self.assertEqual(schema.root.attrib["current"], "4")
+        self.assertEqual(schema.root.attrib["max_version"], "4")
+
+    def test_rollback_maintains_header(self):
+        self.parse().rollback_element(datetime_from_str("20181216-124101"))
+
+        schema = self.parse()
+        self.assertEqual(schema.root.attrib["current"], "2")
+        self.assertEqual(schema.root.attrib["max_version"], "3")
+        self.assertEqual(schema.next_version(), 4)
+
+    def test_header_is_trusted(self):
+        schema = self.parse()
+        schema.root.attrib["max_version"] = "10"
+        schema.root.attrib["current"] = "7"
+        self.assertEqual(schema.next_version(), 11)
+        self.assertEqual(schema.current_version(), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
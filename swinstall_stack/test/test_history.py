@@ -0,0 +1,114 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK1='''<stack_history path="{}">
+    <elt is_current="False" version="20161213-093146_r575055" />
+    <elt is_current="False" version="20181102-144204" />
+    <elt is_current="True" version="20181105-103813" />
+    <elt is_current="False" version="20181110-104603" />
+</stack_history>
+'''
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20181221-142313" hash="c618755af9b63728411bc536d2c60cf2" version="5"/>
+   <elt action="install" datetime="20181221-142248" hash="5c8fdabe2ae7fa9287c0672b88ef6593" version="4"/>
+   <elt action="rollback" datetime="20181221-102242" hash="294fc86579b14b7d39" version="1"/>
+   <elt action="rollback" datetime="20181221-102242" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+class HistoryTestBase(unittest.TestCase):
+    stack = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(self.fullpath)
+        self.schemas = os.path.join(self.fullpath, "packages.xml_swinstall_stack")
+        with open(self.schemas,'w') as fh:
+            fh.write(self.stack.format(self.schemas))
+        self.schema = SwinstallStackMgr().parse(self.versionless_file)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+class Schema1HistoryTest(HistoryTestBase):
+    stack = STACK1
+
+    def test_history(self):
+        versions = [metadata.version for metadata in self.schema.history()]
+        self.assertEqual(versions, [datetime_from_str(version) for version in
+                                    ("20181110-104603", "20181105-103813",
+                                     "20181102-144204", "20161213-093146")])
+
+    def test_history_range(self):
+        history = list(self.schema.history("20181102-144204", "20181109-000000"))
+        self.assertEqual([metadata.version for metadata in history],
+                         [datetime_from_str("20181105-103813"),
+                          datetime_from_str("20181102-144204")])
+        self.assertEqual(history[0].is_current, "True")
+
+    def test_history_actions(self):
+        self.assertEqual(list(self.schema.history(actions=["rollback"])), [])
+        self.assertEqual(len(list(self.schema.history(actions=["install"]))), 4)
+
+
+class Schema2HistoryTest(HistoryTestBase):
+    stack = STACK2
+
+    def test_history(self):
+        versions = [metadata.version for metadata in self.schema.history()]
+        self.assertEqual(versions, [5, 4, 1, 2, 3, 2, 1])
+
+    def test_history_range(self):
+        history = self.schema.history(datetime_from_str("20180101-103813"),
+                                      datetime_from_str("20181221-102242"))
+        self.assertEqual([metadata.version for metadata in history], [1, 2, 3, 2])
+
+    def test_history_before_start(self):
+        self.assertEqual(list(self.schema.history(end="20000101-000000")), [])
+        self.assertEqual(list(self.schema.history(start="20190101-000000")), [])
+
+    def test_history_actions(self):
+        history = self.schema.history(actions=("rollback",))
+        self.assertEqual([metadata.version for metadata in history], [1, 2])
+
+    def test_history_spans_archive(self):
+        self.schema.compact(keep=4)
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+
+        recent = list(schema.history(start="20181221-102242"))
+        self.assertEqual([metadata.version for metadata in recent], [5, 4, 1, 2])
+        self.assertEqual(schema._segment_roots, {})
+
+        older = list(schema.history(end="20180702-144204"))
+        self.assertEqual([metadata.version for metadata in older], [3, 2, 1])
+
+    def test_history_is_lazy(self):
+        history = self.schema.history()
+        self.assertEqual(next(history).version, 5)
+        # altering an entry which has not been consumed yet shows up
+        self.schema.root[1].attrib["hash"] = "changed"
+        self.assertEqual(next(history).hash, "changed")
+
+
+if __name__ == '__main__':
+    unittest.main()
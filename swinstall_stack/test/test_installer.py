@@ -0,0 +1,172 @@
+#initialize testing environment
+import env
+# library imports
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack import installer
+from swinstall_stack.hashing import hash_file
+from swinstall_stack.installer import copy_file, install_file, install_tree
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+def _install_worker(args):
+    """install a file with unique contents into dest"""
+    source_dir, dest, index = args
+    source_file = os.path.join(source_dir, str(index), "packages.xml")
+    os.makedirs(os.path.dirname(source_file))
+    with open(source_file, "w") as fh:
+        fh.write("<packages index='{}'/>".format(index))
+    return install_file(source_file, dest)
+
+class CreateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.stack = os.path.join(self.tmpdir, "bak", "packages.xml",
+                                  "packages.xml_swinstall_stack")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_create(self):
+        mgr = SwinstallStackMgr()
+        self.assertTrue(mgr.create(self.versionless_file))
+        self.assertFalse(mgr.create(self.versionless_file))
+
+        schema = mgr.parse(self.versionless_file)
+        self.assertEqual(schema.schema_version, "2")
+        self.assertEqual(schema.swinstall_stack, self.stack)
+        self.assertEqual(len(schema.root), 0)
+        self.assertEqual(schema.next_version(), 1)
+        with self.assertRaises(LookupError):
+            schema.current()
+        self.assertEqual(os.listdir(os.path.dirname(self.stack)),
+                         ["packages.xml_swinstall_stack"])
+
+    def test_parse_create(self):
+        with self.assertRaises(IOError):
+            SwinstallStackMgr().parse(self.versionless_file)
+        schema = SwinstallStackMgr().parse(self.versionless_file, create=True)
+        self.assertEqual(schema.swinstall_stack, self.stack)
+
+    def test_create_unknown_schema(self):
+        with self.assertRaises(KeyError):
+            SwinstallStackMgr().create(self.versionless_file, "9")
+
+
+class InstallerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, "src")
+        self.dest = os.path.join(self.tmpdir, "dest")
+        os.makedirs(os.path.join(self.source, "etc"))
+        self.write("packages.xml", "<packages/>")
+        self.write(os.path.join("etc", "config.yaml"), "a: 1")
+        self.write(os.path.join("etc", "other.yaml"), "b: 2")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, contents):
+        with open(os.path.join(self.source, name), "w") as fh:
+            fh.write(contents)
+
+    def read(self, *names):
+        with open(os.path.join(self.dest, *names)) as fh:
+            return fh.read()
+
+    def test_copy_file(self):
+        dest_file = os.path.join(self.tmpdir, "copy")
+        copy_file(os.path.join(self.source, "packages.xml"), dest_file)
+        with open(dest_file) as fh:
+            self.assertEqual(fh.read(), "<packages/>")
+
+    def kernel_copy(self, size):
+        source_file = os.path.join(self.source, "packages.xml")
+        dest_file = os.path.join(self.tmpdir, "copy")
+        with open(source_file, "rb") as src, open(dest_file, "wb") as dst:
+            copied = installer._copy_kernel(src.fileno(), dst.fileno(), size)
+        with open(dest_file) as fh:
+            return copied, fh.read()
+
+    @unittest.skipIf(installer._copy_file_range is None and installer._sendfile is None,
+                     "no zero copy system call")
+    def test_copy_kernel(self):
+        self.assertEqual(self.kernel_copy(11), (True, "<packages/>"))
+        # the source ends before size bytes have been copied
+        self.assertFalse(self.kernel_copy(20)[0])
+
+    @unittest.skipIf(installer._sendfile is None, "no sendfile")
+    def test_copy_kernel_sendfile(self):
+        copy_file_range, installer._copy_file_range = installer._copy_file_range, None
+        try:
+            self.assertEqual(self.kernel_copy(11), (True, "<packages/>"))
+        finally:
+            installer._copy_file_range = copy_file_range
+
+    def test_copy_file_fallback(self):
+        functions = (installer._copy_file_range, installer._sendfile)
+        installer._copy_file_range = installer._sendfile = None
+        try:
+            self.test_copy_file()
+        finally:
+            installer._copy_file_range, installer._sendfile = functions
+
+    def test_install_file(self):
+        source_file = os.path.join(self.source, "packages.xml")
+        versioned_file = install_file(source_file, self.dest,
+                                      datetime_from_str("20181216-124101"))
+
+        self.assertEqual(versioned_file,
+                         os.path.join(self.dest, "bak", "packages.xml", "packages.xml_1"))
+        self.assertEqual(self.read("packages.xml"), "<packages/>")
+        # identical contents are not reinstalled
+        self.assertEqual(install_file(source_file, self.dest), None)
+
+        self.write("packages.xml", "<packages></packages>")
+        install_file(source_file, self.dest)
+        self.assertEqual(self.read("packages.xml"), "<packages></packages>")
+        schema = SwinstallStackMgr().parse(os.path.join(self.dest, "packages.xml"))
+        self.assertEqual(schema.current_version(), 2)
+        self.assertEqual(schema.version(1).datetime, datetime_from_str("20181216-124101"))
+
+    def test_install_tree(self):
+        for processes in (1, 2):
+            results = sorted(install_tree(self.source, self.dest, processes))
+            self.assertEqual(len(results), 3)
+
+        self.assertEqual(self.read("etc", "config.yaml"), "a: 1")
+        self.assertEqual(self.read("etc", "other.yaml"), "b: 2")
+        self.assertEqual(self.read("packages.xml"), "<packages/>")
+        # the second run found nothing to install
+        self.assertEqual([versioned for _, versioned in results], [None, None, None])
+
+    def test_concurrent_install_file(self):
+        pool = multiprocessing.Pool(4)
+        try:
+            installed = pool.map(_install_worker, [(self.source, self.dest, index)
+                                                   for index in range(8)])
+        finally:
+            pool.close()
+            pool.join()
+
+        schema = SwinstallStackMgr().parse(os.path.join(self.dest, "packages.xml"))
+        self.assertEqual(sorted(installed),
+                         sorted(schema._versioned_file(version) for version in range(1, 9)))
+        for version in range(1, 9):
+            self.assertEqual(hash_file(schema._versioned_file(version)),
+                             schema.version(version).hash)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(schema.swinstall_stack))),
+                         sorted(["packages.xml_swinstall_stack"] +
+                                ["packages.xml_{}".format(version) for version in range(1, 9)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+# local imports
+from swinstall_stack import links as links_module
+from swinstall_stack.links import relink_tree, update_link, update_links
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+
+import_schemas()
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="rollback" datetime="20180702-150000" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2"/>
+</stack_history>
+'''
+
+class LinksTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_stack(self, name):
+        fullpath = os.path.join(self.tmpdir, "bak", name)
+        os.makedirs(fullpath)
+        stack = os.path.join(fullpath, name + "_swinstall_stack")
+        with open(stack, 'w') as fh:
+            fh.write(STACK.format(stack))
+        return os.path.join(self.tmpdir, name)
+
+    def test_update_link(self):
+        versionless = os.path.join(self.tmpdir, "packages.xml")
+        update_link(versionless, os.path.join(self.tmpdir, "bak", "packages.xml", "packages.xml_1"))
+        update_link(versionless, os.path.join(self.tmpdir, "bak", "packages.xml", "packages.xml_2"))
+
+        self.assertEqual(os.readlink(versionless), os.path.join("bak", "packages.xml", "packages.xml_2"))
+        self.assertEqual(os.listdir(self.tmpdir), ["packages.xml"])
+
+    def test_update_links(self):
+        links = [(os.path.join(self.tmpdir, "file{}".format(i)),
+                  os.path.join(self.tmpdir, "bak", "file{}_1".format(i)))
+                 for i in range(20)]
+
+        self.assertEqual(update_links(links, threads=4), 20)
+        for versionless, versioned in links:
+            self.assertEqual(os.path.realpath(versionless), os.path.realpath(versioned))
+        self.assertEqual(update_links([]), 0)
+
+    def test_update_links_one_directory(self):
+        links = [(os.path.join(self.tmpdir, "file{}".format(i)),
+                  os.path.join(self.tmpdir, "bak", "file{}_1".format(i)))
+                 for i in range(20)]
+        threads = set()
+        fsynced = []
+        swap_link, fsync_dir = links_module._swap_link, links_module.fsync_dir
+
+        def record_swap(*link):
+            threads.add(threading.current_thread().ident)
+            time.sleep(0.01)
+            swap_link(*link)
+
+        links_module._swap_link = record_swap
+        links_module.fsync_dir = fsynced.append
+        try:
+            self.assertEqual(update_links(links, threads=4), 20)
+        finally:
+            links_module._swap_link, links_module.fsync_dir = swap_link, fsync_dir
+        # the links of a single directory are spread across the pool
+        self.assertGreater(len(threads), 1)
+        self.assertEqual(fsynced, [self.tmpdir])
+
+    def test_schema_update_link(self):
+        versionless = self.make_stack("packages.xml")
+        schema = SwinstallStackMgr().parse(versionless)
+
+        self.assertEqual(schema.versionless_path(), versionless)
+        schema.update_link()
+        self.assertEqual(os.readlink(versionless), os.path.join("bak", "packages.xml", "packages.xml_2"))
+
+    def test_relink_tree(self):
+        names = ["a.xml", "b.xml", "c.xml"]
+        for name in names:
+            self.make_stack(name)
+
+        self.assertEqual(relink_tree(self.tmpdir, threads=2), 3)
+        for name in names:
+            self.assertEqual(os.readlink(os.path.join(self.tmpdir, name)),
+                             os.path.join("bak", name, name + "_2"))
+
+
+if __name__ == '__main__':
+    unittest.main()
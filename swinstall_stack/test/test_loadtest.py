@@ -0,0 +1,68 @@
+#initialize testing environment
+import env
+# library imports
+from datetime import datetime
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.loadtest import (CURRENT, INSERT, ROLLBACK, LoadTestResult, _seed, _stack_path, loadtest,
+                                      parse_mix, verify_stack)
+from swinstall_stack.manager import SwinstallStackMgr
+
+class LoadTestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_serial(self):
+        result = loadtest(self.tmpdir, processes=1, stacks=2, operations=30, seed=1)
+        self.assertEqual(result.operations + result.rejections, 30)
+        self.assertEqual((result.conflicts, result.failures), (0, 0))
+        self.assertTrue(result.correct, str(result))
+        self.assertTrue(result.percentile(CURRENT, 0.5) <= result.percentile(CURRENT, 1.0))
+
+    def test_percentile(self):
+        result = LoadTestResult(1, 1.0, {CURRENT: 26}, {CURRENT: range(1, 27)}, 0, 0, 0, [], [])
+        # nearest rank: ceil(0.9 * 26) = 24
+        self.assertEqual(result.percentile(CURRENT, 0.9), 24)
+        self.assertEqual(result.percentile(CURRENT, 0.5), 13)
+        self.assertEqual(result.percentile(CURRENT, 1.0), 26)
+        self.assertEqual(result.percentile(CURRENT, 0.0), 1)
+
+    def test_concurrent(self):
+        for schema_version in ("1", "2"):
+            result = loadtest(processes=3, operations=15, schema_version=schema_version,
+                              seed=2, retry_delay=0.001)
+            self.assertEqual(result.operations + result.rejections + result.failures, 45)
+            self.assertTrue(result.correct, str(result))
+
+    def test_verify_detects_lost_update(self):
+        _seed(self.tmpdir, 1, "2")
+        swinstalled_file = _stack_path(self.tmpdir, 0)
+        schema = SwinstallStackMgr().parse(swinstalled_file)
+        generation = schema.generation
+        self.assertEqual(verify_stack(swinstalled_file, [], generation), ([], []))
+
+        lost, errors = verify_stack(swinstalled_file, ["w0o1"], generation + 1)
+        self.assertEqual(lost, ["w0o1"])
+        self.assertEqual(len(errors), 1)
+
+        schema.insert_element("0" * 32, datetime.now(), "w0o2")
+        schema.insert_element("1" * 32, datetime.now(), "w0o2")
+        lost, errors = verify_stack(swinstalled_file, ["w0o2"], None)
+        self.assertEqual((lost, len(errors)), ([], 1))
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("insert=2,rollback,current=0.5"),
+                         ((INSERT, 2.0), (ROLLBACK, 1.0), (CURRENT, 0.5)))
+        with self.assertRaises(ValueError):
+            parse_mix("install=1")
+        with self.assertRaises(ValueError):
+            parse_mix("current=0")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#initialize testing environment
+import env
+# library imports
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack import metrics
+from swinstall_stack.concurrency import ConcurrentModificationError
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.metrics import (CONFLICTS, LOOKUPS, OPERATIONS, PARSES, SAVE_SECONDS,
+                                     Metrics, flushed)
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+@flushed
+def lookup_worker(value):
+    metrics.increment(LOOKUPS, method="worker")
+    return value
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.textfile = os.path.join(self.tmpdir, "swinstall_stack.prom")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_counter(self):
+        registry = Metrics()
+        registry.increment(PARSES, (("schema", "2"),))
+        registry.increment(PARSES, (("schema", "2"),), 2)
+        self.assertEqual(registry.samples(), {'swinstall_stack_parses_total{schema="2"}': 3})
+
+    def test_histogram(self):
+        registry = Metrics()
+        registry.observe(SAVE_SECONDS, 0.003)
+        registry.observe(SAVE_SECONDS, 20)
+        samples = registry.samples()
+        self.assertEqual(samples['swinstall_stack_save_seconds_bucket{le="0.0025"}'], 0)
+        self.assertEqual(samples['swinstall_stack_save_seconds_bucket{le="0.005"}'], 1)
+        self.assertEqual(samples['swinstall_stack_save_seconds_bucket{le="10.0"}'], 1)
+        self.assertEqual(samples['swinstall_stack_save_seconds_bucket{le="+Inf"}'], 2)
+        self.assertEqual(samples['swinstall_stack_save_seconds_count'], 2)
+        self.assertAlmostEqual(samples['swinstall_stack_save_seconds_sum'], 20.003)
+
+    def test_render(self):
+        registry = Metrics(self.textfile)
+        registry.increment(LOOKUPS, (("method", "current"),))
+        registry.observe(SAVE_SECONDS, 0.2)
+        registry.flush()
+        with open(self.textfile) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[:3], [
+            "# HELP swinstall_stack_lookups_total Queries answered by a stack, by method.",
+            "# TYPE swinstall_stack_lookups_total counter",
+            'swinstall_stack_lookups_total{method="current"} 1'])
+        self.assertEqual(lines[4], "# TYPE swinstall_stack_save_seconds histogram")
+        self.assertEqual(lines[5], 'swinstall_stack_save_seconds_bucket{le="0.001"} 0')
+        self.assertEqual(lines[-3:], ['swinstall_stack_save_seconds_bucket{le="+Inf"} 1',
+                                      "swinstall_stack_save_seconds_count 1",
+                                      "swinstall_stack_save_seconds_sum 0.2"])
+        self.assertEqual(registry.samples(), {})
+
+    def test_flush_merges_processes(self):
+        first, second = Metrics(self.textfile), Metrics(self.textfile)
+        first.increment(PARSES)
+        second.increment(PARSES, value=2)
+        second.increment(CONFLICTS, (("outcome", "retried"),))
+        first.flush()
+        second.flush()
+        first.increment(PARSES)
+        first.flush()
+        samples = metrics._read_textfile(self.textfile)
+        self.assertEqual(samples, {"swinstall_stack_parses_total": 4,
+                                   'swinstall_stack_conflicts_total{outcome="retried"}': 1})
+
+    def test_flush_failure_keeps_samples(self):
+        registry = Metrics(os.path.join(self.tmpdir, "missing", "swinstall_stack.prom"))
+        registry.increment(PARSES)
+        registry.flush()
+        self.assertEqual(registry.samples(), {"swinstall_stack_parses_total": 1})
+
+    def test_pool_workers(self):
+        registry, metrics.METRICS = metrics.METRICS, Metrics(self.textfile, flush_interval=3600)
+        try:
+            # recorded before the workers fork, and flushed by this process only
+            metrics.increment(PARSES)
+            pool = multiprocessing.Pool(2)
+            try:
+                self.assertEqual(pool.map(lookup_worker, range(4)), range(4))
+            finally:
+                # terminated workers do not run atexit handlers
+                pool.terminate()
+                pool.join()
+            metrics.METRICS.flush()
+        finally:
+            metrics.METRICS = registry
+        self.assertEqual(metrics._read_textfile(self.textfile),
+                         {"swinstall_stack_parses_total": 1,
+                          'swinstall_stack_lookups_total{method="worker"}': 4})
+
+    def test_from_environment(self):
+        self.assertIsNone(Metrics.from_environment({}).textfile)
+        registry = Metrics.from_environment({"SWINSTALL_STACK_METRICS_TEXTFILE": self.textfile,
+                                             "SWINSTALL_STACK_METRICS_INTERVAL": "2"})
+        self.assertEqual((registry.textfile, registry.flush_interval), (self.textfile, 2.0))
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(fullpath)
+        self.schemas = os.path.join(fullpath, "packages.xml_swinstall_stack")
+        with open(self.schemas, 'w') as fh:
+            fh.write(STACK.format(self.schemas))
+        self.registry = metrics.METRICS
+        metrics.METRICS = Metrics()
+
+    def tearDown(self):
+        metrics.METRICS = self.registry
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_and_lookups(self):
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        schema.version(1)
+        schema.version(2)
+        SwinstallStackMgr().parse_columns(self.versionless_file).version(1)
+        samples = metrics.METRICS.samples()
+        self.assertEqual(samples['swinstall_stack_parses_total{reader="tree",schema="2"}'], 1)
+        self.assertEqual(samples['swinstall_stack_parses_total{reader="columnar",schema="2"}'], 1)
+        self.assertEqual(samples['swinstall_stack_parse_seconds_count{reader="tree"}'], 1)
+        self.assertEqual(samples['swinstall_stack_lookups_total{method="version"}'], 3)
+
+    def test_operations_and_conflicts(self):
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        other = SwinstallStackMgr().parse(self.versionless_file)
+        schema.retry_delay = schema.max_retry_delay = 0
+        other.insert_element("123456789", datetime_from_str("20181216-124101"))
+        schema.rollback_element(datetime_from_str("20181216-124102"))
+        samples = metrics.METRICS.samples()
+        self.assertEqual(samples['{}{{operation="install",schema="2"}}'.format(OPERATIONS)], 1)
+        self.assertEqual(samples['{}{{operation="rollback",schema="2"}}'.format(OPERATIONS)], 1)
+        self.assertEqual(samples['{}{{outcome="retried"}}'.format(CONFLICTS)], 1)
+        self.assertEqual(samples['swinstall_stack_save_seconds_count{schema="2"}'], 3)
+
+    def test_failed_conflict(self):
+        schema = SwinstallStackMgr().parse(self.versionless_file)
+        schema.max_retries = 0
+        SwinstallStackMgr().parse(self.versionless_file)\
+            .insert_element("123456789", datetime_from_str("20181216-124101"))
+        with self.assertRaises(ConcurrentModificationError):
+            schema.insert_element("987654321", datetime_from_str("20181216-124102"))
+        samples = metrics.METRICS.samples()
+        self.assertEqual(samples['{}{{outcome="failed"}}'.format(CONFLICTS)], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
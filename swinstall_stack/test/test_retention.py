@@ -0,0 +1,153 @@
+#initialize testing environment
+import env
+# library imports
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.fsck import check_stack
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.retention import COLLECTED_UNTIL, RetentionPolicy, collect_stack, gc, plan
+from swinstall_stack.schemas import import_schemas
+
+import_schemas()
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="rollback" datetime="20180710-000000" hash="4" version="4"/>
+   <elt action="install" datetime="20180706-000000" hash="6" version="6"/>
+   <elt action="install" datetime="20180705-000000" hash="5" version="5"/>
+   <elt action="install" datetime="20180704-000000" hash="4" version="4"/>
+   <elt action="install" datetime="20180703-000000" hash="3" version="3"/>
+   <elt action="install" datetime="20180702-000000" hash="2" version="2"/>
+   <elt action="install" datetime="20180701-000000" hash="1" version="1"/>
+</stack_history>
+'''
+
+STACK1='''<stack_history path="{}">
+    <elt is_current="False" version="20180701-000000" />
+    <elt is_current="False" version="20180702-000000_r12" />
+    <elt is_current="True" version="20180703-000000" />
+    <elt is_current="False" version="20180704-000000" />
+</stack_history>
+'''
+
+NOW = datetime(2018, 7, 10, 12)
+
+def write_stack(root, name, template, versions):
+    bak = os.path.join(root, "bak", name)
+    os.makedirs(bak)
+    path = os.path.join(bak, "{}_swinstall_stack".format(name))
+    with open(path, "w") as fh:
+        fh.write(template.format(path))
+    for version in versions:
+        with open(os.path.join(bak, "{}_{}".format(name, version)), "w") as fh:
+            fh.write(version)
+    return os.path.join(root, name)
+
+class RetentionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.schema2 = write_stack(self.tmpdir, "packages.xml", STACK2, map(str, range(1, 7)))
+        self.schema1 = write_stack(os.path.join(self.tmpdir, "sub"), "tools.xml", STACK1,
+                                   ["20180701-000000", "20180702-000000_r12",
+                                    "20180703-000000", "20180704-000000"])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def versioned(self, swinstalled_file, version):
+        name = os.path.basename(swinstalled_file)
+        return os.path.join(os.path.dirname(swinstalled_file), "bak", name,
+                            "{}_{}".format(name, version))
+
+    def test_plan_keep_last(self):
+        schema = SwinstallStackMgr().parse(self.schema2)
+        collected, until = plan(schema, RetentionPolicy(keep_last=1), NOW)
+        # 4 is current, 3 the target of a rollback, 5 and 6 of a rollforward
+        self.assertEqual([path for path, _ in collected],
+                         [self.versioned(self.schema2, 2), self.versioned(self.schema2, 1)])
+        self.assertEqual(sum(size for _, size in collected), 2)
+        self.assertEqual(until, datetime(2018, 7, 2))
+
+    def test_plan_keep_days(self):
+        schema = SwinstallStackMgr().parse(self.schema2)
+        collected, _ = plan(schema, RetentionPolicy(keep_days=9.4), NOW)
+        self.assertEqual([path for path, _ in collected], [self.versioned(self.schema2, 1)])
+        collected, _ = plan(schema, RetentionPolicy(keep_last=6, keep_days=1), NOW)
+        self.assertEqual(collected, [])
+
+    def test_dry_run(self):
+        collection = collect_stack(self.schema2, RetentionPolicy(keep_last=1), dry_run=True,
+                                   now=NOW)
+        self.assertEqual((len(collection.paths), collection.size), (2, 2))
+        self.assertTrue(all(os.path.exists(path) for path in collection.paths))
+        schema = SwinstallStackMgr().parse(self.schema2)
+        self.assertIsNone(schema.root.attrib.get(COLLECTED_UNTIL))
+
+    def test_collect(self):
+        collection = collect_stack(self.schema2, RetentionPolicy(keep_last=1), now=NOW)
+        self.assertEqual(len(collection.paths), 2)
+        self.assertFalse(any(os.path.exists(path) for path in collection.paths))
+        self.assertTrue(os.path.exists(self.versioned(self.schema2, 3)))
+        schema = SwinstallStackMgr().parse(self.schema2)
+        self.assertEqual(schema.root.attrib.get(COLLECTED_UNTIL), "20180702-000000")
+        self.assertEqual(len(schema.root), 7)
+        self.assertEqual(check_stack(self.schema2, verify_hashes=False), [])
+        # removing a file which was not collected is still reported
+        os.remove(self.versioned(self.schema2, 3))
+        self.assertEqual(len(check_stack(self.schema2, verify_hashes=False)), 1)
+
+        self.assertEqual(collect_stack(self.schema2, RetentionPolicy(keep_last=1), now=NOW).paths,
+                         [])
+
+    def test_collect_schema1(self):
+        collection = collect_stack(self.schema1, RetentionPolicy(keep_last=1), now=NOW)
+        # 20180702 is the target of a rollback from the current entry
+        self.assertEqual(collection.paths, [self.versioned(self.schema1, "20180701-000000")])
+        self.assertEqual(check_stack(self.schema1, verify_hashes=False), [])
+
+    def test_rollback_after_collect(self):
+        collect_stack(self.schema2, RetentionPolicy(keep_last=1), now=NOW)
+        schema = SwinstallStackMgr().parse(self.schema2)
+        # 4 is current. 2 and 1 were collected
+        with self.assertRaises(LookupError):
+            schema.rollback_element(datetime(2018, 7, 11), count=3)
+        with self.assertRaises(LookupError):
+            schema.rollback_to(2, datetime(2018, 7, 11))
+        self.assertEqual(schema.current_version(), 4)
+        schema.rollback_element(datetime(2018, 7, 11), count=1)
+        self.assertEqual(SwinstallStackMgr().parse(self.schema2).current_version(), 3)
+
+        collect_stack(self.schema1, RetentionPolicy(keep_last=1), now=NOW)
+        schema = SwinstallStackMgr().parse(self.schema1)
+        with self.assertRaises(LookupError):
+            schema.rollback_element(count=2)
+        with self.assertRaises(LookupError):
+            schema.rollback_to("20180701-000000")
+        schema.rollback_element()
+        self.assertEqual(SwinstallStackMgr().parse(self.schema1).current_version(),
+                         datetime(2018, 7, 2))
+
+    def test_gc(self):
+        for processes in (1, 2):
+            collections = sorted(gc(self.tmpdir, RetentionPolicy(keep_last=1), processes,
+                                    dry_run=True, now=NOW))
+            self.assertEqual([len(collection.paths) for collection in collections], [2, 1])
+        collections = list(gc(self.tmpdir, RetentionPolicy(keep_last=1), 1, rate_limit=1000,
+                              now=NOW))
+        self.assertEqual(sum(collection.size for collection in collections), 17)
+        self.assertEqual([collection.paths for collection in gc(self.tmpdir,
+                                                                 RetentionPolicy(keep_last=1), 1,
+                                                                 now=NOW)],
+                         [[], []])
+
+    def test_policy_requires_rule(self):
+        with self.assertRaises(ValueError):
+            RetentionPolicy()
+
+
+if __name__ == '__main__':
+    unittest.main()
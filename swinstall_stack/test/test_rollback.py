@@ -0,0 +1,125 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK1='''<stack_history path="{}">
+    <elt is_current="False" version="20161213-093146_r575055" />
+    <elt is_current="False" version="20181102-144204" />
+    <elt is_current="False" version="20181105-103813" />
+    <elt is_current="True" version="20181110-104603" />
+</stack_history>
+'''
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20180801-144204" hash="4a" version="4"/>
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20180101-103813" hash="c94f6266789a483a43" version="2"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+class RollbackTestBase(unittest.TestCase):
+    stack = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.versionless_file = os.path.join(self.tmpdir, "packages.xml")
+        self.fullpath = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(self.fullpath)
+        self.schemas = os.path.join(self.fullpath, "packages.xml_swinstall_stack")
+        with open(self.schemas,'w') as fh:
+            fh.write(self.stack.format(self.schemas))
+        self.schema = SwinstallStackMgr().parse(self.versionless_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self):
+        return SwinstallStackMgr().parse(self.versionless_file)
+
+
+class Schema1RollbackTest(RollbackTestBase):
+    stack = STACK1
+
+    def test_rollback_count(self):
+        self.schema.rollback_element(count=2)
+        self.assertEqual(self.parse().current_version(), datetime_from_str("20181102-144204"))
+
+    def test_rollback_count_too_far(self):
+        with self.assertRaises(IndexError):
+            self.schema.rollback_element(count=4)
+        self.assertEqual(self.parse().current_version(), datetime_from_str("20181110-104603"))
+
+    def test_rollback_to(self):
+        self.schema.rollback_to("20161213-093146")
+        self.assertEqual(self.parse().current_version(), datetime_from_str("20161213-093146"))
+
+    def test_rollback_to_nomatch(self):
+        with self.assertRaises(KeyError):
+            self.schema.rollback_to("20181110-104603")
+
+    def test_rollforward(self):
+        self.schema.rollback_element(count=3)
+        self.schema.rollforward_element(count=2)
+        self.assertEqual(self.parse().current_version(), datetime_from_str("20181105-103813"))
+        with self.assertRaises(IndexError):
+            self.schema.rollforward_element(count=2)
+
+
+class Schema2RollbackTest(RollbackTestBase):
+    stack = STACK2
+
+    def test_rollback_count(self):
+        self.schema.rollback_element(count=2)
+
+        schema = self.parse()
+        self.assertEqual(schema.current_version(), 2)
+        self.assertEqual(len(schema.root), 5)
+        self.assertEqual(schema.current().hash, "c94f6266789a483a43")
+
+    def test_rollback_count_too_far(self):
+        with self.assertRaises(KeyError):
+            self.schema.rollback_element(count=4)
+
+    def test_rollback_invalid_count(self):
+        with self.assertRaises(ValueError):
+            self.schema.rollback_element(count=0)
+
+    def test_rollback_to(self):
+        self.schema.rollback_to(1)
+        self.assertEqual(self.parse().current_version(), 1)
+
+    def test_rollback_to_newer(self):
+        with self.assertRaises(ValueError):
+            self.schema.rollback_to(4)
+
+    def test_rollforward(self):
+        self.schema.rollback_to(1)
+        self.schema.rollforward_element(count=2)
+
+        schema = self.parse()
+        self.assertEqual(schema.current_version(), 3)
+        self.assertEqual(schema.current().action, "rollforward")
+        self.assertEqual(schema.next_version(), 5)
+
+    def test_rollforward_past_latest(self):
+        with self.assertRaises(IndexError):
+            self.schema.rollforward_element()
+        self.schema.rollback_element()
+        with self.assertRaises(IndexError):
+            self.schema.rollforward_element(count=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
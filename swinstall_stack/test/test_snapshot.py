@@ -0,0 +1,133 @@
+#initialize testing environment
+import env
+# library imports
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+# local imports
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.snapshot import Snapshot, publish
+from swinstall_stack.utils import datetime_from_str
+
+import_schemas()
+
+STACK1='''<stack_history path="{}">
+    <elt is_current="False" version="20161213-093146_r575055" />
+    <elt is_current="False" version="20181102-144204" />
+    <elt is_current="True" version="20181105-103813" />
+    <elt is_current="False" version="20181110-104603" />
+</stack_history>
+'''
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="rollback" datetime="20181221-150000" hash="5c8fdabe2ae7fa9287c0672b88ef6593" version="4"/>
+   <elt action="install" datetime="20181221-142313" hash="c618755af9b63728411bc536d2c60cf2" version="5"/>
+   <elt action="install" datetime="20181221-142248" hash="5c8fdabe2ae7fa9287c0672b88ef6593" version="4"/>
+   <elt action="install" datetime="20180702-144204" hash="194f835569a79ba433" version="3"/>
+   <elt action="install" datetime="20171106-104603" hash="294fc86579b14b7d39" version="1"/>
+</stack_history>
+'''
+
+DATES = ("20000101-000000", "20161213-093146", "20180101-000000", "20181103-000000",
+         "20181110-104603", "20181221-142248", "20181221-145959", "20181221-150000",
+         "20300101-000000")
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "snapshot")
+        self.files = [self.make_stack("packages.xml", STACK1),
+                      self.make_stack("config.yaml", STACK2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_stack(self, name, stack):
+        fullpath = os.path.join(self.tmpdir, "bak", name)
+        os.makedirs(fullpath)
+        schemas = os.path.join(fullpath, "{}_swinstall_stack".format(name))
+        with open(schemas, 'w') as fh:
+            fh.write(stack.format(schemas))
+        return os.path.join(self.tmpdir, name)
+
+    def test_matches_schemas(self):
+        publish(self.files, self.path, processes=1)
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 2)
+            self.assertEqual(list(snapshot.paths()), sorted(self.files))
+            for swinstalled_file in self.files:
+                schema = SwinstallStackMgr().parse(swinstalled_file)
+                self.assertEqual(snapshot.current(swinstalled_file), schema.current().path)
+                for date in DATES:
+                    try:
+                        expected = schema.file_on(datetime_from_str(date)).path
+                    except LookupError:
+                        with self.assertRaises(LookupError):
+                            snapshot.file_on(swinstalled_file, date)
+                    else:
+                        self.assertEqual(snapshot.file_on(swinstalled_file, date), expected)
+
+    def test_unknown(self):
+        publish(self.files, self.path, processes=1)
+        snapshot = Snapshot(self.path)
+        missing = os.path.join(self.tmpdir, "missing.txt")
+        self.assertFalse(missing in snapshot)
+        with self.assertRaises(KeyError):
+            snapshot.current(missing)
+
+    def test_skips_unreadable(self):
+        missing = os.path.join(self.tmpdir, "missing.txt")
+        publish(self.files + [missing], self.path, processes=2)
+        self.assertEqual(len(Snapshot(self.path)), 2)
+
+    def test_generation(self):
+        self.assertEqual(publish(self.files[:1], self.path, processes=1), 1)
+        snapshot = Snapshot(self.path)
+        self.assertFalse(snapshot.stale())
+
+        self.assertEqual(publish(self.files, self.path, processes=1), 2)
+        self.assertTrue(snapshot.stale())
+        self.assertEqual(len(snapshot), 1)
+        self.assertTrue(snapshot.refresh())
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual(len(snapshot), 2)
+        self.assertFalse(snapshot.refresh())
+
+    def test_concurrent_publishers(self):
+        generations = []
+        def publisher():
+            for _ in range(5):
+                generations.append(publish(self.files, self.path, processes=1))
+        threads = [threading.Thread(target=publisher) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # every publish read the generation of the one before it
+        self.assertEqual(sorted(generations), range(1, 21))
+        self.assertEqual(Snapshot(self.path).generation, 20)
+
+    def test_changed(self):
+        publish(self.files, self.path, processes=1)
+        snapshot = Snapshot(self.path)
+        self.assertFalse(snapshot.changed(self.files[1]))
+
+        schema = SwinstallStackMgr().parse(self.files[1])
+        schema.insert_element("123456789", datetime_from_str("20190101-000000"))
+
+        self.assertTrue(snapshot.changed(self.files[1]))
+        self.assertFalse(snapshot.changed(self.files[0]))
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "w") as fh:
+            fh.write("not a snapshot")
+        with self.assertRaises(ValueError):
+            Snapshot(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#initialize testing environment
+import env
+# library imports
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+# local imports
+from swinstall_stack import timeline
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.timeline import Timeline, TimelineEvent, build, default_timeline_path
+
+import_schemas()
+
+STACK1='''<stack_history path="{}">
+    <elt is_current="False" version="20180701-000000" />
+    <elt is_current="True" version="20180703-000000_r12" />
+    <elt is_current="False" version="20180705-000000" />
+</stack_history>
+'''
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="rollback" datetime="20180706-000000" hash="1" version="1"/>
+   <elt action="install" datetime="20180704-000000" hash="3" version="3"/>
+   <elt action="install" datetime="20180702-000000" hash="2" version="2"/>
+   <elt action="install" datetime="20180701-000000" hash="1" version="1"/>
+</stack_history>
+'''
+
+TIMES = ("20180630-000000", "20180701-000000", "20180702-120000", "20180703-000000",
+         "20180704-000000", "20180705-000000", "20180706-000000", "20180801-000000")
+
+def write_stack(root, name, template):
+    bak = os.path.join(root, "bak", name)
+    os.makedirs(bak)
+    path = os.path.join(bak, "{}_swinstall_stack".format(name))
+    with open(path, "w") as fh:
+        fh.write(template.format(path))
+    return os.path.join(root, name)
+
+class TimelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.schema1 = write_stack(self.tmpdir, "tools.xml", STACK1)
+        self.schema2 = write_stack(os.path.join(self.tmpdir, "sub"), "packages.xml", STACK2)
+        self.path = default_timeline_path(self.tmpdir)
+        self.interval = timeline.CHECKPOINT_INTERVAL
+        # checkpoint every couple of events
+        timeline.CHECKPOINT_INTERVAL = 2
+
+    def tearDown(self):
+        timeline.CHECKPOINT_INTERVAL = self.interval
+        shutil.rmtree(self.tmpdir)
+
+    def file_on(self, swinstalled_file, date_time):
+        try:
+            return SwinstallStackMgr().parse(swinstalled_file).file_on(date_time).path
+        except LookupError:
+            return None
+
+    def assertMatchesStacks(self, index):
+        for date_time in TIMES:
+            state = index.state_at(date_time)
+            for swinstalled_file in (self.schema1, self.schema2):
+                self.assertEqual(state.get(swinstalled_file),
+                                 self.file_on(swinstalled_file, date_time), date_time)
+
+    def test_state_at(self):
+        self.assertEqual(build(self.tmpdir, processes=1), (2, 2))
+        with Timeline(self.path) as index:
+            self.assertEqual(len(index), 6)
+            self.assertEqual(index.interval, 2)
+            self.assertEqual(sorted(index.paths()), sorted([self.schema1, self.schema2]))
+            self.assertMatchesStacks(index)
+            self.assertEqual(len(index.state_at("20180702-120000")), 2)
+            # schema 1 entries past the current one are ignored
+            self.assertTrue(index.state_at("20180801-000000")[self.schema1]\
+                            .endswith("tools.xml_20180703-000000_r12"))
+            self.assertEqual(index.state_at(datetime(2018, 6, 30)), {})
+
+    def test_events(self):
+        build(self.tmpdir, processes=1)
+        with Timeline(self.path) as index:
+            events = list(index.events("20180701-000000", "20180703-000000"))
+            self.assertEqual(events[0], TimelineEvent("20180701-000000", self.schema2, "1",
+                                                      "install"))
+            self.assertEqual([event.datetime for event in events],
+                             ["20180701-000000", "20180701-000000", "20180702-000000",
+                              "20180703-000000"])
+            self.assertEqual(list(index.events())[-1],
+                             TimelineEvent("20180706-000000", self.schema2, "1", "rollback"))
+
+    def test_incremental(self):
+        build(self.tmpdir, processes=1)
+        self.assertEqual(build(self.tmpdir, processes=1), (2, 0))
+
+        schema = SwinstallStackMgr().parse(self.schema2)
+        schema.insert_element("4", datetime(2018, 7, 10), "r4")
+        other = write_stack(os.path.join(self.tmpdir, "other"), "new.xml", STACK2)
+        self.assertEqual(build(self.tmpdir, processes=2), (3, 2))
+        with Timeline(self.path) as index:
+            self.assertEqual(len(index), 11)
+            self.assertTrue(index.state_at("20180801-000000")[self.schema2]\
+                            .endswith("packages.xml_4"))
+            self.assertMatchesStacks(index)
+
+        shutil.rmtree(os.path.dirname(other))
+        self.assertEqual(build(self.tmpdir, processes=1), (2, 0))
+        with Timeline(self.path) as index:
+            self.assertEqual(len(index), 7)
+
+    def test_not_a_timeline(self):
+        with open(self.path, "w") as fh:
+            fh.write("garbage")
+        with self.assertRaises(ValueError):
+            Timeline(self.path)
+        # an unreadable index is rebuilt from scratch
+        self.assertEqual(build(self.tmpdir, processes=1), (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,6 +26,30 @@ class UtilsTest(unittest.TestCase):
         expected = "20180811-221113"
         self.assertEqual(datetime_to_str(dt), expected)
 
+    def test_rate_limiter(self):
+        import time
+        limiter = RateLimiter(1000)
+        start = time.time()
+        for _ in range(5):
+            limiter(10)
+        # the first call is free, the following four wait 10ms each
+        self.assertTrue(time.time() - start >= 0.035)
+
+    def test_pool_worker(self):
+        def fail(args):
+            raise ValueError("unreadable")
+        worker = pool_worker("test", lambda swinstalled_file, err: (swinstalled_file, str(err)))(fail)
+        self.assertEqual(worker(("/tmp/a.xml", 1)), ("/tmp/a.xml", "unreadable"))
+        self.assertEqual(worker("/tmp/b.xml"), ("/tmp/b.xml", "unreadable"))
+        self.assertIsNone(pool_worker("test")(fail)("/tmp/c.xml"))
+        self.assertEqual(pool_worker("test")(lambda args: args)("/tmp/d.xml"), "/tmp/d.xml")
+
+    def test_worker_throttle(self):
+        init_worker_throttle(1000)
+        self.assertIsInstance(worker_throttle(), RateLimiter)
+        init_worker_throttle(None)
+        self.assertIsNone(worker_throttle())
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,135 @@
+#initialize testing environment
+import env
+# library imports
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+# local imports
+from swinstall_stack.manager import SwinstallStackMgr
+from swinstall_stack.schemas import import_schemas
+from swinstall_stack.writebehind import WriteBehind, WriteBehindError
+
+import_schemas()
+
+STACK2='''<?xml version="1.0" encoding="UTF-8"?>
+<stack_history path="{}" schema="2">
+   <elt action="install" datetime="20180702-000000" hash="2" version="2"/>
+   <elt action="install" datetime="20180701-000000" hash="1" version="1"/>
+</stack_history>
+'''
+
+class WriteBehindTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        bak = os.path.join(self.tmpdir, "bak", "packages.xml")
+        os.makedirs(bak)
+        with open(os.path.join(bak, "packages.xml_swinstall_stack"), "w") as fh:
+            fh.write(STACK2.format(os.path.join(bak, "packages.xml_swinstall_stack")))
+        self.swinstalled_file = os.path.join(self.tmpdir, "packages.xml")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self):
+        return SwinstallStackMgr().parse(self.swinstalled_file)
+
+    def test_flush(self):
+        with WriteBehind(self.parse(), interval=60) as stack:
+            for index in range(5):
+                stack.insert_element(str(index + 3), datetime(2018, 7, 3 + index))
+            # visible through the instance, but not yet saved
+            self.assertEqual(stack.current_version(), 7)
+            self.assertEqual(len(stack), 5)
+            self.assertEqual(self.parse().current_version(), 2)
+            stack.flush()
+            self.assertEqual(len(stack), 0)
+            on_disk = self.parse()
+            self.assertEqual(on_disk.current_version(), 7)
+            # the modifications were saved together
+            self.assertEqual(on_disk.generation, 1)
+
+    def test_close(self):
+        stack = WriteBehind(self.parse(), interval=60)
+        stack.rollback_element(datetime(2018, 7, 3))
+        stack.close()
+        self.assertEqual(self.parse().current_version(), 1)
+        with self.assertRaises(ValueError):
+            stack.rollforward_element(datetime(2018, 7, 4))
+
+    def test_batch_size(self):
+        with WriteBehind(self.parse(), interval=60, batch_size=2) as stack:
+            stack.insert_element("3", datetime(2018, 7, 3))
+            stack.insert_element("4", datetime(2018, 7, 4))
+            deadline = time.time() + 5
+            while len(stack) and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.parse().current_version(), 4)
+
+    def test_interval(self):
+        with WriteBehind(self.parse(), interval=0.05) as stack:
+            stack.insert_element("3", datetime(2018, 7, 3))
+            deadline = time.time() + 5
+            while len(stack) and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.parse().current_version(), 3)
+
+    def test_rebase(self):
+        with WriteBehind(self.parse(), interval=60) as stack:
+            stack.insert_element("3", datetime(2018, 7, 3))
+            # another writer saves the stack first
+            self.parse().insert_element("other", datetime(2018, 7, 4))
+            stack.flush()
+        on_disk = self.parse()
+        self.assertEqual(on_disk.current_version(), 4)
+        self.assertEqual(on_disk.version(3).hash, "other")
+        self.assertEqual(on_disk.version(4).hash, "3")
+
+    def test_rebase_resolved_at_queue_time(self):
+        source_file = os.path.join(self.tmpdir, "source")
+        with open(source_file, "w") as fh:
+            fh.write("queued")
+        with WriteBehind(self.parse(), interval=60) as stack:
+            queued = stack.install(source_file).hash
+            stack.rollback_element()
+            queued_at = datetime.now()
+            # entries record whole seconds
+            time.sleep(1.1)
+            with open(source_file, "w") as fh:
+                fh.write("changed")
+            self.parse().insert_element("other", datetime(2018, 7, 4))
+            stack.flush()
+        on_disk = self.parse()
+        # the rebased install records the contents which were installed
+        self.assertEqual(on_disk.version(4).hash, queued)
+        # the rollback keeps the time it was made
+        rollback = list(on_disk.history())[0]
+        self.assertEqual(rollback.action, "rollback")
+        self.assertLessEqual(rollback.datetime, queued_at)
+
+    def test_dropped(self):
+        stack = WriteBehind(self.parse(), interval=60)
+        stack.rollback_to(1, datetime(2018, 7, 3))
+        # another writer rolls back first, so there is nothing newer to roll back from
+        self.parse().rollback_to(1, datetime(2018, 7, 4))
+        with self.assertRaises(WriteBehindError) as context:
+            stack.close()
+        self.assertEqual([name for name, _, _ in context.exception.failures], ["rollback_to"])
+        self.assertEqual(len(list(self.parse().history())), 3)
+
+    def test_invalid(self):
+        with WriteBehind(self.parse(), interval=60) as stack:
+            # errors are raised as the modification is made, and nothing is queued
+            with self.assertRaises(ValueError):
+                stack.rollback_element(count=0)
+            with self.assertRaises(ValueError):
+                stack.modify("compact")
+            with self.assertRaises(TypeError):
+                stack.rollback_element(date=datetime.now())
+            self.assertEqual(len(stack), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
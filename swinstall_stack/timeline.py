@@ -0,0 +1,325 @@
+"""
+timeline.py
+
+Global timeline index of every swinstall_stack under a tree, answering
+"which versioned file of each swinstalled file was current at time T"
+without reading any stack. The index is a single file holding the events
+of every stack, sorted by time, along with checkpoints of the state of the
+tree at regular intervals of the event log, so that the state at T is the
+nearest checkpoint at or before T followed by the events since it. The
+index is rebuilt incrementally: only stacks whose token has changed since
+the previous build are read.
+
+The file consists of a header, a table of stacks sorted by versionless path,
+the table of events, the checkpoints and the strings the tables refer to.
+Each checkpoint holds, for every stack, one more than the index of the
+stack's last event before the checkpoint, or 0.
+"""
+
+from array import array
+from collections import namedtuple
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+from .concurrency import StackToken, atomic_write, stat_token
+from .constants import ACTIONS
+from .export import stack_entries
+from .manager import SwinstallStackMgr
+from .metrics import flushed
+from .utils import (datetime_from_str, epoch_from_datetime, epoch_from_str, epoch_to_str,
+                    find_swinstalled_files, pool_worker)
+
+__all__ = ("Timeline", "TimelineEvent", "build", "default_timeline_path", "versioned_file")
+
+LOG = logging.getLogger(__name__)
+
+TIMELINE_NAME = ".swinstall_stack_timeline"
+
+_MAGIC = "SWTIME01"
+# magic, stack count, event count, checkpoint interval, time built
+_HEADER = struct.Struct("<8sIIId")
+# versionless path offset and length, and the token of the stack when it was read
+_STACK = struct.Struct("<IIQQQ")
+# epoch, stack, version offset and length, action
+_EVENT = struct.Struct("<qIIIB")
+_EPOCH = struct.Struct("<q")
+
+# smallest number of events between checkpoints. The interval is at least the
+# number of stacks, so that the checkpoints are no larger than the events
+CHECKPOINT_INTERVAL = 4096
+
+class TimelineEvent(namedtuple("TimelineEvent", "datetime swinstalled_file version action")):
+    """An entry of a stack, as indexed. datetime is formatted as in the stack,
+    and version is the string naming the versioned file.
+    """
+    __slots__ = ()
+
+
+def default_timeline_path(root):
+    """Return the default path of the timeline index of a tree.
+
+    :param root: directory indexed
+    :type root: str
+
+    :rtype: str
+    """
+    return os.path.join(root, TIMELINE_NAME)
+
+def versioned_file(swinstalled_file, version):
+    """Return the versioned file of a version of a swinstalled file."""
+    dirname, name = os.path.split(swinstalled_file)
+    return os.path.join(dirname, "bak", name, "{}_{}".format(name, version))
+
+@flushed
+@pool_worker("index")
+def _resolve(swinstalled_file):
+    """Read the events of a swinstalled file's stack: the epoch, version and
+    action code of each entry, oldest first. As in a snapshot, schema 1
+    entries past the current one are not part of the timeline.
+
+    :returns: versionless path, token and events, or None if the stack cannot be read
+    :rtype: tuple | None
+    """
+    token = stat_token(SwinstallStackMgr._swinstall_stack_from_file(swinstalled_file))
+    entries = stack_entries(swinstalled_file)
+    if token is None:
+        return None
+    if entries and entries[0].schema == "1":
+        current = [entry.is_current for entry in entries].index(True) \
+                  if any(entry.is_current for entry in entries) else len(entries)
+        entries = entries[current:]
+    events = [(epoch_from_str(entry.datetime), str(entry.version),
+               ACTIONS.index(entry.action) if entry.action in ACTIONS else 0)
+              for entry in reversed(entries)]
+    return (swinstalled_file, token, events)
+
+def _pack(resolved):
+    """Lay out the events of resolved stacks as the contents of an index."""
+    resolved = sorted(resolved)
+    events = []
+    for stack, (_, _, stack_events) in enumerate(resolved):
+        events.extend((epoch, stack, sequence, version, action)
+                      for sequence, (epoch, version, action) in enumerate(stack_events))
+    events.sort()
+    interval = max(CHECKPOINT_INTERVAL, len(resolved))
+    checkpoints = len(events) // interval
+
+    strings = []
+    offsets = {}
+    position = [_HEADER.size + len(resolved) * _STACK.size + len(events) * _EVENT.size
+                + checkpoints * len(resolved) * 4]
+
+    def string(value):
+        if value not in offsets:
+            offsets[value] = position[0]
+            position[0] += len(value)
+            strings.append(value)
+        return (offsets[value], len(value))
+
+    stacks = [_STACK.pack(*(string(swinstalled_file) + tuple(token)))
+              for swinstalled_file, token, _ in resolved]
+    packed = []
+    checkpoint_data = []
+    state = array("I", [0] * len(resolved))
+    for index, (epoch, stack, _, version, action) in enumerate(events):
+        if index and index % interval == 0:
+            checkpoint_data.append(state.tostring())
+        packed.append(_EVENT.pack(epoch, stack, *(string(version) + (action,))))
+        state[stack] = index + 1
+    if checkpoints and len(events) % interval == 0:
+        checkpoint_data.append(state.tostring())
+    return "".join([_HEADER.pack(_MAGIC, len(stacks), len(events), interval, time.time())]
+                   + stacks + packed + checkpoint_data + strings)
+
+def build(root, path=None, processes=None):
+    """Build or update the timeline index of the stacks under root. Stacks whose
+    token is unchanged since the index at path was built are not read again.
+    The index is replaced atomically.
+
+    :param root: directory to index
+    :type root: str
+    :param path: path of the index. Defaults to default_timeline_path(root)
+    :type path: str | None
+    :param processes: number of worker processes reading stacks. Defaults to
+                      the number of cpus. A value of 1 reads stacks in the
+                      calling process.
+    :type processes: int | None
+
+    :returns: number of stacks indexed, and the number of them which were read
+    :rtype: tuple(int, int)
+    """
+    path = path or default_timeline_path(root)
+    previous = {}
+    try:
+        with Timeline(path) as timeline:
+            previous = timeline._stack_events()
+    except (IOError, ValueError):
+        pass
+
+    resolved = []
+    changed = []
+    for swinstalled_file in find_swinstalled_files(root):
+        token = stat_token(SwinstallStackMgr._swinstall_stack_from_file(swinstalled_file))
+        known = previous.get(swinstalled_file)
+        if known is not None and token is not None and known[0] == token:
+            resolved.append((swinstalled_file, known[0], known[1]))
+        else:
+            changed.append(swinstalled_file)
+    if processes == 1 or len(changed) < 2:
+        read = [_resolve(swinstalled_file) for swinstalled_file in changed]
+    else:
+        pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+        try:
+            read = pool.map(_resolve, changed)
+        finally:
+            pool.terminate()
+            pool.join()
+    resolved.extend(stack for stack in read if stack is not None)
+    atomic_write(path, _pack(resolved))
+    LOG.debug("indexed %s stacks under %s, %s read", len(resolved), root, len(changed))
+    return (len(resolved), len(changed))
+
+
+class Timeline(object):
+    """Read only view of a timeline index, answered from the memory mapped file.
+    """
+    def __init__(self, path):
+        """Open a timeline index.
+
+        :param path: path of the index
+        :type path: str
+
+        :raises: IOError if there is no index at path
+        :raises: ValueError if the file at path is not a timeline index
+        """
+        self.path = path
+        with open(path, "rb") as filehandle:
+            self._map = mmap.mmap(filehandle.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map.size() < _HEADER.size or self._map[:len(_MAGIC)] != _MAGIC:
+            self.close()
+            raise ValueError("{} is not a swinstall_stack timeline".format(path))
+        _, self._stacks, self._events, self.interval, built = _HEADER.unpack_from(self._map)
+        self.built = built
+        self._events_start = _HEADER.size + self._stacks * _STACK.size
+        self._checkpoints_start = self._events_start + self._events * _EVENT.size
+
+    def __repr__(self):
+        return "Timeline <path:{} stacks:{} events:{}>".format(self.path, self._stacks,
+                                                               self._events)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._events
+
+    def close(self):
+        """Close the index."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _string(self, offset, length):
+        return self._map[offset:offset + length]
+
+    def _stack(self, index):
+        return _STACK.unpack_from(self._map, _HEADER.size + index * _STACK.size)
+
+    def _event(self, index):
+        return _EVENT.unpack_from(self._map, self._events_start + index * _EVENT.size)
+
+    def paths(self):
+        """Generate the versionless paths of the indexed stacks, sorted."""
+        for index in xrange(self._stacks):
+            record = self._stack(index)
+            yield self._string(record[0], record[1])
+
+    def _stack_events(self):
+        """Return the token and events of each stack, by versionless path, as
+        returned by _resolve."""
+        paths = list(self.paths())
+        stacks = dict((path, (StackToken(*self._stack(index)[2:]), []))
+                      for index, path in enumerate(paths))
+        for index in xrange(self._events):
+            epoch, stack, offset, length, action = self._event(index)
+            stacks[paths[stack]][1].append((epoch, self._string(offset, length), action))
+        return stacks
+
+    def _position(self, epoch):
+        """Return the number of events at or before epoch, by binary search."""
+        low, high = 0, self._events
+        while low < high:
+            mid = (low + high) // 2
+            if _EPOCH.unpack_from(self._map, self._events_start + mid * _EVENT.size)[0] <= epoch:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _state(self, position):
+        """Return, for each stack, one more than the index of its last event among
+        the first position events, or 0."""
+        checkpoint = position // self.interval
+        if checkpoint:
+            start = self._checkpoints_start + (checkpoint - 1) * self._stacks * 4
+            state = array("I")
+            state.fromstring(self._map[start:start + self._stacks * 4])
+        else:
+            state = array("I", [0] * self._stacks)
+        for index in xrange(checkpoint * self.interval, position):
+            state[self._event(index)[1]] = index + 1
+        return state
+
+    def state_at(self, date_time):
+        """Return the versioned file of each swinstalled file that was current at
+        a time. Swinstalled files installed after date_time are absent.
+
+        :param date_time: time of interest
+        :type date_time: datetime | str
+
+        :returns: full path to the versioned file, by versionless path
+        :rtype: dict(str, str)
+        """
+        date_time = datetime_from_str(date_time) if isinstance(date_time, basestring) else date_time
+        state = self._state(self._position(epoch_from_datetime(date_time)))
+        files = {}
+        for stack, event in enumerate(state):
+            if event:
+                record = self._stack(stack)
+                swinstalled_file = self._string(record[0], record[1])
+                _, _, offset, length, _ = self._event(event - 1)
+                files[swinstalled_file] = versioned_file(swinstalled_file,
+                                                         self._string(offset, length))
+        return files
+
+    def events(self, start=None, end=None):
+        """Generate the events of every stack between two times, oldest first.
+
+        :param start: earliest time of interest, inclusive. Defaults to the first event
+        :type start: datetime | str | None
+        :param end: latest time of interest, inclusive. Defaults to the last event
+        :type end: datetime | str | None
+
+        :returns: generator of events
+        :rtype: generator(TimelineEvent)
+        """
+        def epoch(date_time):
+            if isinstance(date_time, basestring):
+                date_time = datetime_from_str(date_time)
+            return epoch_from_datetime(date_time)
+        first = 0 if start is None else self._position(epoch(start) - 1)
+        last = self._events if end is None else self._position(epoch(end))
+        paths = {}
+        for index in xrange(first, last):
+            event_epoch, stack, offset, length, action = self._event(index)
+            if stack not in paths:
+                record = self._stack(stack)
+                paths[stack] = self._string(record[0], record[1])
+            yield TimelineEvent(epoch_to_str(event_epoch), paths[stack],
+                                self._string(offset, length), ACTIONS[action])
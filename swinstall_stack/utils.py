@@ -4,11 +4,19 @@ utils.py
 Utility functions for project.
 """
 
+import calendar
 from datetime import datetime
+import functools
 import logging
+import multiprocessing
+import os
+import time
 from .constants import DATETIME_FORMAT
 
-__all__ = ("datetime_from_str", "datetime_revision_from_str", "datetime_to_str")
+__all__ = ("datetime_from_str", "datetime_revision_from_str", "datetime_to_str",
+           "epoch_from_str", "epoch_to_str", "epoch_from_datetime",
+           "bisect_descending", "find_swinstalled_files", "pool_worker", "RateLimiter",
+           "init_worker_throttle", "rate_limited_pool", "worker_throttle")
 
 LOG = logging.getLogger(__name__)
 
@@ -52,3 +60,171 @@ def datetime_to_str(date_time):
 
     return date_time.strftime(DATETIME_FORMAT)
 
+
+def epoch_from_str(datetime_str):
+    """Given a string of the form YYYYMMDD-HHMMSS, return the number of seconds
+    between the epoch and that time, treating it as UTC. This is considerably
+    cheaper than datetime_from_str, and is used when packing stack history
+    into arrays.
+
+    :param datetime_str: string representing a specific date and time
+    :type datetime_str: str
+
+    :returns: seconds since the epoch
+    :rtype: int
+    """
+    return calendar.timegm((int(datetime_str[0:4]), int(datetime_str[4:6]),
+                            int(datetime_str[6:8]), int(datetime_str[9:11]),
+                            int(datetime_str[11:13]), int(datetime_str[13:15])))
+
+def epoch_from_datetime(date_time):
+    """Given a datetime instance, return seconds since the epoch, treating it as UTC.
+
+    :param date_time: the datetime instance
+    :type date_time: datetime
+
+    :returns: seconds since the epoch
+    :rtype: int
+    """
+    return calendar.timegm(date_time.timetuple())
+
+def epoch_to_str(epoch):
+    """Inverse of epoch_from_str.
+
+    :param epoch: seconds since the epoch
+    :type epoch: int
+
+    :returns: datetime string matching constants.DATETIME_FORMAT
+    :rtype: str
+    """
+    return datetime.utcfromtimestamp(epoch).strftime(DATETIME_FORMAT)
+
+def bisect_descending(count, key, target):
+    """Binary search a sequence sorted in descending order, returning the index
+    of the first item whose key is less than or equal to target. Only the
+    O(log count) items probed have their key computed.
+
+    :param count: number of items in the sequence
+    :type count: int
+    :param key: callable returning the key of the item at an index
+    :type key: callable
+    :param target: value to search for
+
+    :returns: index of the first item with key <= target, or count if there is none
+    :rtype: int
+    """
+    low, high = 0, count
+    while low < high:
+        mid = (low + high) // 2
+        if key(mid) <= target:
+            high = mid
+        else:
+            low = mid + 1
+    return low
+
+def find_swinstalled_files(root):
+    """Walk the tree under root, yielding the full path to every versionless
+    swinstalled file which has a swinstall_stack. The bak directories
+    themselves are not descended into.
+
+    :param root: directory to search
+    :type root: str
+
+    :returns: generator of versionless file paths, in sorted order
+    :rtype: generator(str)
+    """
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames.sort()
+        if "bak" not in dirnames:
+            continue
+        dirnames.remove("bak")
+        bak = os.path.join(dirpath, "bak")
+        for name in sorted(os.listdir(bak)):
+            stack = os.path.join(bak, name, "{}_swinstall_stack".format(name))
+            if os.path.isfile(stack):
+                yield os.path.join(dirpath, name)
+
+def pool_worker(action, on_error=None):
+    """Decorate a pool worker whose argument is a swinstalled file, or a tuple
+    starting with one, so that one stack which cannot be handled does not
+    abort the whole pool. The error is logged as a warning and the worker
+    returns on_error(swinstalled_file, err), or None. Workers must still be
+    defined at module level to be picklable.
+
+    :param action: what the worker does to a stack, for the warning
+    :type action: str
+    :param on_error: optional callable building the result of a failed stack
+    :type on_error: callable | None
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(args):
+            try:
+                return function(args)
+            except Exception as err:
+                swinstalled_file = args[0] if isinstance(args, tuple) else args
+                LOG.warning("unable to %s %s: %s", action, swinstalled_file, err)
+                return on_error(swinstalled_file, err) if on_error is not None else None
+        return wrapper
+    return decorator
+
+
+class RateLimiter(object):
+    """Callable which paces a stream of operations so that on average no more
+    than *rate* units (bytes, files...) are consumed per second.
+    """
+    def __init__(self, rate):
+        """
+        :param rate: units per second
+        :type rate: float
+        """
+        self.rate = float(rate)
+        self._available_at = 0.0
+
+    def __call__(self, amount=1):
+        """Account for amount units, sleeping first if the rate has been exceeded.
+
+        :param amount: number of units about to be consumed
+        :type amount: int
+        """
+        now = time.time()
+        start = max(now, self._available_at)
+        self._available_at = start + amount / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+# per process rate limiter of pool workers, set up by init_worker_throttle
+_THROTTLE = None
+
+def init_worker_throttle(rate_limit):
+    """Pool initializer giving each worker process its own RateLimiter, for
+    its share of a rate limit. Call it directly when the work is done in the
+    calling process.
+
+    :param rate_limit: units per second allowed to the process, or None
+    :type rate_limit: float | None
+    """
+    global _THROTTLE
+    _THROTTLE = RateLimiter(rate_limit) if rate_limit else None
+
+def worker_throttle():
+    """Return the RateLimiter set up by init_worker_throttle, or None.
+
+    :rtype: RateLimiter | None
+    """
+    return _THROTTLE
+
+def rate_limited_pool(processes, rate_limit):
+    """Return a pool of worker processes which share a rate limit equally,
+    each reading its share from worker_throttle().
+
+    :param processes: number of worker processes. Defaults to the number of cpus.
+    :type processes: int | None
+    :param rate_limit: units per second shared by the workers, or None
+    :type rate_limit: float | None
+
+    :rtype: multiprocessing.Pool
+    """
+    processes = processes or multiprocessing.cpu_count()
+    per_worker = float(rate_limit) / processes if rate_limit else None
+    return multiprocessing.Pool(processes, init_worker_throttle, (per_worker,))
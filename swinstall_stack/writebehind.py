@@ -0,0 +1,276 @@
+"""
+writebehind.py
+
+Write-behind of modifications to a swinstall_stack, for installers which
+modify the same stack many times a minute. Modifications are applied to the
+stack in memory as they are made, and a background thread saves them
+together, once per interval or once enough have accumulated, so that many
+modifications cost a single save.
+
+Durability: a modification is visible through the instance as soon as it is
+made, and is on disk once a flush which covers it has returned, whether
+flush() was called or the background thread flushed. Modifications which
+have not been flushed are lost if the process dies. If another writer saves
+the stack first, the pending modifications are re-applied on top of its
+save, as by SchemaCommon._commit; a modification which no longer applies is
+dropped, and reported by the next call to flush() or close().
+"""
+
+from datetime import datetime
+import logging
+import threading
+import time
+from .hashing import hash_file
+
+__all__ = ("WriteBehind", "WriteBehindError")
+
+LOG = logging.getLogger(__name__)
+
+# names of the arguments of the modifications, in order. insert_element
+# differs between schemas
+_ARGUMENTS = {"install": ("source_file", "date_time", "revision"),
+              "install_hash": ("hash_str", "date_time", "revision"),
+              "rollback_element": ("date_time", "count"),
+              "rollback_to": ("version", "date_time"),
+              "rollforward_element": ("date_time", "count")}
+_INSERT_ARGUMENTS = {"1": ("date_time", "revision"),
+                     "2": ("hash", "datetime", "revision")}
+
+class WriteBehindError(RuntimeError):
+    """Raised by WriteBehind.flush when modifications failed to be saved. failures
+    holds the name, keyword arguments and error of each modification which was
+    dropped.
+    """
+    def __init__(self, message, failures=()):
+        super(WriteBehindError, self).__init__(message)
+        self.failures = list(failures)
+
+
+def _save_batch(schema, batch, state, failures):
+    """Save a batch of modifications already applied to the schema. Applied
+    through schema._commit, which reloads the stack when another writer has
+    saved it first, in which case the modifications are applied again.
+
+    :param state: dict recording whether the stack has been reloaded
+    :type state: dict
+    :param failures: list receiving the modifications which no longer apply
+    :type failures: list
+    """
+    if state["reloaded"]:
+        del failures[:]
+        schema._deferred = True
+        try:
+            for name, kwargs in batch:
+                try:
+                    getattr(schema, name)(**kwargs)
+                except Exception as err:
+                    failures.append((name, kwargs, err))
+        finally:
+            schema._deferred = False
+    # any further attempt follows a reload
+    state["reloaded"] = True
+    schema._save()
+
+
+class WriteBehind(object):
+    """Queue the modifications of a Schema1 or Schema2 instance and save them
+    in batches from a background thread. Other attributes of the schema are
+    available through the instance, under the same lock as the modifications.
+
+        with WriteBehind(schema, interval=1.0) as stack:
+            stack.insert_element(hash_str, datetime.now())
+            stack.current()
+    """
+    # methods which modify the stack, and may be queued
+    MODIFICATIONS = ("insert_element", "install", "install_hash", "rollback_element",
+                     "rollback_to", "rollforward_element")
+    DEFAULT_INTERVAL = 1.0
+    DEFAULT_BATCH_SIZE = 100
+
+    def __init__(self, schema, interval=DEFAULT_INTERVAL, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param schema: the stack to modify
+        :type schema: Schema1 | Schema2
+        :param interval: longest time in seconds a modification waits to be saved
+        :type interval: float
+        :param batch_size: number of pending modifications which triggers a save
+        :type batch_size: int
+        """
+        self.schema = schema
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._wake = threading.Condition(self._lock)
+        # modifications applied since the last save, and when the oldest was made
+        self._pending = []
+        self._pending_since = None
+        self._failures = []
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="swinstall_stack write-behind")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return "WriteBehind <stack:{} pending:{}>".format(self.schema.swinstall_stack,
+                                                          len(self._pending))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __getattr__(self, name):
+        if name in self.MODIFICATIONS:
+            def modify(*args, **kwargs):
+                return self.modify(name, *args, **kwargs)
+            return modify
+        attr = getattr(self.schema, name)
+        if not callable(attr):
+            return attr
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return locked
+
+    def _resolve(self, name, args, kwargs):
+        """Bind the arguments of a modification by name, resolving those which
+        would otherwise be resolved as it is applied: the time, which defaults
+        to now, and the hash of an installed file. A modification re-applied
+        after a conflict is then the modification which was made.
+
+        :returns: name of the method to apply, and its keyword arguments
+        :rtype: tuple(str, dict)
+
+        :raises: TypeError if the arguments do not match the method
+        """
+        if name == "insert_element":
+            names = _INSERT_ARGUMENTS[self.schema.schema_version]
+        else:
+            names = _ARGUMENTS[name]
+        if len(args) > len(names):
+            raise TypeError("{}() takes at most {} arguments ({} given)"\
+                            .format(name, len(names), len(args)))
+        bound = dict(zip(names, args))
+        for key, value in kwargs.items():
+            if key not in names or key in bound:
+                raise TypeError("{}() got an unexpected or repeated argument '{}'"\
+                                .format(name, key))
+            bound[key] = value
+        time_name = "datetime" if "datetime" in names else "date_time"
+        if bound.get(time_name) is None:
+            bound[time_name] = datetime.now()
+        if name == "install":
+            bound["hash_str"] = hash_file(bound.pop("source_file"))
+            name = "install_hash"
+        return (name, bound)
+
+    def modify(self, name, *args, **kwargs):
+        """Apply a modification to the stack in memory, and queue it to be saved.
+        Errors raised by the modification, such as a rollback past the first
+        entry, are raised here and nothing is queued. The time of the
+        modification, and the hash of an installed file, are resolved here.
+
+        :param name: name of the schema method making the modification
+        :type name: str
+
+        :returns: the result of the method
+
+        :raises: ValueError if name is not a modification, or the instance is closed
+        :raises: AttributeError if the schema has no such method
+        """
+        if name not in self.MODIFICATIONS:
+            raise ValueError("{} is not a modification. Modifications: {}"\
+                             .format(name, self.MODIFICATIONS))
+        with self._lock:
+            if self._closed:
+                raise ValueError("write-behind of {} is closed".format(self.schema.swinstall_stack))
+            # raise AttributeError before hashing, for modifications the schema lacks
+            getattr(self.schema, name)
+            name, kwargs = self._resolve(name, args, kwargs)
+            self.schema._deferred = True
+            try:
+                result = getattr(self.schema, name)(**kwargs)
+            finally:
+                self.schema._deferred = False
+            self._pending.append((name, kwargs))
+            if self._pending_since is None:
+                self._pending_since = time.time()
+                # the background thread waits without a timeout while nothing is pending
+                self._wake.notify()
+            elif len(self._pending) >= self.batch_size:
+                self._wake.notify()
+            return result
+
+    def _flush(self):
+        """Save the pending modifications. Must be called with the lock held."""
+        if not self._pending:
+            return
+        batch = self._pending
+        failures = []
+        try:
+            self.schema._commit(_save_batch, batch, {"reloaded": False}, failures)
+        except Exception as err:
+            # the modifications stay applied in memory and pending, to be
+            # saved by the next flush
+            LOG.warning("unable to save %s modifications to %s: %s", len(batch),
+                        self.schema.swinstall_stack, err)
+            self._error = err
+            return
+        for name, kwargs, err in failures:
+            LOG.warning("dropped %s%s from %s: %s", name, kwargs, self.schema.swinstall_stack, err)
+        self._failures.extend(failures)
+        self._error = None
+        self._pending = []
+        self._pending_since = None
+        LOG.debug("saved %s modifications to %s", len(batch), self.schema.swinstall_stack)
+
+    def flush(self):
+        """Save the pending modifications, returning once they are on disk.
+
+        :raises: WriteBehindError if the modifications could not be saved, or if
+                 any modification has been dropped since the last call
+        """
+        with self._lock:
+            self._flush()
+            error, self._error = self._error, None
+            failures, self._failures = self._failures, []
+        if error is not None:
+            raise WriteBehindError("unable to save {}: {}".format(self.schema.swinstall_stack,
+                                                                  error), failures)
+        if failures:
+            raise WriteBehindError("{} modifications of {} no longer applied and were dropped"\
+                                   .format(len(failures), self.schema.swinstall_stack), failures)
+
+    def _run(self):
+        """Body of the background thread."""
+        with self._lock:
+            while not self._closed:
+                if self._pending_since is None:
+                    self._wake.wait()
+                    continue
+                remaining = self._pending_since + self.interval - time.time()
+                if remaining > 0 and len(self._pending) < self.batch_size:
+                    self._wake.wait(remaining)
+                    continue
+                self._flush()
+                if self._error is not None:
+                    # back off before retrying a failed save
+                    self._pending_since = time.time()
+
+    def close(self):
+        """Stop the background thread and save the pending modifications.
+
+        :raises: WriteBehindError, see flush
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+        self.flush()